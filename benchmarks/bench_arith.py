@@ -0,0 +1,73 @@
+""" compares arithmetic backends of key derivation (see `nkit.security.arith`) per key size
+
+usage: python -m benchmarks.bench_arith [passphrase]
+gmpy2 is left out when it isn't installed, keys of every backend are checked to be the same
+"""
+import sys
+import time
+import random
+
+from nkit.security import pass_rsa, arith, sieve
+
+KEY_LENGTHS = [512, 1024, 2048, 4096]
+
+
+def timed(fn, *args):
+	start = time.perf_counter()
+	result = fn(*args)
+	return result, time.perf_counter() - start
+
+
+def recursive_egcd(a: int, b: int):
+	# what pass_rsa.egcd was, for comparison
+	if a == 0:
+		return (b, 0, 1)
+	g, y, x = recursive_egcd(b % a, a)
+	return (g, x - (b // a) * y, y)
+
+
+def modinv_rate(key_len: int, count: int = 2000) -> float:
+	# inverses per second of random key_len values, like `get_components` does
+	rng = random.Random(key_len)
+	pairs = [(rng.getrandbits(key_len) | 1, rng.getrandbits(key_len) | (1 << key_len)) for _ in range(count)]
+	start = time.perf_counter()
+	for a, m in pairs:
+		try:
+			arith.invert(a, m)
+		except ValueError:
+			pass
+	return count / (time.perf_counter() - start)
+
+
+def main(passphrase: bytes):
+	sieve.small_primes()
+	names = sorted(arith.BACKENDS)
+	previous = arith.backend
+	print(f"{'bits':<6} {'backend':<8} {'key (s)':>9} {'modinv/s':>10}")
+	try:
+		for key_len in KEY_LENGTHS:
+			keys = {}
+			for name in names:
+				arith.use(name)
+				key, seconds = timed(pass_rsa.generate_rsa_key, passphrase, key_len)
+				keys[name] = key.export_key("PEM")
+				print(f"{key_len:<6} {name:<8} {seconds:>9.3f} {modinv_rate(key_len):>10.0f}")
+			assert len(set(keys.values())) == 1, f"backends derived different {key_len} bit keys"
+	finally:
+		arith.use(previous)
+
+	print(f"\n{'bits':<6} {'recursive egcd/s':>17} {'iterative egcd/s':>17}")
+	for key_len in KEY_LENGTHS:
+		rng = random.Random(key_len)
+		pairs = [(rng.getrandbits(key_len), rng.getrandbits(key_len)) for _ in range(500)]
+		try:
+			_, seconds = timed(lambda: [recursive_egcd(a, b) for a, b in pairs])
+			recursive = f"{len(pairs)/seconds:.0f}"
+		except RecursionError:
+			recursive = "RecursionError"
+		_, seconds = timed(lambda: [arith.egcd(a, b) for a, b in pairs])
+		print(f"{key_len:<6} {recursive:>17} {len(pairs)/seconds:>17.0f}")
+
+
+if __name__ == "__main__":
+	main(sys.argv[1].encode("utf-8") if len(sys.argv) > 1 else b"benchmark passphrase")
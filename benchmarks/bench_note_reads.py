@@ -0,0 +1,41 @@
+""" rows/s of reading notes through orm objects + pydantic against core rows (`models.NoteRow`)
+
+usage: python -m benchmarks.bench_note_reads [notes]
+runs against a throwaway database (TESTING=1)
+"""
+import os
+import sys
+import time
+
+os.environ["TESTING"] = "1"
+
+from nkit.storage.local import NoteDb, Note
+from benchmarks.bench_notes_import import make_notes, clear, report
+
+
+def main(count: int):
+	clear()
+	with NoteDb() as db:
+		db.insert_many(make_notes(count))
+
+	with NoteDb() as db:
+		start = time.perf_counter()
+		for db_note in db.db.query(Note).order_by(Note.id).yield_per(5000):
+			db_note.to_pydantic()
+		report("orm + pydantic", count, time.perf_counter() - start)
+
+		start = time.perf_counter()
+		for _ in db.iter_all():
+			pass
+		report("core rows", count, time.perf_counter() - start)
+
+		# what `notes show` pays, timestamp converted when displayed
+		start = time.perf_counter()
+		for note in db.iter_all():
+			note.created_at.format('YYYY-MM-DD HH:mm')
+		report("core rows + display", count, time.perf_counter() - start)
+	clear()
+
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
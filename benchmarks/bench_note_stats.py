@@ -0,0 +1,50 @@
+""" note stats from the notes_daily rollup against grouping notes on every read, at growing numbers of notes
+
+usage: python -m benchmarks.bench_note_stats [notes]
+notes are spread over ten years, the rollup has one row per day and type whatever the number of notes
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+from pathlib import Path
+
+os.environ["TESTING"] = "1"
+
+import arrow
+
+from nkit.models import NoteCreate, NoteType
+from nkit.storage.local import SqliteStorage
+
+MINUTES = 60 * 24 * 3650
+
+
+def fill(storage: SqliteStorage, count: int):
+	rng = random.Random(count)
+	now = arrow.utcnow()
+	with storage.notes() as db:
+		db.insert_many(NoteCreate(ty=rng.choice(list(NoteType)), msg="bench", created_at=now.shift(minutes=-rng.randrange(MINUTES)),
+			draft=False, deadline=None, resources=[], refer_id=None, completed=None) for _ in range(count))
+
+
+def timed_counts(storage: SqliteStorage, rollup: bool) -> float:
+	storage.rollup_enabled = rollup
+	with storage.notes() as db:
+		start = time.perf_counter()
+		db.daily_counts()
+		return time.perf_counter() - start
+
+
+def main(count: int):
+	print(f"{'notes':>8} {'group notes (s)':>16} {'rollup (s)':>11} {'speedup':>9}")
+	with tempfile.TemporaryDirectory() as directory:
+		for size in sorted({min(count, 10_000), min(count, 100_000), count}):
+			storage = SqliteStorage(Path(directory)/f"{size}.db")
+			fill(storage, size)
+			grouped, rolled = timed_counts(storage, False), timed_counts(storage, True)
+			print(f"{size:>8} {grouped:>16.3f} {rolled:>11.4f} {grouped/rolled:>8.0f}x")
+
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
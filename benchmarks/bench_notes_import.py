@@ -0,0 +1,68 @@
+""" rows/s of one-by-one `NoteDb.insert` against `NoteDb.insert_many`, and of export
+
+usage: python -m benchmarks.bench_notes_import [notes]
+runs against a throwaway database (TESTING=1)
+"""
+import io
+import os
+import sys
+import time
+
+os.environ["TESTING"] = "1"
+
+import arrow
+
+from nkit import models, notes_io
+from nkit.storage.local import NoteDb, SessionLocal, Note
+
+
+def make_notes(count: int):
+	now = arrow.utcnow()
+	for i in range(count):
+		yield models.NoteCreate(ty=models.NoteType.update, msg=f"benchmark note {i}", created_at=now.shift(seconds=i),
+			draft=False, deadline=None, resources=[], refer_id=None, completed=None)
+
+
+def clear():
+	db = SessionLocal()
+	db.query(Note).delete()
+	db.commit()
+	db.close()
+
+
+def report(name: str, count: int, seconds: float):
+	print(f"{name:<24} {count:>8} rows {seconds:>8.2f}s {count/seconds:>10.0f} rows/s")
+
+
+def main(count: int):
+	# one commit per note is slow, keep it to a sample
+	sample = min(count, 2000)
+	start = time.perf_counter()
+	with NoteDb() as db:
+		for note in make_notes(sample):
+			db.insert(note)
+	report("insert", sample, time.perf_counter() - start)
+	clear()
+
+	start = time.perf_counter()
+	with NoteDb() as db:
+		db.insert_many(make_notes(count))
+	report("insert_many", count, time.perf_counter() - start)
+
+	for format in notes_io.FORMATS:
+		out = io.StringIO()
+		start = time.perf_counter()
+		with NoteDb() as db:
+			notes_io.write(db.iter_all(), out, format)
+		report(f"export {format}", count, time.perf_counter() - start)
+
+		clear()
+		out.seek(0)
+		start = time.perf_counter()
+		with NoteDb() as db:
+			db.insert_many(notes_io.read(out, format))
+		report(f"import {format}", count, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
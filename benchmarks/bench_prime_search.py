@@ -0,0 +1,32 @@
+""" compares linear and sieve backed prime search used by `generate_rsa_key`
+
+usage: python -m benchmarks.bench_prime_search [passphrase]
+"""
+import sys
+import time
+
+from nkit.security import pass_rsa, sieve
+
+KEY_LENGTHS = [512, 1024, 2048, 4096]
+
+
+def timed(fn, *args):
+	start = time.perf_counter()
+	result = fn(*args)
+	return result, time.perf_counter() - start
+
+
+def main(passphrase: bytes):
+	# small prime table is built once per process, keep it out of the timings
+	sieve.small_primes()
+	print(f"{'bits':<6} {'linear (s)':>12} {'sieve (s)':>12} {'speedup':>8}")
+	for key_len in KEY_LENGTHS:
+		seeds = pass_rsa.get_prime_seeds(passphrase, key_len)
+		linear_primes, linear_time = timed(lambda: [pass_rsa.get_next_prime_linear(seed) for seed in seeds])
+		sieve_primes, sieve_time = timed(lambda: [pass_rsa.get_next_prime(seed) for seed in seeds])
+		assert linear_primes == sieve_primes, "sieve search diverged from linear search"
+		print(f"{key_len:<6} {linear_time:>12.3f} {sieve_time:>12.3f} {linear_time/sieve_time:>7.2f}x")
+
+
+if __name__ == "__main__":
+	main(sys.argv[1].encode("utf-8") if len(sys.argv) > 1 else b"benchmark passphrase")
@@ -0,0 +1,32 @@
+""" rows/s of pushing notes to a remote (`nkit.storage.remote_server` on localhost) by batch concurrency,
+without and with 20ms of simulated latency per request
+
+usage: python -m benchmarks.bench_remote_push [notes]
+"""
+import sys
+import time
+import asyncio as aio
+
+from nkit.storage.remote import RemoteNoteDb
+from nkit.storage.remote_server import running_server
+from benchmarks.bench_notes_import import make_notes, report
+
+
+async def push(url: str, count: int, concurrency: int, batch_size: int) -> int:
+	async with RemoteNoteDb(url, concurrency=concurrency) as db:
+		return await db.insert_many(make_notes(count), batch_size=batch_size)
+
+
+def main(count: int):
+	for delay in [0.0, 0.02]:
+		for concurrency, batch_size in [(1, 1000), (4, 1000), (8, 1000), (8, 5000)]:
+			with running_server() as server:
+				server.delay = delay
+				start = time.perf_counter()
+				assert aio.run(push(server.url, count, concurrency, batch_size)) == count
+				report(f"{delay*1000:.0f}ms {concurrency} x {batch_size}", count, time.perf_counter() - start)
+				print(f"{'':<24} {server.connections:>8} connections")
+
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,61 @@
+""" password change with secrets encrypted straight to password key (every secret re-encrypted)
+against the master key envelope (one record rewrapped), at growing numbers of secrets
+
+usage: python -m benchmarks.bench_rotate_password [secrets]
+key derivation from password costs the same either way and is left out, keys are 2048 bits
+"""
+import os
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+os.environ["TESTING"] = "1"
+
+from Crypto.PublicKey import RSA
+
+from nkit import models, security
+from nkit.security import envelope
+from nkit.storage.local import SqliteStorage, Secret
+
+
+def fill(storage: SqliteStorage, public_key: RSA.RsaKey, count: int):
+	with storage.secrets() as db:
+		db.db.bulk_insert_mappings(Secret, [
+			{"title": f"bench/{i:06}", "data": security.encrypt_large(public_key, os.urandom(32))} for i in range(count)])
+		db.db.commit()
+
+
+def reencrypt_all(storage: SqliteStorage, old_key: RSA.RsaKey, new_key: RSA.RsaKey) -> float:
+	start = time.perf_counter()
+	new_public_key = new_key.publickey()
+	with storage.secrets() as db:
+		db.update_all([models.SecretRow(secret.id, secret.title, security.encrypt_large(new_public_key, security.decrypt_large(old_key, secret.data)))
+			for secret in db.get_secrets("")])
+	return time.perf_counter() - start
+
+
+def rewrap(path: Path, old_key: RSA.RsaKey, new_key: RSA.RsaKey) -> float:
+	start = time.perf_counter()
+	envelope.rotate(path, old_key, new_key, lambda: None)
+	return time.perf_counter() - start
+
+
+def main(count: int):
+	old_key, new_key = RSA.generate(2048), RSA.generate(2048)
+	print(f"{'secrets':>8} {'re-encrypt (s)':>15} {'rewrap (s)':>11} {'speedup':>9}")
+	with tempfile.TemporaryDirectory() as directory:
+		for size in sorted({min(count, 100), min(count, 1000), count}):
+			storage = SqliteStorage(Path(directory)/f"{size}.db")
+			fill(storage, old_key.publickey(), size)
+			reencrypt_time = reencrypt_all(storage, old_key, new_key)
+
+			master_path = Path(directory)/f"{size}.master.key"
+			master_key = envelope.create(master_path, old_key)
+			fill(SqliteStorage(Path(directory)/f"{size}.envelope.db"), master_key.publickey(), size)
+			rewrap_time = rewrap(master_path, old_key, new_key)
+			print(f"{size:>8} {reencrypt_time:>15.3f} {rewrap_time:>11.4f} {reencrypt_time/rewrap_time:>8.0f}x")
+
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
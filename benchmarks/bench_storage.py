@@ -0,0 +1,67 @@
+""" same workload on every storage backend: bulk insert, single inserts, recent pages, full scan, key lookups
+
+usage: python -m benchmarks.bench_storage [notes]
+sqlite backends use a throwaway directory
+"""
+import os
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+os.environ["TESTING"] = "1"
+
+from nkit import models
+from nkit.storage.storage import BACKENDS, create_storage, note_cursor
+from benchmarks.bench_notes_import import make_notes, report
+
+
+def run(name: str, count: int, directory: Path):
+	storage = create_storage(name) if name == "memory" else create_storage(name, path=directory/f"{name}.db")
+	print(name)
+	with storage.notes() as db:
+		start = time.perf_counter()
+		db.insert_many(make_notes(count))
+		report("insert_many", count, time.perf_counter() - start)
+
+		sample = min(count, 1000)
+		start = time.perf_counter()
+		for note in make_notes(sample):
+			db.insert(note)
+		report("insert", sample, time.perf_counter() - start)
+
+		start = time.perf_counter()
+		pages, cursor = 0, None
+		while pages < 100:
+			page = list(db.iter_recent(50, before=cursor))
+			if not page:
+				break
+			cursor = note_cursor(page[0])
+			pages += 1
+		report("iter_recent 50/page", pages * 50, time.perf_counter() - start)
+
+		start = time.perf_counter()
+		scanned = sum(1 for _ in db.iter_all())
+		report("iter_all", scanned, time.perf_counter() - start)
+
+	with storage.secrets() as db:
+		for i in range(sample):
+			db.insert(models.SecretCreate(title=f"bench/{i:05}", data=os.urandom(64)))
+		start = time.perf_counter()
+		for i in range(sample):
+			db.get_secret(f"bench/{i:05}")
+		report("get_secret", sample, time.perf_counter() - start)
+		start = time.perf_counter()
+		for i in range(100):
+			db.titles(prefix=f"bench/00{i % 10}")
+		report("titles prefix", 100, time.perf_counter() - start)
+
+
+def main(count: int):
+	with tempfile.TemporaryDirectory() as directory:
+		for name in BACKENDS:
+			run(name, count, Path(directory))
+
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,101 @@
+""" processes writing and reading notes at the same time, p50/p99 latency of both and failures
+
+usage: python -m benchmarks.stress_concurrent_notes [processes] [writes per process] [direct|agent]
+direct: every process inserts itself, agent: inserts go through an agent's write queue
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+import typing as t
+import multiprocessing as mp
+from pathlib import Path
+
+os.environ["TESTING"] = "1"
+
+import arrow
+
+from nkit import models
+
+
+class Report(t.NamedTuple):
+	writes: t.List[float]
+	reads: t.List[float]
+	errors: t.List[str]
+
+
+def percentile(values: t.List[float], q: float) -> float:
+	ordered = sorted(values)
+	return ordered[int(q * (len(ordered) - 1))] if ordered else 0.0
+
+
+def worker(path: str, socket_path: t.Optional[str], writes: int, worker_id: int) -> Report:
+	from nkit.agent import AgentClient
+	from nkit.storage.local import SqliteStorage
+
+	storage = SqliteStorage(Path(path))
+	report = Report([], [], [])
+	for i in range(writes):
+		note = models.NoteCreate(ty=models.NoteType.update, msg=f"worker {worker_id} note {i}", created_at=arrow.utcnow(),
+			draft=False, deadline=None, resources=[], refer_id=None, completed=None)
+		start = time.perf_counter()
+		try:
+			if socket_path:
+				AgentClient(Path(socket_path)).note(note)
+			else:
+				with storage.notes() as db:
+					db.insert(note)
+		except Exception as e:
+			report.errors.append(str(e))
+		report.writes.append(time.perf_counter() - start)
+
+		start = time.perf_counter()
+		try:
+			with storage.notes() as db:
+				list(db.iter_recent(20))
+		except Exception as e:
+			report.errors.append(str(e))
+		report.reads.append(time.perf_counter() - start)
+	return report
+
+
+def run(path: Path, processes: int, writes: int, agent: bool = False) -> Report:
+	from nkit.agent import Agent, AgentClient
+	from nkit.storage.local import SqliteStorage
+	from nkit.security import generate_rsa_key
+
+	storage = SqliteStorage(path)
+	# schema is created once, like on any machine that ran nkit before
+	storage.engine
+	socket_path = None
+	if agent:
+		socket_path = path.parent/"agent.sock"
+		server = threading.Thread(target=Agent(generate_rsa_key(b"stress", 512), socket_path, storage=storage).run)
+		server.start()
+		while not AgentClient(socket_path).available():
+			time.sleep(0.05)
+	try:
+		with mp.get_context("spawn").Pool(processes) as pool:
+			reports = pool.starmap(worker, [(str(path), socket_path and str(socket_path), writes, i) for i in range(processes)])
+	finally:
+		if agent:
+			AgentClient(socket_path).stop()
+			server.join()
+	return Report([w for r in reports for w in r.writes], [r_ for r in reports for r_ in r.reads], [e for r in reports for e in r.errors])
+
+
+def main(processes: int, writes: int, mode: str):
+	with tempfile.TemporaryDirectory() as directory:
+		start = time.perf_counter()
+		report = run(Path(directory)/"notes.db", processes, writes, agent=mode == "agent")
+		seconds = time.perf_counter() - start
+	print(f"{processes} processes x {writes} writes ({mode}) in {seconds:.2f}s, {len(report.errors)} failed")
+	for name, values in [("write", report.writes), ("read", report.reads)]:
+		print(f"{name:<6} p50 {percentile(values, 0.5)*1000:>8.2f}ms  p99 {percentile(values, 0.99)*1000:>8.2f}ms  max {max(values)*1000:>8.2f}ms")
+	for error in sorted(set(report.errors))[:5]:
+		print(f"  {error}")
+
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 8, int(sys.argv[2]) if len(sys.argv) > 2 else 200, sys.argv[3] if len(sys.argv) > 3 else "direct")
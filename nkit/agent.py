@@ -0,0 +1,224 @@
+""" long lived process holding derived private key, like ssh-agent
+
+protocol is one json object per line over a unix socket, bytes are base64 encoded
+	request:  {"op": "decrypt", "data": "..."}
+	response: {"ok": true, "data": "..."} or {"ok": false, "error": "..."}
+
+it's also the single writer of notes for concurrent `nkit note`s (cron jobs, shell hooks),
+they're queued and committed together instead of each taking the database lock
+"""
+import os
+import json
+import time
+import base64
+import socket
+import asyncio as aio
+import typing as t
+from pathlib import Path
+
+from Crypto.PublicKey import RSA
+
+from . import security, models, notes_io
+from .security import envelope
+from . import constants as c
+from .storage.storage import Storage, get_storage
+from .storage.write_queue import WriteQueue
+from .reminders import Reminders
+from .exceptions import AgentUnavailable, AgentError
+
+# biggest request line agent accepts, encrypted files are sent in one line
+MAX_MESSAGE = 1<<30
+
+Handler = t.Callable[..., t.Awaitable[t.Dict[str, t.Any]]]
+
+
+def encode(data: bytes) -> str:
+	return base64.b64encode(data).decode("ascii")
+
+def decode(data: str) -> bytes:
+	return base64.b64decode(data)
+
+
+class Agent:
+	def __init__(self, private_key: RSA.RsaKey, path: Path, timeout: t.Optional[float] = None, storage: t.Optional[Storage] = None,
+			reminders: bool = False, legacy_key: t.Optional[RSA.RsaKey] = None):
+		self.private_key = private_key
+		# password key from before master keys, content private_key doesn't open is tried with it (`envelope.legacy_key`)
+		self.legacy_key = legacy_key
+		self.path = path
+		self.timeout = timeout
+		self.storage = storage
+		# deadlines of notes are reminded of while agent runs, see `reminders`
+		self.reminders: t.Optional[Reminders] = Reminders(storage or get_storage()) if reminders else None
+		self.started_at = time.time()
+		# repeated decrypts of a secret skip rsa, see `security.DataKeyCache`
+		self.data_keys = security.DataKeyCache(c.DATA_KEY_CACHE_SIZE, c.DATA_KEY_TTL)
+		self.handlers: t.Dict[str, Handler] = {
+			"ping": self.ping,
+			"public_key": self.public_key,
+			"decrypt": self.decrypt,
+			"unwrap": self.unwrap,
+			"note": self.note,
+			"stop": self.stop,
+		}
+
+	def run(self):
+		aio.run(self.serve())
+
+	async def serve(self):
+		loop = aio.get_event_loop()
+		self._stopped = aio.Event()
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		if self.path.exists():
+			# left over from an agent that died, a live one would have been found by the caller
+			self.path.unlink()
+		self.writes = WriteQueue(self.storage or get_storage())
+		# socket is private from the moment it's bound, chmod after bind would leave a window to connect in
+		umask = os.umask(0o077)
+		try:
+			server = await aio.start_unix_server(self._handle, path=str(self.path), limit=MAX_MESSAGE)
+		finally:
+			os.umask(umask)
+		os.chmod(self.path, 0o600)
+		if self.timeout:
+			loop.call_later(self.timeout, self._stopped.set)
+		tasks = [aio.ensure_future(self._expire_data_keys())]
+		if self.reminders is not None:
+			tasks.append(aio.ensure_future(self.reminders.run()))
+		try:
+			await self._stopped.wait()
+		finally:
+			for task in tasks:
+				task.cancel()
+			server.close()
+			await server.wait_closed()
+			await self._in_thread(self.writes.close)
+			if self.path.exists():
+				self.path.unlink()
+			# forget the key as soon as we're done
+			self.private_key = self.legacy_key = None # type: ignore
+			self.data_keys.clear()
+
+	async def _expire_data_keys(self):
+		# expired keys are zeroized even when nobody asks for them again
+		while True:
+			await aio.sleep(min(max(self.data_keys.ttl, 1), 60))
+			self.data_keys.expire()
+
+	async def _handle(self, reader: aio.StreamReader, writer: aio.StreamWriter):
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				response = await self._dispatch(line)
+				writer.write(json.dumps(response).encode("utf-8") + b"\n")
+				await writer.drain()
+		except (ConnectionError, aio.IncompleteReadError, ValueError):
+			# client went away or sent more then MAX_MESSAGE
+			pass
+		finally:
+			writer.close()
+
+	async def _dispatch(self, line: bytes) -> t.Dict[str, t.Any]:
+		try:
+			request = json.loads(line)
+			handler = self.handlers[request.pop("op")]
+		except (ValueError, KeyError, AttributeError):
+			return {"ok": False, "error": "bad request"}
+		try:
+			return {"ok": True, **(await handler(**request))}
+		except Exception as e:
+			return {"ok": False, "error": str(e)}
+
+	async def _in_thread(self, fn, *args):
+		# crypto work is cpu bound, keep the loop free for other clients
+		return await aio.get_event_loop().run_in_executor(None, fn, *args)
+
+	async def ping(self) -> t.Dict[str, t.Any]:
+		remaining = None
+		if self.timeout:
+			remaining = max(0, self.started_at + self.timeout - time.time())
+		return {"pid": os.getpid(), "remaining": remaining}
+
+	def keys(self) -> t.List[RSA.RsaKey]:
+		return [self.private_key] if self.legacy_key is None else [self.private_key, self.legacy_key]
+
+	async def public_key(self) -> t.Dict[str, t.Any]:
+		return {"data": encode(self.private_key.publickey().export_key("PEM"))}
+
+	async def decrypt(self, data: str, key_id: t.Optional[int] = None) -> t.Dict[str, t.Any]:
+		# key_id (secret id) is where unwrapped aes key is cached, without it every decrypt pays for rsa
+		content = decode(data)
+		decrypt = envelope.fallback(security.decrypt_large, self.keys())
+		if key_id is None:
+			decrypted = await self._in_thread(decrypt, content)
+		else:
+			decrypted = await self._in_thread(decrypt, content, self.data_keys, key_id)
+		return {"data": encode(decrypted)}
+
+	async def unwrap(self, data: str) -> t.Dict[str, t.Any]:
+		# only the rsa part, for content streamed by the client
+		unwrapped = await self._in_thread(envelope.fallback(security.decrypt, self.keys()), decode(data))
+		return {"data": encode(unwrapped)}
+
+	async def note(self, **record: t.Any) -> t.Dict[str, t.Any]:
+		# `notes_io.to_record` without id (so it's a NoteCreate, refer_id is kept), saved along with notes of other clients
+		saved = await aio.wrap_future(self.writes.submit(notes_io.from_record(record))) # type: ignore
+		if self.reminders is not None and saved.deadline is not None:
+			self.reminders.add(saved.id, saved.deadline.to("utc").naive)
+		return {"id": saved.id}
+
+	async def stop(self) -> t.Dict[str, t.Any]:
+		self._stopped.set()
+		return {}
+
+
+class AgentClient:
+	def __init__(self, path: Path):
+		self.path = path
+
+	def request(self, op: str, **kwargs) -> t.Dict[str, t.Any]:
+		if not hasattr(socket, "AF_UNIX") or not self.path.exists():
+			raise AgentUnavailable("agent is not running")
+		with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+			try:
+				sock.connect(str(self.path))
+			except OSError as e:
+				raise AgentUnavailable(f"can't connect to agent: {e}")
+			sock.sendall(json.dumps({"op": op, **kwargs}).encode("utf-8") + b"\n")
+			with sock.makefile("rb") as f:
+				line = f.readline()
+		if not line:
+			raise AgentUnavailable("agent closed connection")
+		response = json.loads(line)
+		if not response.pop("ok"):
+			raise AgentError(response["error"])
+		return response
+
+	def available(self) -> bool:
+		try:
+			self.ping()
+		except AgentUnavailable:
+			return False
+		return True
+
+	def ping(self) -> t.Dict[str, t.Any]:
+		return self.request("ping")
+
+	def public_key(self) -> RSA.RsaKey:
+		return RSA.import_key(decode(self.request("public_key")["data"]))
+
+	def decrypt(self, content: bytes, key_id: t.Optional[int] = None) -> bytes:
+		return decode(self.request("decrypt", data=encode(content), key_id=key_id)["data"])
+
+	def unwrap(self, wrapped: bytes) -> bytes:
+		return decode(self.request("unwrap", data=encode(wrapped))["data"])
+
+	def note(self, note: models.NoteCreate) -> int:
+		record = notes_io.to_record(note)
+		record.pop("id")
+		return self.request("note", **record)["id"]
+
+	def stop(self):
+		self.request("stop")
@@ -0,0 +1,80 @@
+import os
+import time
+import typer
+
+from . import constants as c
+from .agent import Agent, AgentClient
+from .exceptions import AgentUnavailable
+from .keys_app import require_init, check_password_and_retry, running_agent, secrets_keys
+
+agent_app = typer.Typer()
+
+
+def detach() -> bool:
+	# True in the forked agent process, False in the one that returns to the shell
+	if os.fork() != 0:
+		return False
+	os.setsid()
+	devnull = os.open(os.devnull, os.O_RDWR)
+	for fd in (0, 1, 2):
+		os.dup2(devnull, fd)
+	return True
+
+
+@agent_app.command("start")
+@require_init
+def start_agent(
+		password: str = typer.Option(..., prompt=True, hide_input=True),
+		timeout: int = typer.Option(3600, help="seconds agent holds the key, 0 holds it until stopped"),
+		foreground: bool = typer.Option(False, "--foreground/--background"),
+		reminders: bool = typer.Option(False, help="remind of note deadlines, see NKIT_REMIND_COMMAND")):
+	if running_agent() is not None:
+		typer.echo("agent is already running. Stop it with `nkit agent stop`")
+		raise typer.Abort()
+
+	private_key = check_password_and_retry(password)
+	if private_key is None:
+		typer.echo("Password Not Correct!!")
+		raise typer.Abort()
+
+	keys = secrets_keys(private_key)
+	agent = Agent(keys[0], c.AGENT_SOCKET, timeout or None, reminders=reminders, legacy_key=keys[1] if len(keys) > 1 else None)
+	if foreground or not hasattr(os, "fork"):
+		typer.echo(f"agent listening on {c.AGENT_SOCKET}")
+		agent.run()
+		return
+
+	if detach():
+		agent.run()
+		os._exit(0)
+
+	# wait for socket so the very next `nkit keys get` finds the agent
+	client = AgentClient(c.AGENT_SOCKET)
+	for _ in range(50):
+		if client.available():
+			typer.echo(f"agent started, holding key for {timeout or 'unlimited'}s")
+			return
+		time.sleep(0.1)
+	typer.echo("agent didn't start")
+	raise typer.Abort()
+
+
+@agent_app.command("stop")
+def stop_agent():
+	try:
+		AgentClient(c.AGENT_SOCKET).stop()
+	except AgentUnavailable:
+		typer.echo("agent is not running")
+		raise typer.Abort()
+	typer.echo("agent stopped")
+
+
+@agent_app.command("status")
+def agent_status():
+	try:
+		status = AgentClient(c.AGENT_SOCKET).ping()
+	except AgentUnavailable:
+		typer.echo("agent is not running")
+		raise typer.Exit(1)
+	remaining = "until stopped" if status["remaining"] is None else f"{status['remaining']:.0f}s"
+	typer.echo(f"agent running, pid {status['pid']}, holding key {remaining}")
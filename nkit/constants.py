@@ -2,13 +2,48 @@ from pathlib import Path
 import typer
 import os
 import tempfile
+import typing as t
 
 APP_NAME = "nkit"
 
 DEFAULT_DIR = Path(typer.get_app_dir(APP_NAME)).resolve()
 
+N = t.TypeVar("N", int, float)
+
+
+def env_number(name: str, default: N) -> N:
+	# malformed value falls back to default with a warning, it shouldn't break every command at import
+	value = os.environ.get(name)
+	if value is None:
+		return default
+	try:
+		return type(default)(value)
+	except ValueError:
+		typer.secho(f"ignoring {name}={value!r}, not a number, using {default}", fg=typer.colors.YELLOW, err=True)
+		return default
+
+
 DEBUG = os.environ.get("DEBUG", "0") != "0"
 TESTING = os.environ.get("TESTING", "0") != "0"
+# processes used for deriving rsa key from password, 1 keeps it in process
+WORKERS = env_number("NKIT_WORKERS", 1)
+# seconds derived key stays in encrypted on-disk cache, 0 disables it
+KEY_CACHE_TTL = env_number("NKIT_KEY_CACHE_TTL", 0)
+# seconds agent keeps an unwrapped aes key of a secret, and how many it keeps. 0 disables
+DATA_KEY_TTL = env_number("NKIT_DATA_KEY_TTL", 300.0)
+DATA_KEY_CACHE_SIZE = env_number("NKIT_DATA_KEY_CACHE_SIZE", 1024)
+# agent reminders of deadlines run this with the reminder as last argument, logged to APP_DIR/reminders.log if empty
+REMIND_COMMAND = os.environ.get("NKIT_REMIND_COMMAND", "")
+# seconds a sqlite connection waits for another writer before giving up
+BUSY_TIMEOUT = env_number("NKIT_BUSY_TIMEOUT", 30.0)
+# backend notes and keys are kept in, see `storage.storage.BACKENDS`
+STORAGE = os.environ.get("NKIT_STORAGE", "sqlite")
+# server of remote storage (`storage.remote`), e.g. http://127.0.0.1:8765
+REMOTE_URL = os.environ.get("NKIT_REMOTE_URL", "")
+# where `nkit sync` pushes to and pulls from, a directory
+REMOTE = os.environ.get("NKIT_REMOTE", "")
+# `nkit note` appends to a journal folded into storage on next read, see `journal`
+NOTE_JOURNAL = os.environ.get("NKIT_NOTE_JOURNAL", "0") != "0"
 
 if TESTING:
 	APP_DIR = Path(tempfile.mkdtemp(suffix=APP_NAME))
@@ -18,4 +53,8 @@ else:
 if DEBUG:
 	APP_DIR = DEFAULT_DIR/".debug"
 
-APP_DIR.mkdir(exist_ok=True, parents=True)
+def ensure_app_dir():
+	# called before writing anything, so importing constants doesn't touch disk
+	APP_DIR.mkdir(exist_ok=True, parents=True)
+
+AGENT_SOCKET = APP_DIR/"agent.sock"
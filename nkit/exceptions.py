@@ -1,2 +1,14 @@
 class CrudException(Exception):
 	pass
+
+class AgentUnavailable(Exception):
+	pass
+
+class AgentError(Exception):
+	pass
+
+class SyncError(Exception):
+	pass
+
+class RemoteError(Exception):
+	pass
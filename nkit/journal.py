@@ -0,0 +1,106 @@
+""" append-only journal `nkit note` writes to instead of notes.db, opt in with NKIT_NOTE_JOURNAL=1
+
+a note is one json line (`notes_io.to_record` without id) added with a single O_APPEND write:
+no engine, no schema check, no database lock, and none of sqlalchemy/pydantic is imported.
+`fold` moves journaled notes into storage in one transaction, `notes show`/`search`/`export`
+fold before reading and `notes flush` folds explicitly.
+
+notes are inserted only if their content hash isn't in storage yet, so a fold that crashed after
+commit but before the journal was emptied replays without duplicates. lines torn by a crash
+mid write are skipped. the write isn't fsynced, a crashed process loses nothing but a crashed
+machine may lose the last notes.
+"""
+import os
+import json
+import datetime
+import typing as t
+
+from . import constants as c
+from .types import NoteType, Json
+
+try:
+	import fcntl
+except ImportError:
+	# windows, appends and folds aren't serialized
+	fcntl = None
+
+JOURNAL_PATH = c.APP_DIR/"notes.journal"
+
+
+def note_record(msg: str, ty: NoteType, created_at: t.Optional[datetime.datetime] = None, refer_id: t.Optional[int] = None,
+		deadline: t.Optional[str] = None) -> Json:
+	# same as `notes_io.to_record` of the NoteCreate `notes create` makes
+	if deadline:
+		# read like `notes create` reads it, arrow is imported only for notes with a deadline. ValueError if malformed
+		import arrow
+		deadline = arrow.get(deadline).isoformat()
+	return {
+		"ty": ty.value,
+		"msg": msg,
+		"created_at": (created_at or datetime.datetime.now(datetime.timezone.utc)).isoformat(),
+		"draft": True,
+		"deadline": deadline or None,
+		"resources": [],
+		"refer_id": refer_id,
+		"completed": None,
+	}
+
+
+def lock(fd: int):
+	if fcntl is not None:
+		fcntl.flock(fd, fcntl.LOCK_EX)
+
+
+def append(record: Json, path: t.Optional[os.PathLike] = None):
+	line = json.dumps(record).encode("utf-8") + b"\n"
+	c.ensure_app_dir()
+	fd = os.open(path or JOURNAL_PATH, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+	try:
+		# waits for a running fold, it empties the file after reading it
+		lock(fd)
+		if os.fstat(fd).st_size:
+			# no pread on windows, the write appends wherever the offset is left
+			os.lseek(fd, -1, os.SEEK_END)
+			if os.read(fd, 1) != b"\n":
+				# last append was torn, keep it from swallowing this one
+				line = b"\n" + line
+		os.write(fd, line)
+	finally:
+		os.close(fd)
+
+
+def read(data: bytes) -> t.List[Json]:
+	records = []
+	for line in data.splitlines():
+		try:
+			records.append(json.loads(line))
+		except ValueError:
+			continue
+	return records
+
+
+def pending(path: t.Optional[os.PathLike] = None) -> bool:
+	try:
+		return os.stat(path or JOURNAL_PATH).st_size > 0
+	except FileNotFoundError:
+		return False
+
+
+def fold(storage: t.Any, path: t.Optional[os.PathLike] = None) -> int:
+	""" inserts journaled notes into storage in one transaction and empties journal, returns number inserted
+
+	journal is kept as is when insert fails
+	"""
+	if not pending(path):
+		return 0
+	from . import notes_io
+	with open(path or JOURNAL_PATH, "r+b") as f:
+		lock(f.fileno())
+		# records have no id, they're read as NoteCreates with refer_id kept
+		notes = [notes_io.from_record(record) for record in read(f.read())]
+		inserted = 0
+		if notes:
+			with storage.notes() as db:
+				inserted = db.insert_new(notes)
+		f.truncate(0)
+	return inserted
@@ -1,16 +1,45 @@
 import typer
 import functools
+import contextlib
+import mmap
 import typing as t
 from pathlib import Path
 from . import security
+from .security import batch, envelope, verifier
 from Crypto.PublicKey import RSA
-from .storage.local import SecretDb
+from .storage.storage import get_storage
 from . import constants as c
 from . import models
+from .agent import AgentClient
+from .exceptions import AgentError
 
 keys_app = typer.Typer()
 
 KEY_PATH = c.APP_DIR/'pub.pem'
+# master key secrets are encrypted to, wrapped under password key. see `security.envelope`
+MASTER_PATH = c.APP_DIR/'master.key'
+# rejects wrong passwords before key derivation, see `security.verifier`
+VERIFIER_PATH = c.APP_DIR/'pub.verifier'
+
+options = {"workers": c.WORKERS}
+key_cache = security.KeyCache(c.APP_DIR/'key_cache.bin', ttl=c.KEY_CACHE_TTL)
+# same secret asked for twice in one process is rsa decrypted once, across processes the agent keeps them
+data_keys = security.DataKeyCache(c.DATA_KEY_CACHE_SIZE, c.DATA_KEY_TTL)
+
+
+@keys_app.callback()
+def keys_options(
+		workers: int = typer.Option(c.WORKERS, envvar="NKIT_WORKERS", help="processes used to derive key from password"),
+		cache_ttl: int = typer.Option(c.KEY_CACHE_TTL, envvar="NKIT_KEY_CACHE_TTL", help="seconds to keep derived key in encrypted disk cache, 0 disables")):
+	options["workers"] = workers
+	key_cache.ttl = cache_ttl
+
+
+def derive_key(password: str) -> RSA.RsaKey:
+	private_key = key_cache.get(password.encode('utf-8'), workers=options["workers"])
+	if c.DEBUG:
+		typer.echo(f"key cache: {key_cache.cache_info()}", err=True)
+	return private_key
 
 def require_init(f):
 	@functools.wraps(f)
@@ -29,11 +58,29 @@ def initialize(password: str = typer.Option(..., prompt=True, confirmation_promp
 		typer.echo("key already initialized. Run `nkit keys reset` to remove all secrets and key")
 		raise typer.Abort()
 
-	private_key = security.generate_rsa_key(password.encode('utf-8'))
-	public_key_bytes = private_key.publickey().export_key("PEM")
-	with open(KEY_PATH, "wb") as f:
-		f.write(public_key_bytes)
-		typer.echo(f"Stored public key at {KEY_PATH}")
+	private_key = derive_key(password)
+	c.ensure_app_dir()
+	if MASTER_PATH.exists():
+		# pulled by sync before init, keys from other machines are encrypted to it
+		try:
+			envelope.unwrap(MASTER_PATH, private_key)
+		except ValueError:
+			typer.echo("Master key pulled from remote isn't for this password. Use the password of the machine keys were pushed from")
+			raise typer.Abort()
+	else:
+		envelope.create(MASTER_PATH, private_key)
+	write_public_key(private_key, password)
+	typer.echo(f"Stored public key at {KEY_PATH}")
+	key_cache.keep(password.encode('utf-8'), private_key)
+
+
+def write_public_key(private_key: RSA.RsaKey, password: str):
+	public_key_pem = private_key.publickey().export_key("PEM")
+	tmp_path = KEY_PATH.with_suffix(".tmp")
+	tmp_path.write_bytes(public_key_pem)
+	tmp_path.replace(KEY_PATH)
+	# a verifier of the previous key left by an interruption here is ignored
+	verifier.write(VERIFIER_PATH, password.encode('utf-8'), public_key_pem)
 
 
 @keys_app.command("reset")
@@ -43,65 +90,163 @@ def reset():
 		import os
 		os.remove(KEY_PATH)
 		typer.echo("Deleted key")
-	with SecretDb() as db:
+	for path in [MASTER_PATH, VERIFIER_PATH]:
+		if path.exists():
+			path.unlink()
+	key_cache.clear()
+	with get_storage().secrets() as db:
 		db.delete_all()
 		typer.echo("removed all secrets")
 
 
+@keys_app.command("clear-cache")
+def clear_cache():
+	key_cache.clear()
+	typer.echo("removed cached keys")
+
+
 @keys_app.command("add")
 @require_init
 def add_key(key: str, title: str = typer.Option(..., prompt=True)):
-	with open(KEY_PATH, "rb") as f:
-		public_key = RSA.import_key(f.read())
-	with SecretDb() as db:
+	public_key = secrets_public_key()
+	with get_storage().secrets() as db:
 		db.insert(models.SecretCreate(title=title, data=security.encrypt_large(public_key, key.encode('utf-8'))))
 		typer.echo(f"Saved with title: {title}")
 
 
-def check_password_and_retry(password: str) -> t.Optional[RSA.RsaKey]:
-	def get_public_key(password) -> bytes:
-		private_key = security.generate_rsa_key(password.encode('utf-8'))
-		return private_key.publickey().export_key("PEM")
+def unlock(password: str, stored_public_key: bytes) -> t.Optional[RSA.RsaKey]:
+	# password key, None if password is wrong. verifier usually tells that before key is derived
+	if verifier.check(VERIFIER_PATH, password.encode('utf-8'), stored_public_key) is False:
+		return None
+	private_key = derive_key(password)
+	if not stored_public_key == private_key.publickey().export_key("PEM"):
+		return None
+	return private_key
 
-	public_key_bytes = get_public_key(password)
 
+def check_password_and_retry(password: str) -> t.Optional[RSA.RsaKey]:
 	with open(KEY_PATH, "rb") as f:
 		stored_public_key = f.read()
 
+	private_key = unlock(password, stored_public_key)
 	tries = 0
-	while not stored_public_key == public_key_bytes and tries < 3:
+	while private_key is None and tries < 3:
 		typer.echo(f"Password is incorrect. Doesn't match with public key. Retry {tries+1}")
 		password = typer.prompt("Password: ", hide_input=True)
-		public_key_bytes = get_public_key(password)
+		private_key = unlock(password, stored_public_key)
 		tries += 1
 
-	if not stored_public_key == public_key_bytes:
+	if private_key is None:
 		return None
+	key_cache.keep(password.encode('utf-8'), private_key)
+	if not verifier.exists(VERIFIER_PATH, stored_public_key):
+		# installs from before verifiers get one on first successful unlock
+		verifier.write(VERIFIER_PATH, password.encode('utf-8'), stored_public_key)
+	return private_key
+
+
+def reject_wrong_password(password: str):
+	# for commands that don't compare with public key, a wrong password would only show up as garbage or a failed decryption
+	if KEY_PATH.exists() and verifier.check(VERIFIER_PATH, password.encode('utf-8'), KEY_PATH.read_bytes()) is False:
+		typer.echo("Password Not Correct!!")
+		raise typer.Abort()
+
+
+def secrets_public_key() -> RSA.RsaKey:
+	# encrypting needs no password, master public key is stored as is
+	if MASTER_PATH.exists():
+		return envelope.public_key(MASTER_PATH)
+	return RSA.import_key(KEY_PATH.read_bytes())
+
+
+def secrets_key(password_key: RSA.RsaKey) -> RSA.RsaKey:
+	# key secrets and files are encrypted to: master key, or password key itself on installs from before master keys
+	if not MASTER_PATH.exists():
+		return password_key
+	if envelope.migrating(MASTER_PATH):
+		typer.echo("Password change was interrupted. Run `nkit keys rotate-password` again")
+		raise typer.Abort()
+	try:
+		return envelope.unwrap(MASTER_PATH, password_key)
+	except ValueError:
+		typer.echo("Password Not Correct!!")
+		raise typer.Abort()
+
+
+def secrets_keys(password_key: RSA.RsaKey) -> t.List[RSA.RsaKey]:
+	# secrets_key, then password key of the install from before master keys that older files are encrypted to
+	key = secrets_key(password_key)
+	legacy = envelope.legacy_key(MASTER_PATH, key) if MASTER_PATH.exists() else None
+	return [key] if legacy is None else [key, legacy]
+
+
+def running_agent() -> t.Optional[AgentClient]:
+	client = AgentClient(c.AGENT_SOCKET)
+	return client if client.available() else None
+
+
+def get_decryptor(password: t.Optional[str], verify: bool = True) -> t.Callable[..., bytes]:
+	# decrypt(content, key_id=None), key_id is secret id its aes key is cached under
+	# running agent already holds the key, otherwise derive it here
+	client = running_agent()
+	if client is not None:
+		return client.decrypt
+	if password is None:
+		password = typer.prompt("Password", hide_input=True)
+	if verify:
+		private_key = check_password_and_retry(password)
+		if private_key is None:
+			typer.echo("Password Not Correct!!")
+			raise typer.Abort()
 	else:
-		return security.generate_rsa_key(password.encode('utf-8'))
+		reject_wrong_password(password)
+		private_key = derive_key(password)
+	return functools.partial(envelope.fallback(security.decrypt_large, secrets_keys(private_key)), data_keys=data_keys)
+
+
+def get_public_key(password: t.Optional[str]) -> RSA.RsaKey:
+	client = running_agent()
+	if client is not None:
+		return client.public_key()
+	if MASTER_PATH.exists():
+		return envelope.public_key(MASTER_PATH)
+	if password is None:
+		password = typer.prompt("Password", hide_input=True)
+	reject_wrong_password(password)
+	return derive_key(password).publickey()
 
 
 @keys_app.command("get")
 @require_init
-def get_key(title: str, password: str = typer.Option(..., prompt=True, hide_input=True)):
-	private_key = check_password_and_retry(password)
-	if private_key is None:
-		typer.echo("Password Not Correct!!")
+def get_key(
+		title: t.Optional[str] = typer.Argument(None),
+		all_matching: t.Optional[str] = typer.Option(None, "--all-matching", help="every key with title matching regex, printed as title: key"),
+		password: t.Optional[str] = typer.Option(None, hide_input=True, help="prompted for when agent isn't running")):
+	if (title is None) == (all_matching is None):
+		typer.echo("Give either a title or --all-matching")
 		raise typer.Abort()
+	decrypt = get_decryptor(password)
 
-
-	with SecretDb() as db:
+	with get_storage().secrets() as db:
+		if all_matching is not None:
+			secrets = db.get_secrets(all_matching)
+			if not secrets:
+				typer.echo(f"No key matches: {all_matching}")
+				raise typer.Abort()
+			for secret in secrets:
+				typer.echo(f"{secret.title}: {decrypt(secret.data, key_id=secret.id).decode('utf-8')}")
+			return
 		secret = db.get_secret(title)
 		if secret is None:
 			typer.echo(f"No key with title: {title}")
 			raise typer.Abort()
-		typer.echo(security.decrypt_large(private_key, secret.data))
+		typer.echo(decrypt(secret.data, key_id=secret.id))
 
 
 @keys_app.command("remove")
 @require_init
 def get_key(title: str):
-	with SecretDb() as db:
+	with get_storage().secrets() as db:
 		secret = db.get_secret(title)
 		if secret is None:
 			typer.echo(f"No key with title: {title}")
@@ -110,70 +255,170 @@ def get_key(title: str):
 		typer.echo("deleted")
 
 
-@keys_app.command("decrypt")
-def decrypt_external(password: str = typer.Option(..., prompt=True, hide_input=True), inpath: t.Optional[Path] = typer.Option(None), outpath: t.Optional[Path] = typer.Option(None)):
+@keys_app.command("rotate-password")
+@require_init
+def rotate_password(
+		password: str = typer.Option(..., prompt="Current password", hide_input=True),
+		new_password: str = typer.Option(..., prompt=True, confirmation_prompt=True, hide_input=True)):
+	old_key = check_password_and_retry(password)
+	if old_key is None:
+		typer.echo("Password Not Correct!!")
+		raise typer.Abort()
+	new_key = derive_key(new_password)
+	if not MASTER_PATH.exists():
+		# secrets from before master keys are encrypted to password key, moved to a master key once
+		# old password key is kept in master key record, files encrypted to it still open
+		envelope.create(MASTER_PATH, old_key, migrating=True, legacy=old_key)
+	if envelope.migrating(MASTER_PATH):
+		count = migrate_secrets(old_key, envelope.unwrap(MASTER_PATH, old_key))
+		typer.echo(f"Re-encrypted {count} secrets to master key")
+	envelope.rotate(MASTER_PATH, old_key, new_key, lambda: write_public_key(new_key, new_password))
+	key_cache.clear()
+	typer.echo("Password changed")
+
+
+def migrate_secrets(password_key: RSA.RsaKey, master_key: RSA.RsaKey) -> int:
+	# in one transaction, so it's redone as a whole (by next rotate-password) if interrupted
+	master_public_key = master_key.publickey()
+	with get_storage().secrets() as db:
+		moved = []
+		for secret in db.get_secrets(""):
+			try:
+				data = security.decrypt_large(password_key, secret.data)
+			except ValueError:
+				# already on master key
+				continue
+			moved.append(models.SecretRow(secret.id, secret.title, security.encrypt_large(master_public_key, data)))
+		db.update_all(moved)
+	envelope.write(MASTER_PATH, master_key, [password_key.publickey()], legacy=password_key)
+	return len(moved)
+
+
+def get_unwrapper(password: t.Optional[str]) -> t.Tuple[security.Unwrap, int]:
+	# decrypts only the small rsa wrapped aes key, content itself is decrypted here in chunks
+	client = running_agent()
+	if client is not None:
+		return client.unwrap, client.public_key().size_in_bytes()
+	if password is None:
+		password = typer.prompt("Password", hide_input=True)
+	reject_wrong_password(password)
+	keys = secrets_keys(derive_key(password))
+	return envelope.fallback(security.decrypt, keys), keys[0].size_in_bytes()
+
+
+def open_input(inpath: t.Optional[Path]) -> t.BinaryIO:
 	if inpath is None:
-		import sys
-		encrypted = sys.stdin.read().encode('utf-8')
-	else:
-		if not (inpath.exists() and inpath.is_file()):
-			typer.echo("content path not valid")
-			raise typer.Abort()
-		encrypted = inpath.read_bytes()
-	private_key = security.generate_rsa_key(password.encode("utf-8"))
-	try:
-		decrypted = security.decrypt_large(private_key, encrypted)
-	except ValueError as e:
-		typer.echo(f"Can't decrypt: {e}")
+		return typer.get_binary_stream("stdin")
+	if not (inpath.exists() and inpath.is_file()):
+		typer.echo("content path not valid")
 		raise typer.Abort()
+	return open(inpath, "rb")
+
+
+@contextlib.contextmanager
+def open_output(outpath: t.Optional[Path]) -> t.Iterator[t.BinaryIO]:
+	# file appears only once everything is written, failed decryption leaves nothing behind
 	if outpath is None:
-		typer.echo(decrypted)
-	else:
-		if outpath.is_dir():
-			typer.echo(f"{outpath} is dir")
+		yield typer.get_binary_stream("stdout")
+		return
+	if outpath.is_dir():
+		typer.echo(f"{outpath} is dir")
+		raise typer.Abort()
+	if outpath.exists():
+		typer.echo(f"{outpath} already exists")
+		override = typer.prompt(f"override [y/n]: ") == "y"
+		if not override:
 			raise typer.Abort()
-		if outpath.exists():
-			typer.echo(f"{outpath} already exists")
-			override = typer.prompt(f"override [y/n]: ") == "y"
-			if not override:
-				raise typer.Abort()
-		with open(outpath, "wb") as f:
-			f.write(decrypted)
-			typer.echo(f"writted to file {outpath}")
+	with batch.atomic_output(outpath) as f:
+		yield f
+	typer.echo(f"writted to file {outpath}")
+
+
+def map_input(inpath: Path) -> mmap.mmap:
+	# mapping isn't closed explicitly, it goes away with the last view into it
+	with open_input(inpath) as f:
+		return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@keys_app.command("decrypt")
+def decrypt_external(
+		password: t.Optional[str] = typer.Option(None, hide_input=True, help="prompted for when agent isn't running"),
+		inpath: t.Optional[Path] = typer.Option(None),
+		outpath: t.Optional[Path] = typer.Option(None),
+		use_mmap: bool = typer.Option(False, "--mmap", help="map input file in memory instead of reading it")):
+	if use_mmap and inpath is None:
+		typer.echo("--mmap needs --inpath")
+		raise typer.Abort()
+	infile = open_input(inpath) if not use_mmap else None
+	unwrap, key_length = get_unwrapper(password)
+	try:
+		if infile is None:
+			mapped = map_input(inpath) # type: ignore checked with use_mmap
+			with open_output(outpath) as outfile:
+				security.decrypt_buffer(unwrap, key_length, mapped, outfile)
+		else:
+			with infile, open_output(outpath) as outfile:
+				security.decrypt_stream(unwrap, key_length, infile, outfile)
+	except (ValueError, AgentError) as e:
+		typer.echo(f"Can't decrypt: {e}", err=True)
+		raise typer.Abort()
 
 
 @keys_app.command("encrypt")
-def encrypt_external(password: str = typer.Option(..., prompt=True, hide_input=True), inpath: t.Optional[Path] = typer.Option(None), outpath: t.Optional[Path] = typer.Option(None)):
-	if inpath is None:
-		import sys
-		data = sys.stdin.read().encode('utf-8')
-	else:
-		if not (inpath.exists() and inpath.is_file()):
-			typer.echo("content path not valid")
-			raise typer.Abort()
-		data = inpath.read_bytes()
-	private_key = security.generate_rsa_key(password.encode("utf-8"))
-	encrypted = security.encrypt_large(private_key.publickey(), data)
+def encrypt_external(password: t.Optional[str] = typer.Option(None, hide_input=True, help="prompted for when agent isn't running"), inpath: t.Optional[Path] = typer.Option(None), outpath: t.Optional[Path] = typer.Option(None)):
+	infile = open_input(inpath)
+	public_key = get_public_key(password)
+	with infile, open_output(outpath) as outfile:
+		security.encrypt_stream(public_key, infile, outfile)
 
-	if outpath is None:
-		typer.echo(encrypted)
-	else:
-		if outpath.is_dir():
-			typer.echo(f"{outpath} is dir")
-			raise typer.Abort()
-		if outpath.exists():
-			typer.echo(f"{outpath} already exists")
-			override = typer.prompt(f"override [y/n]: ") == "y"
-			if not override:
-				raise typer.Abort()
-		with open(outpath, "wb") as f:
-			f.write(encrypted)
-			typer.echo(f"writted to file {outpath}")
+
+def echo_batch_result(action: str, result: batch.BatchResult):
+	for path, error in result.failed:
+		typer.secho(f"failed {path}: {error}", fg=typer.colors.RED, err=True)
+	typer.echo(f"{action} {result.files} files, {result.bytes/(1<<20):.1f} MB in {result.seconds:.2f}s "
+		f"({result.files_per_second:.1f} files/s, {result.mb_per_second:.1f} MB/s)")
+	if result.failed:
+		raise typer.Exit(1)
+
+
+@keys_app.command("encrypt-batch")
+def encrypt_batch(
+		sources: t.List[str] = typer.Argument(None, help="files, directories or glob patterns"),
+		manifest: t.Optional[Path] = typer.Option(None, help="file with an input path per line, optionally followed by tab and output path"),
+		outdir: t.Optional[Path] = typer.Option(None, help="put outputs here instead of next to inputs"),
+		threads: int = typer.Option(0, help="0 uses all cores"),
+		force: bool = typer.Option(False, help="override existing outputs"),
+		password: t.Optional[str] = typer.Option(None, hide_input=True, help="prompted for when agent isn't running")):
+	jobs = batch.collect_jobs(sources or [], manifest, outdir, batch.encrypted_name)
+	if not jobs:
+		typer.echo("no files to encrypt")
+		raise typer.Abort()
+	public_key = get_public_key(password)
+	echo_batch_result("encrypted", batch.encrypt_files(public_key, jobs, threads or None, force))
+
+
+@keys_app.command("decrypt-batch")
+def decrypt_batch(
+		sources: t.List[str] = typer.Argument(None, help="files, directories or glob patterns"),
+		manifest: t.Optional[Path] = typer.Option(None, help="file with an input path per line, optionally followed by tab and output path"),
+		outdir: t.Optional[Path] = typer.Option(None, help="put outputs here instead of next to inputs"),
+		threads: int = typer.Option(0, help="0 uses all cores"),
+		force: bool = typer.Option(False, help="override existing outputs"),
+		password: t.Optional[str] = typer.Option(None, hide_input=True, help="prompted for when agent isn't running")):
+	jobs = batch.collect_jobs(sources or [], manifest, outdir, batch.decrypted_name)
+	if not jobs:
+		typer.echo("no files to decrypt")
+		raise typer.Abort()
+	unwrap, key_length = get_unwrapper(password)
+	echo_batch_result("decrypted", batch.decrypt_files(unwrap, key_length, jobs, threads or None, force))
 
 
 @keys_app.command("list")
-def list_keys(regex: t.Optional[str] = typer.Option(default=None)):
-	with SecretDb() as db:
-		titles = db.titles(regex)
+def list_keys(
+		regex: t.Optional[str] = typer.Option(default=None),
+		prefix: t.Optional[str] = typer.Option(default=None),
+		glob: t.Optional[str] = typer.Option(default=None, help="sqlite glob pattern e.g. 'aws/*'")):
+	with get_storage().secrets() as db:
+		titles = db.titles(regex, prefix=prefix, glob=glob)
 	for i, title in enumerate(titles, start=1):
 		typer.echo(f"{i:<3} {title}")
@@ -1,17 +1,21 @@
+import typing as t
 import typer
 
-from .utils import blocking_run
+from .utils import blocking_run, LazyGroup
+from .types import NoteType
 
-from .notes_app import note_app, create_note
-from .keys_app import keys_app
-from .models import NoteType
-from .sync_app import sync_app, sync_status
 
-app = typer.Typer()
+class NkitGroup(LazyGroup):
+	# sub apps pull in sqlalchemy, pycryptodome, pydantic... import them only when used
+	lazy_subcommands = {
+		"notes": ("nkit.notes_app", "note_app", "show, search and manage notes"),
+		"keys": ("nkit.keys_app", "keys_app", "password protected secrets and file encryption"),
+		"sync": ("nkit.sync_app", "sync_app", "sync local storage with remote"),
+		"agent": ("nkit.agent_app", "agent_app", "keep unlocked key in a background agent"),
+	}
 
-app.add_typer(note_app, name="notes")
-app.add_typer(keys_app, name="keys")
-app.add_typer(sync_app, name="sync")
+
+app = typer.Typer(cls=NkitGroup)
 
 
 @app.command()
@@ -26,12 +30,27 @@ def hey():
 
 
 @app.command("note")
-def note(note: str, type: NoteType = typer.Option("think")):
-	return create_note(note, type)
+def note(note: str, type: NoteType = typer.Option("think"), refer: t.Optional[int] = typer.Option(None, help="id of note this one follows up"),
+		deadline: t.Optional[str] = typer.Option(None, help="e.g. 2021-01-31T18:00, utc unless offset is given")):
+	from . import constants as c
+	if c.NOTE_JOURNAL:
+		# one append, storage isn't opened
+		from . import journal
+		try:
+			record = journal.note_record(note, type, refer_id=refer, deadline=deadline)
+		except ValueError as e:
+			raise typer.BadParameter(str(e), param_hint="--deadline")
+		journal.append(record)
+		typer.secho(f"Successfull {record['created_at']}", fg=typer.colors.GREEN)
+		typer.secho(note, fg=typer.colors.BLUE)
+		return
+	from .notes_app import create_note
+	return create_note(note, type, refer, deadline)
 
 
 @app.command("sync")
 def sync():
+	from .sync_app import sync_status
 	return sync_status()
 
 
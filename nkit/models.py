@@ -1,13 +1,8 @@
+import datetime
 import typing as t
 from pydantic import BaseModel
-import enum
 import arrow
-
-class NoteType(enum.Enum):
-	task = "task"
-	update = "update"
-	habit = "habit"
-	think_block = "think"
+from .types import NoteType
 
 class NoteCreate(BaseModel):
 	ty: NoteType
@@ -26,9 +21,89 @@ class NoteCreate(BaseModel):
 class Note(NoteCreate):
 	id: int
 
+class NoteRow:
+	""" note as read from db, built straight from a row without validation
+
+	timestamps stay naive utc datetimes as stored, arrow is made only when they are accessed
+	"""
+	__slots__ = ("id", "ty", "msg", "_created_at", "draft", "_deadline", "_resources", "refer_id", "completed")
+
+	def __init__(self, id: int, ty: NoteType, msg: str, created_at: datetime.datetime, draft: bool,
+			deadline: t.Optional[datetime.datetime], resources: str, refer_id: t.Optional[int], completed: t.Optional[bool]):
+		self.id = id
+		self.ty = ty
+		self.msg = msg
+		self._created_at = created_at
+		self.draft = draft
+		self._deadline = deadline
+		self._resources = resources
+		self.refer_id = refer_id
+		self.completed = completed
+
+	@property
+	def created_at(self) -> arrow.Arrow:
+		return arrow.Arrow.fromdatetime(self._created_at)
+
+	@property
+	def deadline(self) -> t.Optional[arrow.Arrow]:
+		return arrow.Arrow.fromdatetime(self._deadline) if self._deadline else None
+
+	@property
+	def created_at_utc(self) -> datetime.datetime:
+		# as stored, naive utc. for comparing and sorting without making arrows
+		return self._created_at
+
+	@property
+	def deadline_utc(self) -> t.Optional[datetime.datetime]:
+		return self._deadline
+
+	@property
+	def resources(self) -> t.List[str]:
+		return [a for a in self._resources.split("\n") if len(a)>0]
+
+	def values(self) -> tuple:
+		return tuple(getattr(self, name) for name in self.__slots__)
+
+	def __eq__(self, other) -> bool:
+		return isinstance(other, NoteRow) and self.values() == other.values()
+
+	def __repr__(self) -> str:
+		return f"NoteRow(id={self.id}, ty={self.ty}, msg={self.msg!r}, created_at={self._created_at})"
+
+	def to_pydantic(self) -> Note:
+		return Note(id=self.id, ty=self.ty, msg=self.msg, created_at=self.created_at, draft=self.draft,
+			deadline=self.deadline, resources=self.resources, refer_id=self.refer_id, completed=self.completed)
+
+# what read paths return, or a validated note
+AnyNote = t.Union[Note, NoteRow]
+
+class NoteMatch(t.NamedTuple):
+	note: NoteRow
+	# msg with matched terms wrapped in highlight markers
+	highlighted: str
+	# bm25, lower is better
+	rank: float
+
+class ThreadNote(t.NamedTuple):
+	# 0 for root of thread, 1 for notes referring to it...
+	depth: int
+	note: NoteRow
+
+class DayCount(t.NamedTuple):
+	# notes of a type created on a utc day
+	day: datetime.date
+	ty: NoteType
+	count: int
+
 class SecretCreate(BaseModel):
 	title: str
 	data: bytes
 
 class Secret(SecretCreate):
 	id: int
+
+class SecretRow(t.NamedTuple):
+	# secret as read from db, without validation
+	id: int
+	title: str
+	data: bytes
@@ -1,56 +1,271 @@
+import time
+import typing as t
 import typer
 import arrow
 from .models import NoteCreate
 from .exceptions import CrudException
 from . import models
-from .storage.local import NoteDb
+from .storage.storage import get_storage, note_cursor
 from .utils import catch_error
+from . import notes_io
+from . import journal
+from . import stats
+from . import constants as c
 
 note_app = typer.Typer()
 
 
 @note_app.command("show")
 @catch_error
-def show_notes(limit: int = 5, id: bool = typer.Option(False, "--id/--no-id")):
-	with NoteDb() as db:
-		notes = db.get_recent(limit = limit)
-	notes = sorted(notes, key=lambda x: x.created_at)
-	
-	if len(notes) == 0:
+def show_notes(
+		limit: int = 5,
+		id: bool = typer.Option(False, "--id/--no-id"),
+		before: t.Optional[str] = typer.Option(None, help="cursor, show notes older than it"),
+		after: t.Optional[str] = typer.Option(None, help="cursor, show notes newer than it")):
+	shown = 0
+	first = None
+	journal.fold(get_storage())
+	with get_storage().notes() as db:
+		# printed as rows arrive, nothing is collected
+		for i, note in enumerate(db.iter_recent(limit, before=before, after=after)):
+			if first is None:
+				first = note
+			created = typer.style(note.created_at.format('YYYY-MM-DD HH:mm'), fg=typer.colors.BLUE if i%2==0 else typer.colors.BRIGHT_BLUE)
+			task = typer.style(f"{note.ty.name:<12}", fg=typer.colors.BLUE if i%2==0 else typer.colors.BRIGHT_BLUE)
+			msg =  created + f" {note.created_at.humanize():<10}  " + task + f" - {note.msg}"
+			if id:
+				msg = f"{note.id:<5}- "  + msg
+
+			typer.echo(msg)
+			shown += 1
+
+	if shown == 0:
 		typer.secho("Can't find any notes on local storage")
+	elif shown == limit and after is None:
+		typer.secho(f"older notes: nkit notes show --before {note_cursor(first)}", dim=True, err=True)
+
+@note_app.command("search")
+@catch_error
+def search_notes(
+		query: str,
+		type: t.Optional[models.NoteType] = typer.Option(None),
+		since: t.Optional[str] = typer.Option(None, help="only notes created after this date e.g. 2021-01-31"),
+		limit: int = 20,
+		raw: bool = typer.Option(False, help="query is fts5 syntax e.g. 'deploy NOT staging'"),
+		id: bool = typer.Option(False, "--id/--no-id")):
+	# ansi codes are stripped by typer.echo when output isn't a terminal
+	highlight = ("\x1b[1;33m", "\x1b[0m")
+	journal.fold(get_storage())
+	with get_storage().notes() as db:
+		matches = db.search(query, type=type, since=arrow.get(since) if since else None, limit=limit, highlight=highlight, raw=raw)
+
+	if len(matches) == 0:
+		typer.secho("No matching notes")
 
-	for i, note in enumerate(notes):
+	for i, match in enumerate(matches):
+		note = match.note
 		created = typer.style(note.created_at.format('YYYY-MM-DD HH:mm'), fg=typer.colors.BLUE if i%2==0 else typer.colors.BRIGHT_BLUE)
 		task = typer.style(f"{note.ty.name:<12}", fg=typer.colors.BLUE if i%2==0 else typer.colors.BRIGHT_BLUE)
-		msg =  created + f" {note.created_at.humanize():<10}  " + task + f" - {note.msg}"
+		msg = created + "  " + task + f" - {match.highlighted}"
 		if id:
 			msg = f"{note.id:<5}- "  + msg
-
 		typer.echo(msg)
 
+def thread_lines(thread: t.List[models.ThreadNote]) -> t.Iterator[t.Tuple[str, models.NoteRow]]:
+	# (tree drawing prefix, note) of every note, thread is depth first like `thread` returns it
+	last = [False] * len(thread)
+	seen_at: t.Dict[int, bool] = {}
+	for i in reversed(range(len(thread))):
+		depth = thread[i].depth
+		last[i] = not seen_at.get(depth, False)
+		seen_at = {level: seen for level, seen in seen_at.items() if level < depth}
+		seen_at[depth] = True
+	ancestors_last: t.List[bool] = []
+	for (depth, note), is_last in zip(thread, last):
+		ancestors_last = ancestors_last[:depth] + [is_last]
+		prefix = "".join("    " if ended else "│   " for ended in ancestors_last[1:-1])
+		if depth > 0:
+			prefix += "└── " if is_last else "├── "
+		yield prefix, note
+
+@note_app.command("thread")
+@catch_error
+def show_thread(id: int, depth: t.Optional[int] = typer.Option(None, help="levels of replies to show, all by default")):
+	journal.fold(get_storage())
+	with get_storage().notes() as db:
+		thread = db.thread(id, depth=depth)
+	if not thread:
+		typer.secho(f"No note with id {id}")
+		raise typer.Exit(1)
+	for prefix, note in thread_lines(thread):
+		created = typer.style(note.created_at.format('YYYY-MM-DD HH:mm'), fg=typer.colors.BLUE)
+		typer.echo(prefix + f"{note.id:<5}- " + created + f"  {note.ty.name:<12} - {note.msg}")
+
+def echo_due(notes: t.List[models.NoteRow], now: arrow.Arrow):
+	for note in notes:
+		deadline = note.deadline
+		color = typer.colors.RED if deadline < now else typer.colors.BLUE # type: ignore due notes have deadline
+		due = typer.style(f"{deadline.format('YYYY-MM-DD HH:mm')} {deadline.humanize(now):<14}", fg=color) # type: ignore
+		typer.echo(f"{note.id:<5}- " + due + f" {note.ty.name:<12} - {note.msg}")
+
+@note_app.command("due")
+@catch_error
+def due_notes(
+		days: float = typer.Option(7, help="deadlines up to this many days ahead, overdue ones included"),
+		type: t.Optional[models.NoteType] = typer.Option(None),
+		limit: int = 50):
+	journal.fold(get_storage())
+	now = arrow.utcnow()
+	with get_storage().notes() as db:
+		notes = db.due(before=now.shift(days=days).naive, type=type, limit=limit)
+	if not notes:
+		typer.secho(f"Nothing due in {days:g} days")
+	echo_due(notes, now)
+
+@note_app.command("overdue")
+@catch_error
+def overdue_notes(type: t.Optional[models.NoteType] = typer.Option(None), limit: int = 50):
+	journal.fold(get_storage())
+	now = arrow.utcnow()
+	with get_storage().notes() as db:
+		notes = db.due(before=now.naive, type=type, limit=limit)
+	if not notes:
+		typer.secho("Nothing overdue")
+	echo_due(notes, now)
+
+@note_app.command("complete")
+@catch_error
+def complete_note(id: int, undo: bool = typer.Option(False, "--undo", help="mark as not completed again")):
+	journal.fold(get_storage())
+	try:
+		with get_storage().notes() as db:
+			note = db.complete(id, completed=not undo)
+	except CrudException as e:
+		typer.secho(str(e), fg=typer.colors.RED, bg=typer.colors.WHITE)
+		raise typer.Exit(1)
+	typer.secho(f"{'Reopened' if undo else 'Completed'} {note.id} - {note.msg}", fg=typer.colors.GREEN)
+
+@note_app.command("stats")
+@catch_error
+def note_stats(
+		days: int = typer.Option(14, help="days in daily histogram"),
+		weeks: int = typer.Option(8, help="weeks in weekly histogram"),
+		type: t.Optional[models.NoteType] = typer.Option(None, help="histograms and streak of this type only, streak is of habit notes by default")):
+	# read from per day counts, days are utc
+	journal.fold(get_storage())
+	with get_storage().notes() as db:
+		counts = db.daily_counts()
+	if not counts:
+		typer.secho("Can't find any notes on local storage")
+		return
+	today = arrow.utcnow().date()
+	selected = [count for count in counts if type is None or count.ty == type]
+
+	typer.secho("notes by type", bold=True)
+	for ty, total in sorted(stats.totals(counts).items(), key=lambda item: -item[1]):
+		typer.echo(f"{ty.name:<12} {total:>7}")
+
+	daily = stats.per_day(selected)
+	day_range = [today - stats.ONE_DAY * i for i in reversed(range(days))]
+	typer.secho(f"\nlast {days} days{f' ({type.name})' if type else ''}", bold=True)
+	for line in stats.histogram([(day.strftime("%Y-%m-%d %a"), daily.get(day, 0)) for day in day_range]):
+		typer.echo(line)
+
+	weekly = stats.per_week(daily)
+	week_range = [stats.week_start(today) - stats.ONE_DAY * 7 * i for i in reversed(range(weeks))]
+	typer.secho(f"\nlast {weeks} weeks{f' ({type.name})' if type else ''}", bold=True)
+	for line in stats.histogram([(week.strftime("%G-W%V"), weekly.get(week, 0)) for week in week_range]):
+		typer.echo(line)
+
+	streak_type = type or models.NoteType.habit
+	current, longest = stats.streaks((count.day for count in counts if count.ty == streak_type), today)
+	typer.secho(f"\n{streak_type.name} streak: {current} days, longest {longest} days", fg=typer.colors.GREEN if current else None)
+
+@note_app.command("rebuild-stats")
+@catch_error
+def rebuild_note_stats():
+	with get_storage().notes() as db:
+		db.rebuild_stats()
+	typer.secho("Rebuilt note stats", fg=typer.colors.GREEN)
+
+@note_app.command("reindex")
+@catch_error
+def reindex_notes():
+	with get_storage().notes() as db:
+		db.rebuild_search_index()
+	typer.secho("Rebuilt search index", fg=typer.colors.GREEN)
+
+@note_app.command("flush")
+@catch_error
+def flush_notes():
+	count = journal.fold(get_storage())
+	typer.secho(f"Moved {count} journaled notes to storage", fg=typer.colors.GREEN)
+
 @note_app.command("remove")
 @catch_error
 def remove_note(id: int):
 	try:
-		with NoteDb() as db:
+		with get_storage().notes() as db:
 			db.delete_by_id(id=id)
 	except CrudException as e:
 		typer.secho(str(e), fg=typer.colors.RED, bg=typer.colors.WHITE)
 
+def running_agent_note(note: NoteCreate) -> bool:
+	# agent is the single writer, concurrent notes don't fight over database lock. False if it isn't running
+	if not c.AGENT_SOCKET.exists():
+		return False
+	# pulls in pycryptodome, only when there may be an agent
+	from .agent import AgentClient
+	from .exceptions import AgentUnavailable
+	try:
+		AgentClient(c.AGENT_SOCKET).note(note)
+	except AgentUnavailable:
+		return False
+	return True
+
 @note_app.command("create")
 @catch_error
-def create_note(msg: str, type: models.NoteType = typer.Option("think")):
+def create_note(msg: str, type: models.NoteType = typer.Option("think"), refer: t.Optional[int] = typer.Option(None, help="id of note this one follows up"),
+		deadline: t.Optional[str] = typer.Option(None, help="e.g. 2021-01-31T18:00, utc unless offset is given")):
 	note = NoteCreate(
 			ty=type,
 			msg=msg,
 			created_at=arrow.utcnow(),
 			draft=True,
 			resources=[],
-			deadline=None,
-			refer_id=None)
+			deadline=arrow.get(deadline) if deadline else None,
+			refer_id=refer)
 
-	with NoteDb() as db:
-		db.insert(note)
+	if not running_agent_note(note):
+		with get_storage().notes() as db:
+			db.insert(note)
 
 	typer.secho(f"Successfull {str(note.created_at)}", fg=typer.colors.GREEN)
 	typer.secho(msg, fg=typer.colors.BLUE)
+
+@note_app.command("import")
+@catch_error
+def import_notes(
+		path: str = typer.Argument(..., help="jsonl or csv file, - for stdin"),
+		format: t.Optional[str] = typer.Option(None, help="jsonl or csv, guessed from file name by default"),
+		new_ids: bool = typer.Option(False, "--new-ids", help="ignore ids (and references) in file"),
+		batch_size: int = typer.Option(5000)):
+	format = format or notes_io.guess_format(path)
+	start = time.perf_counter()
+	with typer.open_file(path, "r", encoding="utf-8") as f, get_storage().notes() as db:
+		count = db.insert_many(notes_io.read(f, format, keep_ids=not new_ids), batch_size=batch_size)
+	elapsed = time.perf_counter() - start
+	typer.secho(f"imported {count} notes in {elapsed:.2f}s ({count/elapsed if elapsed else 0:.0f} rows/s)", fg=typer.colors.GREEN, err=True)
+
+@note_app.command("export")
+@catch_error
+def export_notes(
+		path: str = typer.Argument("-", help="jsonl or csv file, - for stdout"),
+		format: t.Optional[str] = typer.Option(None, help="jsonl or csv, guessed from file name by default")):
+	format = format or notes_io.guess_format(path)
+	journal.fold(get_storage())
+	start = time.perf_counter()
+	with typer.open_file(path, "w", encoding="utf-8", atomic=path != "-") as f, get_storage().notes() as db:
+		count = notes_io.write(db.iter_all(), f, format)
+	elapsed = time.perf_counter() - start
+	typer.secho(f"exported {count} notes in {elapsed:.2f}s ({count/elapsed if elapsed else 0:.0f} rows/s)", fg=typer.colors.GREEN, err=True)
@@ -0,0 +1,109 @@
+""" jsonl/csv (de)serialization of notes, one note at a time so any amount of notes fits in memory """
+import csv
+import json
+import typing as t
+
+import arrow
+
+from . import models
+
+FORMATS = ["jsonl", "csv"]
+FIELDS = ["id", "ty", "msg", "created_at", "draft", "deadline", "resources", "refer_id", "completed"]
+
+
+def to_record(note: t.Union[models.AnyNote, models.NoteCreate]) -> t.Dict[str, t.Any]:
+	return {
+		"id": getattr(note, "id", None),
+		"ty": note.ty.value,
+		"msg": note.msg,
+		"created_at": note.created_at.isoformat(),
+		"draft": note.draft,
+		"deadline": note.deadline.isoformat() if note.deadline else None,
+		"resources": note.resources,
+		"refer_id": note.refer_id,
+		"completed": note.completed,
+	}
+
+
+def from_record(record: t.Dict[str, t.Any], keep_id: bool = True) -> t.Union[models.NoteCreate, models.Note]:
+	fields = dict(
+		ty=models.NoteType(record["ty"]),
+		msg=record["msg"],
+		created_at=arrow.get(record["created_at"]),
+		draft=record.get("draft", False),
+		deadline=arrow.get(record["deadline"]) if record.get("deadline") else None,
+		resources=record.get("resources") or [],
+		refer_id=record.get("refer_id") if keep_id else None,
+		completed=record.get("completed"),
+	)
+	if keep_id and record.get("id") is not None:
+		return models.Note(id=record["id"], **fields)
+	return models.NoteCreate(**fields)
+
+
+def write_jsonl(notes: t.Iterable[models.AnyNote], f: t.TextIO) -> int:
+	count = 0
+	for note in notes:
+		f.write(json.dumps(to_record(note)) + "\n")
+		count += 1
+	return count
+
+
+def read_jsonl(f: t.TextIO, keep_ids: bool = True) -> t.Iterator[t.Union[models.NoteCreate, models.Note]]:
+	for line in f:
+		if line.strip():
+			yield from_record(json.loads(line), keep_ids)
+
+
+def csv_value(value: t.Any) -> str:
+	if value is None:
+		return ""
+	if isinstance(value, bool):
+		return "true" if value else "false"
+	if isinstance(value, list):
+		return "\n".join(value)
+	return str(value)
+
+
+def write_csv(notes: t.Iterable[models.AnyNote], f: t.TextIO) -> int:
+	writer = csv.writer(f)
+	writer.writerow(FIELDS)
+	count = 0
+	for note in notes:
+		record = to_record(note)
+		writer.writerow([csv_value(record[field]) for field in FIELDS])
+		count += 1
+	return count
+
+
+def read_csv(f: t.TextIO, keep_ids: bool = True) -> t.Iterator[t.Union[models.NoteCreate, models.Note]]:
+	def optional_bool(value: str) -> t.Optional[bool]:
+		return None if value == "" else value.lower() == "true"
+
+	def optional_int(value: str) -> t.Optional[int]:
+		return None if value == "" else int(value)
+
+	for row in csv.DictReader(f):
+		yield from_record({
+			"id": optional_int(row.get("id", "")),
+			"ty": row["ty"],
+			"msg": row["msg"],
+			"created_at": row["created_at"],
+			"draft": optional_bool(row.get("draft", "")) or False,
+			"deadline": row.get("deadline") or None,
+			"resources": [a for a in row.get("resources", "").split("\n") if len(a)>0],
+			"refer_id": optional_int(row.get("refer_id", "")),
+			"completed": optional_bool(row.get("completed", "")),
+		}, keep_ids)
+
+
+def write(notes: t.Iterable[models.AnyNote], f: t.TextIO, format: str) -> int:
+	return write_csv(notes, f) if format == "csv" else write_jsonl(notes, f)
+
+
+def read(f: t.TextIO, format: str, keep_ids: bool = True) -> t.Iterator[t.Union[models.NoteCreate, models.Note]]:
+	return read_csv(f, keep_ids) if format == "csv" else read_jsonl(f, keep_ids)
+
+
+def guess_format(name: str) -> str:
+	return "csv" if name.lower().endswith(".csv") else "jsonl"
@@ -0,0 +1,97 @@
+""" reminders of note deadlines, run by the agent (`nkit agent start --reminders`)
+
+upcoming deadlines of open notes are loaded once into a heap, the loop sleeps until the earliest
+one and is woken early only when the agent saves a note with a deadline. nothing polls the database:
+a due note is read once, to skip it if it got completed meanwhile.
+
+reminder is NKIT_REMIND_COMMAND run with the note as its last argument (e.g. notify-send),
+or a line in APP_DIR/reminders.log when it isn't set
+"""
+import heapq
+import shlex
+import datetime
+import subprocess
+import asyncio as aio
+import typing as t
+
+from . import models
+from . import constants as c
+from .storage.storage import Storage
+
+# loop clock doesn't advance while machine sleeps, wake up at least this often to catch up
+MAX_SLEEP = 3600.0
+
+
+def utcnow() -> datetime.datetime:
+	# naive utc, like deadlines are stored
+	return datetime.datetime.utcnow()
+
+
+def reminder_text(note: models.NoteRow) -> str:
+	return f"{note.ty.name} due {note.deadline.humanize()}: {note.msg}" # type: ignore deadline is set for due notes
+
+
+def notify(note: models.NoteRow):
+	if c.REMIND_COMMAND:
+		subprocess.Popen(shlex.split(c.REMIND_COMMAND) + [reminder_text(note)], stdin=subprocess.DEVNULL,
+			stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		return
+	c.ensure_app_dir()
+	with open(c.APP_DIR/"reminders.log", "a") as f:
+		f.write(f"{utcnow().isoformat(timespec='seconds')} {reminder_text(note)}\n")
+
+
+class Reminders:
+	def __init__(self, storage: Storage, notify: t.Callable[[models.NoteRow], None] = notify):
+		self.storage = storage
+		self.notify = notify
+		# (deadline, note id)
+		self.heap: t.List[t.Tuple[datetime.datetime, int]] = []
+		self.changed: t.Optional[aio.Event] = None
+
+	def add(self, id: int, deadline: datetime.datetime):
+		# call from the agent's loop, deadline is naive utc
+		heapq.heappush(self.heap, (deadline, id))
+		if self.changed is not None:
+			self.changed.set()
+
+	def load(self):
+		with self.storage.notes() as db:
+			for note in db.due(after=utcnow()):
+				heapq.heappush(self.heap, (note.deadline_utc, note.id))
+
+	def pop_due(self, now: datetime.datetime) -> t.List[int]:
+		ids = []
+		while self.heap and self.heap[0][0] <= now:
+			ids.append(heapq.heappop(self.heap)[1])
+		return ids
+
+	def remind(self, ids: t.List[int]) -> int:
+		# still open ones are notified, returns how many
+		count = 0
+		with self.storage.notes() as db:
+			for id in ids:
+				note = db.get_note(id)
+				if note is not None and note.completed is not True and note.deadline_utc is not None:
+					self.notify(note)
+					count += 1
+		return count
+
+	def sleep_time(self, now: datetime.datetime) -> float:
+		if not self.heap:
+			return MAX_SLEEP
+		return min(MAX_SLEEP, max(0.0, (self.heap[0][0] - now).total_seconds()))
+
+	async def run(self):
+		loop = aio.get_event_loop()
+		self.changed = aio.Event()
+		await loop.run_in_executor(None, self.load)
+		while True:
+			self.changed.clear()
+			try:
+				await aio.wait_for(self.changed.wait(), self.sleep_time(utcnow()))
+			except aio.TimeoutError:
+				pass
+			ids = self.pop_due(utcnow())
+			if ids:
+				await loop.run_in_executor(None, self.remind, ids)
@@ -1 +1,4 @@
-from .pass_rsa import generate_rsa_key, encrypt, encrypt_large, decrypt, decrypt_large
+from .pass_rsa import generate_rsa_key, encrypt, encrypt_large, decrypt, decrypt_large, decrypt_large_into, decrypted_length
+from .key_cache import KeyCache
+from .data_keys import DataKeyCache
+from .stream import Unwrap, encrypt_stream, decrypt_stream, decrypt_buffer
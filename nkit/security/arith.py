@@ -0,0 +1,123 @@
+""" big integer arithmetic behind key derivation: primality and modular inverse
+
+gmpy2 (GMP) is used when installed, pure python otherwise. NKIT_ARITH=python|gmpy2 picks one.
+both answer the same (inverses are exact, primality is miller-rabin on either side with error
+below 4**-40), so a password derives the same key whichever is used.
+"""
+import os
+import sys
+import math
+import random
+import typing as t
+
+try:
+	import gmpy2
+except ImportError:
+	gmpy2 = None
+
+LOW_PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61,
+	67, 71, 73, 79, 83, 89, 97, 101, 103, 107, 109, 113, 127, 131, 137, 139, 149, 151,
+	157, 163, 167, 173, 179, 181, 191, 193, 197, 199, 211, 223, 227, 229, 233, 239, 241,
+	251, 257, 263, 269, 271, 277, 281, 283, 293, 307, 311, 313,317, 331, 337, 347, 349,
+	353, 359, 367, 373, 379, 383, 389, 397, 401, 409, 419, 421, 431, 433, 439, 443, 449,
+	457, 461, 463, 467, 479, 487, 491, 499, 503, 509, 521, 523, 541, 547, 557, 563, 569,
+	571, 577, 587, 593, 599, 601, 607, 613, 617, 619, 631, 641, 643, 647, 653, 659, 661,
+	673, 677, 683, 691, 701, 709, 719, 727, 733, 739, 743, 751, 757, 761, 769, 773, 787,
+	797, 809, 811, 821, 823, 827, 829, 839, 853, 857, 859, 863, 877, 881, 883, 887, 907,
+	911, 919, 929, 937, 941, 947, 953, 967, 971, 977, 983, 991, 997]
+LOW_PRIME_SET = frozenset(LOW_PRIMES)
+TRIALS = 40
+
+
+def lcm(a: int, b: int) -> int:
+	return a*b // math.gcd(a, b)
+
+
+def egcd(a: int, b: int) -> t.Tuple[int, int, int]:
+	# (g, x, y) with a*x + b*y == g, iterative so 4096 bit values don't recurse thousands of frames deep
+	x0, y0, x1, y1 = 0, 1, 1, 0
+	while a != 0:
+		q, b, a = b // a, a, b % a
+		y0, y1 = y1, y0 - q * y1
+		x0, x1 = x1, x0 - q * x1
+	return b, x0, y0
+
+
+def egcd_invert(a: int, m: int) -> int:
+	g, x, _ = egcd(a % m, m)
+	if g != 1:
+		raise ValueError("modular inverse does not exist")
+	return x % m
+
+
+def python_invert(a: int, m: int) -> int:
+	if sys.version_info >= (3, 8):
+		try:
+			return pow(a, -1, m)
+		except ValueError:
+			raise ValueError("modular inverse does not exist")
+	return egcd_invert(a, m)
+
+
+def miller_rabin(num: int, trials: int = TRIALS) -> bool:
+	s = num - 1
+	t = 0
+
+	while s % 2 == 0:
+		s = s // 2
+		t += 1
+	for _ in range(trials):
+		a = random.randrange(2, num - 1)
+		v = pow(a, s, num)
+		if v != 1:
+			i = 0
+			while v != (num - 1):
+				if i == t - 1:
+					return False
+				else:
+					i = i + 1
+					v = pow(v, 2, num)
+	return True
+
+
+def python_is_prime(num: int) -> bool:
+	if num < 2:
+		return False
+	if num in LOW_PRIME_SET:
+		return True
+	for prime in LOW_PRIMES:
+		if num % prime == 0:
+			return False
+	return miller_rabin(num)
+
+
+def gmpy2_invert(a: int, m: int) -> int:
+	try:
+		return int(gmpy2.invert(a, m))
+	except ZeroDivisionError:
+		raise ValueError("modular inverse does not exist")
+
+
+def gmpy2_is_prime(num: int) -> bool:
+	# trial division and miller-rabin in GMP
+	return num >= 2 and bool(gmpy2.is_prime(num, TRIALS))
+
+
+# name -> (invert, is_prime)
+BACKENDS: t.Dict[str, t.Tuple[t.Callable[[int, int], int], t.Callable[[int], bool]]] = {"python": (python_invert, python_is_prime)}
+if gmpy2 is not None:
+	BACKENDS["gmpy2"] = (gmpy2_invert, gmpy2_is_prime)
+
+
+def use(name: str):
+	# switches backend of this process, process pools pick theirs from NKIT_ARITH on import
+	global backend, invert, is_prime
+	if name not in BACKENDS:
+		raise ValueError(f"arithmetic backend {name} isn't available, choose from {', '.join(sorted(BACKENDS))}")
+	backend = name
+	invert, is_prime = BACKENDS[name]
+
+
+backend = ""
+invert, is_prime = python_invert, python_is_prime
+use(os.environ.get("NKIT_ARITH") or ("gmpy2" if gmpy2 is not None else "python"))
@@ -0,0 +1,129 @@
+import os
+import glob
+import time
+import typing as t
+import contextlib
+import concurrent.futures as cf
+from pathlib import Path
+
+from Crypto.PublicKey import RSA
+
+from . import stream
+
+ENCRYPTED_SUFFIX = ".enc"
+DECRYPTED_SUFFIX = ".dec"
+
+# (input file, output file)
+Job = t.Tuple[Path, Path]
+
+
+class BatchResult(t.NamedTuple):
+	files: int
+	bytes: int
+	seconds: float
+	failed: t.List[t.Tuple[Path, str]]
+
+	@property
+	def files_per_second(self) -> float:
+		return self.files / self.seconds if self.seconds else 0.0
+
+	@property
+	def mb_per_second(self) -> float:
+		return self.bytes / (1<<20) / self.seconds if self.seconds else 0.0
+
+
+@contextlib.contextmanager
+def atomic_output(path: Path) -> t.Iterator[t.BinaryIO]:
+	# written to a temp file next to path and renamed over it only if nothing failed
+	tmp_path = path.with_name(f".{path.name}.tmp")
+	try:
+		with open(tmp_path, "wb") as f:
+			yield f
+		tmp_path.replace(path)
+	finally:
+		if tmp_path.exists():
+			tmp_path.unlink()
+
+
+def encrypted_name(path: Path) -> str:
+	return path.name + ENCRYPTED_SUFFIX
+
+def decrypted_name(path: Path) -> str:
+	if path.suffix == ENCRYPTED_SUFFIX:
+		return path.stem
+	return path.name + DECRYPTED_SUFFIX
+
+
+def expand(source: str) -> t.Iterator[t.Tuple[Path, Path]]:
+	# (file, directory its output path is relative to) for a file, directory or glob pattern
+	path = Path(source)
+	if path.is_dir():
+		for file in sorted(path.rglob("*")):
+			if file.is_file():
+				yield file, path
+	elif path.is_file():
+		yield path, path.parent
+	else:
+		for match in sorted(glob.glob(source, recursive=True)):
+			if Path(match).is_file():
+				yield Path(match), Path(match).parent
+
+
+def collect_jobs(sources: t.Sequence[str], manifest: t.Optional[Path], outdir: t.Optional[Path], name: t.Callable[[Path], str]) -> t.List[Job]:
+	""" input/output pairs for files, directories, glob patterns and manifest
+
+	manifest has one input per line, optionally followed by a tab and its output path.
+	outputs are put next to their input unless outdir is given, where directory structure is kept
+	"""
+	jobs: t.List[Job] = []
+	for source in sources:
+		for file, base in expand(source):
+			target_dir = file.parent if outdir is None else outdir/file.parent.relative_to(base)
+			jobs.append((file, target_dir/name(file)))
+
+	if manifest is not None:
+		for line in manifest.read_text().splitlines():
+			if not line.strip():
+				continue
+			inpath, _, outpath = line.partition("\t")
+			file = Path(inpath.strip())
+			if outpath.strip():
+				jobs.append((file, Path(outpath.strip())))
+			else:
+				jobs.append((file, (file.parent if outdir is None else outdir)/name(file)))
+	return jobs
+
+
+def run_batch(process: t.Callable[[t.BinaryIO, t.BinaryIO], int], jobs: t.Sequence[Job], workers: t.Optional[int] = None, overwrite: bool = False) -> BatchResult:
+	""" runs process(infile, outfile) for every job in a thread pool
+
+	AES in pycryptodome runs without GIL, so threads scale with cores without pickling keys to processes
+	"""
+	def run(job: Job) -> int:
+		inpath, outpath = job
+		if outpath.exists() and not overwrite:
+			raise FileExistsError(f"{outpath} already exists")
+		outpath.parent.mkdir(parents=True, exist_ok=True)
+		with open(inpath, "rb") as infile, atomic_output(outpath) as outfile:
+			process(infile, outfile)
+		return os.path.getsize(inpath)
+
+	start = time.perf_counter()
+	total = 0
+	failed: t.List[t.Tuple[Path, str]] = []
+	with cf.ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+		futures = {pool.submit(run, job): job for job in jobs}
+		for future in cf.as_completed(futures):
+			try:
+				total += future.result()
+			except Exception as e:
+				failed.append((futures[future][0], str(e)))
+	return BatchResult(len(jobs) - len(failed), total, time.perf_counter() - start, failed)
+
+
+def encrypt_files(public_key: RSA.RsaKey, jobs: t.Sequence[Job], workers: t.Optional[int] = None, overwrite: bool = False) -> BatchResult:
+	return run_batch(lambda infile, outfile: stream.encrypt_stream(public_key, infile, outfile), jobs, workers, overwrite)
+
+
+def decrypt_files(unwrap: stream.Unwrap, key_length: int, jobs: t.Sequence[Job], workers: t.Optional[int] = None, overwrite: bool = False) -> BatchResult:
+	return run_batch(lambda infile, outfile: stream.decrypt_stream(unwrap, key_length, infile, outfile), jobs, workers, overwrite)
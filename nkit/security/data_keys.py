@@ -0,0 +1,76 @@
+import time
+import hashlib
+import threading
+import typing as t
+import collections
+
+CacheInfo = collections.namedtuple("CacheInfo", ["hits", "misses", "evictions"])
+
+# (secret id, sha256 of wrapped key)
+EntryKey = t.Tuple[t.Optional[int], bytes]
+
+
+class DataKeyCache:
+	""" lru of unwrapped aes keys of `pass_rsa.encrypt_large` contents, in memory only
+
+	a hit skips the rsa decryption of the wrapped key, the expensive part of decrypting a small secret.
+	entries are keyed by secret id and the wrapped key itself: rewriting a secret wraps a new aes key,
+	so an old entry is never used for new content. they expire ttl seconds after being added and the
+	least recently used goes once there are more then maxsize.
+	keys are held in bytearrays which are overwritten with zeros when evicted or cleared, python may
+	still have short lived copies of them around (that's as far as zeroizing goes in python)
+	"""
+	def __init__(self, maxsize: int = 1024, ttl: float = 300):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self._entries: "collections.OrderedDict[EntryKey, t.Tuple[bytearray, float]]" = collections.OrderedDict()
+		# agent decrypts in executor threads
+		self._lock = threading.Lock()
+		self._hits = self._misses = self._evictions = 0
+
+	def cache_info(self) -> CacheInfo:
+		return CacheInfo(self._hits, self._misses, self._evictions)
+
+	def __len__(self) -> int:
+		return len(self._entries)
+
+	def unwrap(self, wrapped_key: t.Union[bytes, memoryview], unwrap: t.Callable[[], bytes], key_id: t.Optional[int] = None) -> bytes:
+		# cached aes key of wrapped_key, unwrap() is called on a miss
+		entry_key = (key_id, hashlib.sha256(wrapped_key).digest())
+		now = time.monotonic()
+		with self._lock:
+			entry = self._entries.get(entry_key)
+			if entry is not None and entry[1] > now:
+				self._hits += 1
+				self._entries.move_to_end(entry_key)
+				return bytes(entry[0])
+			if entry is not None:
+				self._evict(entry_key)
+			self._misses += 1
+
+		aes_key = unwrap()
+		if self.ttl <= 0 or self.maxsize <= 0:
+			return aes_key
+		with self._lock:
+			if entry_key in self._entries:
+				self._evict(entry_key)
+			self._entries[entry_key] = (bytearray(aes_key), now + self.ttl)
+			while len(self._entries) > self.maxsize:
+				self._evict(next(iter(self._entries)))
+		return aes_key
+
+	def expire(self):
+		now = time.monotonic()
+		with self._lock:
+			for entry_key in [entry_key for entry_key, (_, expires) in self._entries.items() if expires <= now]:
+				self._evict(entry_key)
+
+	def clear(self):
+		with self._lock:
+			for entry_key in list(self._entries):
+				self._evict(entry_key)
+
+	def _evict(self, entry_key: EntryKey):
+		aes_key, _ = self._entries.pop(entry_key)
+		aes_key[:] = bytes(len(aes_key))
+		self._evictions += 1
@@ -0,0 +1,119 @@
+""" master key secrets are encrypted to, wrapped under the password derived key
+
+	password --generate_rsa_key--> password key --wraps--> master key --wraps--> aes key of each secret
+
+master key is a random rsa key, secrets and files are `pass_rsa.encrypt_large`d to its public half
+(so adding one needs no password) and only the master key is wrapped under the password key.
+changing password rewraps that one record, whatever the number of secrets.
+
+file is json: {"public": master public pem, "wrapped": {password key fingerprint: encrypt_large of master der},
+"migrating": true while secrets from before master keys are re-encrypted to it,
+"legacy": encrypt_large of the password key from before master keys, to master public key}
+
+installs from before master keys keep their old password key in "legacy": secrets are re-encrypted once,
+but files from `keys encrypt` can't be, they're opened with it (`fallback`) after the password changed.
+
+master key is random, so machines sharing keys share this record too (`sync.push_master`/`sync.pull_master`).
+only a password whose key it's wrapped for opens it, as with password derived keys before.
+"""
+import json
+import base64
+import hashlib
+import typing as t
+from pathlib import Path
+
+from Crypto.PublicKey import RSA
+
+from . import pass_rsa
+
+MASTER_BITS = 2048
+
+
+def fingerprint(public_key: RSA.RsaKey) -> str:
+	return hashlib.sha256(public_key.export_key("DER")).hexdigest()
+
+
+def read(path: Path) -> t.Dict[str, t.Any]:
+	return json.loads(path.read_text())
+
+
+def write(path: Path, master_key: RSA.RsaKey, password_keys: t.Sequence[RSA.RsaKey], migrating: bool = False,
+		legacy: t.Optional[RSA.RsaKey] = None):
+	# master_key wrapped for every public password key given, replaces file atomically
+	der = master_key.export_key("DER")
+	record = {
+		"public": master_key.publickey().export_key("PEM").decode("ascii"),
+		"wrapped": {fingerprint(key): base64.b64encode(pass_rsa.encrypt_large(key, der)).decode("ascii") for key in password_keys},
+		"migrating": migrating,
+	}
+	if legacy is not None:
+		record["legacy"] = base64.b64encode(pass_rsa.encrypt_large(master_key.publickey(), legacy.export_key("DER"))).decode("ascii")
+	write_record(path, record)
+
+
+def write_record(path: Path, record: t.Dict[str, t.Any]):
+	# record as `read` returns it, e.g. one pulled by sync
+	path.parent.mkdir(parents=True, exist_ok=True)
+	tmp_path = path.with_suffix(".tmp")
+	tmp_path.touch(mode=0o600)
+	tmp_path.write_text(json.dumps(record))
+	tmp_path.replace(path)
+
+
+def create(path: Path, password_key: RSA.RsaKey, migrating: bool = False, legacy: t.Optional[RSA.RsaKey] = None) -> RSA.RsaKey:
+	master_key = RSA.generate(MASTER_BITS)
+	write(path, master_key, [password_key.publickey()], migrating, legacy)
+	return master_key
+
+
+def public_key(path: Path) -> RSA.RsaKey:
+	return RSA.import_key(read(path)["public"])
+
+
+def migrating(path: Path) -> bool:
+	return read(path).get("migrating", False)
+
+
+def unwrap(path: Path, password_key: RSA.RsaKey) -> RSA.RsaKey:
+	# raises ValueError when master key isn't wrapped for this password
+	wrapped = read(path)["wrapped"].get(fingerprint(password_key.publickey()))
+	if wrapped is None:
+		raise ValueError("master key isn't wrapped for this password")
+	return RSA.import_key(pass_rsa.decrypt_large(password_key, base64.b64decode(wrapped)))
+
+
+def legacy_key(path: Path, master_key: RSA.RsaKey) -> t.Optional[RSA.RsaKey]:
+	# password key of the install from before master keys, None for installs that started with one
+	wrapped = read(path).get("legacy")
+	if wrapped is None:
+		return None
+	return RSA.import_key(pass_rsa.decrypt_large(master_key, base64.b64decode(wrapped)))
+
+
+def fallback(decrypt: t.Callable[..., bytes], keys: t.Sequence[RSA.RsaKey]) -> t.Callable[..., bytes]:
+	""" decrypt(content, ..) with the first of keys content is encrypted to, for decrypt(key, content, ..) functions
+
+	keys are master key then legacy key, a wrong key is told by ValueError of rsa oaep
+	"""
+	def decrypt_with_keys(content: t.Any, *args: t.Any, **kwargs: t.Any) -> bytes:
+		for key in keys[:-1]:
+			try:
+				return decrypt(key, content, *args, **kwargs)
+			except ValueError:
+				continue
+		return decrypt(keys[-1], content, *args, **kwargs)
+	return decrypt_with_keys
+
+
+def rotate(path: Path, old_password_key: RSA.RsaKey, new_password_key: RSA.RsaKey, switch: t.Callable[[], None]) -> RSA.RsaKey:
+	""" rewraps master key for new password, cost doesn't depend on number of secrets
+
+	switch (replacing stored public password key) is called while both passwords open master key,
+	so whatever point it's interrupted at, the password stored key says is the one that works
+	"""
+	master_key = unwrap(path, old_password_key)
+	legacy = legacy_key(path, master_key)
+	write(path, master_key, [old_password_key.publickey(), new_password_key.publickey()], migrating(path), legacy)
+	switch()
+	write(path, master_key, [new_password_key.publickey()], migrating(path), legacy)
+	return master_key
@@ -0,0 +1,133 @@
+import json
+import time
+import typing as t
+import collections
+from pathlib import Path
+
+from Crypto.PublicKey import RSA
+from Crypto.Cipher import AES
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import scrypt
+from Crypto.Random import get_random_bytes
+
+from . import pass_rsa
+
+CacheInfo = collections.namedtuple("CacheInfo", ["memory_hits", "disk_hits", "misses"])
+
+
+class KeyCache:
+	""" cache in front of `pass_rsa.generate_rsa_key`
+
+	two layers:
+	* memory: derived keys of this process, keyed by sha256 of passphrase
+	* disk (only when ttl > 0): derived primes sealed with AES-GCM under a scrypt key of the passphrase,
+	  so a script calling `nkit keys get` repeatedly pays ~50ms of scrypt instead of the prime search.
+	  scrypt is much cheaper than the prime search, so a stolen cache file is easier to brute force then pub.pem;
+	  that's why it's opt-in and expires.
+
+	file layout: MAGIC + 16salt + 8expiry + 16nonce + 16tag + ..sealed json,
+	header (everything before nonce) is authenticated too
+	"""
+	MAGIC = b"NKC1"
+	SALT_LENGTH = 16
+	# scrypt cost, ~50ms
+	KDF_N = 1<<14
+
+	def __init__(self, path: t.Optional[Path] = None, ttl: int = 0, maxsize: int = 8):
+		self.path = path
+		self.ttl = ttl
+		self.maxsize = maxsize
+		self._memory: "collections.OrderedDict[bytes, RSA.RsaKey]" = collections.OrderedDict()
+		self._persisted: t.Set[bytes] = set()
+		self._memory_hits = self._disk_hits = self._misses = 0
+
+	def cache_info(self) -> CacheInfo:
+		return CacheInfo(self._memory_hits, self._disk_hits, self._misses)
+
+	def _memo_key(self, passphrase: bytes, key_len: int) -> bytes:
+		return SHA256.new(key_len.to_bytes(4, "big") + passphrase).digest()
+
+	def get(self, passphrase: bytes, key_len: int = 2048, workers: t.Optional[int] = None) -> RSA.RsaKey:
+		memo_key = self._memo_key(passphrase, key_len)
+		if memo_key in self._memory:
+			self._memory_hits += 1
+			self._memory.move_to_end(memo_key)
+			return self._memory[memo_key]
+
+		primes = self._load(passphrase, key_len)
+		if primes is not None:
+			self._disk_hits += 1
+			self._persisted.add(memo_key)
+		else:
+			self._misses += 1
+			primes = pass_rsa.generate_rsa_primes(passphrase, key_len, workers)
+
+		private_key = pass_rsa.generate_keys_from_primes(*primes)
+		self._memory[memo_key] = private_key
+		if len(self._memory) > self.maxsize:
+			self._memory.popitem(last=False)
+		return private_key
+
+	def keep(self, passphrase: bytes, private_key: RSA.RsaKey, key_len: int = 2048):
+		""" persist key to disk cache, call it only once passphrase is known to be correct
+
+		otherwise a mistyped password would replace the cached key
+		"""
+		memo_key = self._memo_key(passphrase, key_len)
+		if not self._disk_enabled or memo_key in self._persisted:
+			return
+		primes = sorted([int(private_key.p), int(private_key.q)]) # type: ignore pycryptodome: p, q are set dynamically
+		self._store(passphrase, key_len, (primes[0], primes[1]))
+		self._persisted.add(memo_key)
+
+	def clear(self):
+		self._memory.clear()
+		self._persisted.clear()
+		if self.path is not None and self.path.exists():
+			self.path.unlink()
+
+	@property
+	def _disk_enabled(self) -> bool:
+		return self.path is not None and self.ttl > 0
+
+	def _kdf(self, passphrase: bytes, salt: bytes) -> bytes:
+		return scrypt(passphrase, salt, 16, N=self.KDF_N, r=8, p=1) # type: ignore returns bytes for single key
+
+	def _load(self, passphrase: bytes, key_len: int) -> t.Optional[t.Tuple[int, int]]:
+		if not self._disk_enabled or not self.path.exists(): # type: ignore checked by _disk_enabled
+			return None
+		content = self.path.read_bytes() # type: ignore checked by _disk_enabled
+		header_length = len(self.MAGIC) + self.SALT_LENGTH + 8
+		if len(content) < header_length + 32 or not content.startswith(self.MAGIC):
+			return None
+		header = content[:header_length]
+		expires = int.from_bytes(header[-8:], "big")
+		if expires < time.time():
+			return None
+
+		salt = header[len(self.MAGIC):len(self.MAGIC) + self.SALT_LENGTH]
+		nonce = content[header_length:header_length + 16]
+		tag = content[header_length + 16:header_length + 32]
+		cipher = AES.new(self._kdf(passphrase, salt), AES.MODE_GCM, nonce=nonce)
+		cipher.update(header)
+		try:
+			entry = json.loads(cipher.decrypt_and_verify(content[header_length + 32:], tag)) # type: ignore decrypt_and_verify method isn't recognized
+		except ValueError:
+			# other passphrase or tampered file
+			return None
+		if entry["key_len"] != key_len:
+			return None
+		return entry["p"], entry["q"]
+
+	def _store(self, passphrase: bytes, key_len: int, primes: t.Tuple[int, int]):
+		salt = get_random_bytes(self.SALT_LENGTH)
+		header = self.MAGIC + salt + int(time.time() + self.ttl).to_bytes(8, "big")
+		cipher = AES.new(self._kdf(passphrase, salt), AES.MODE_GCM)
+		cipher.update(header)
+		entry = json.dumps({"key_len": key_len, "p": primes[0], "q": primes[1]}).encode("utf-8")
+		sealed, tag = cipher.encrypt_and_digest(entry) # type: ignore encrypt_and_digest method isn't recognized
+		self.path.parent.mkdir(parents=True, exist_ok=True) # type: ignore checked by _disk_enabled
+		tmp_path = self.path.with_suffix(".tmp") # type: ignore checked by _disk_enabled
+		tmp_path.touch(mode=0o600)
+		tmp_path.write_bytes(header + cipher.nonce + tag + sealed) # type: ignore pycryptodome: nonce is set for GCM
+		tmp_path.replace(self.path) # type: ignore checked by _disk_enabled
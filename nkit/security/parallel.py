@@ -0,0 +1,97 @@
+import typing as t
+import concurrent.futures as cf
+
+from . import sieve
+
+
+class PrimeSearch:
+	""" state of one `next_prime` search split into fixed size chunks
+
+	chunk i covers [start + i*chunk_size, start + (i+1)*chunk_size), chunks may finish in any order
+	but the search only resolves once every lower chunk is known to be prime free,
+	so the answer is always the lowest prime, same as the serial search.
+	"""
+	def __init__(self, num: int, chunk_size: int):
+		assert num > 1
+		bit_length = num.bit_length()
+		self.end = (1<<bit_length) - 1
+		self.min_for_bit_length = 1<<(bit_length -1)
+		self.chunk_size = chunk_size
+		self.generation = 0
+		self._reset(num)
+
+	def _reset(self, num: int):
+		self.num = num
+		self.start = num + 1
+		self.submitted = 0
+		self.resolved = 0
+		self.results: t.Dict[int, t.Optional[int]] = {}
+		self.prime: t.Optional[int] = None
+
+	@property
+	def done(self) -> bool:
+		return self.prime is not None
+
+	@property
+	def has_chunks(self) -> bool:
+		return not self.done and self.start + self.submitted*self.chunk_size < self.end
+
+	def next_chunk(self) -> t.Tuple[int, int, int]:
+		index = self.submitted
+		base = self.start + index*self.chunk_size
+		self.submitted += 1
+		return index, base, min(self.chunk_size, self.end - base)
+
+	def record(self, index: int, prime: t.Optional[int]):
+		self.results[index] = prime
+		while self.resolved in self.results:
+			prime = self.results.pop(self.resolved)
+			if prime is not None:
+				self.prime = prime
+				return
+			self.resolved += 1
+
+		if self.start + self.resolved*self.chunk_size >= self.end:
+			# whole bit range is prime free, cycle from the bottom like `sieve.next_prime`
+			if self.num == self.min_for_bit_length:
+				raise ValueError(f"No prime in bit length of {self.end.bit_length()}")
+			self.generation += 1
+			self._reset(self.min_for_bit_length)
+
+
+def next_primes(nums: t.Sequence[int], is_prime: t.Callable[[int], bool], workers: int, chunk_size: t.Optional[int] = None) -> t.List[int]:
+	""" `sieve.next_prime` for every num at once, spread over a process pool
+
+	all searches advance together (round robin) and each one keeps several chunks in flight.
+	`is_prime` has to be picklable i.e. a module level function.
+	"""
+	if chunk_size is None:
+		bit_length = max(num.bit_length() for num in nums)
+		# small chunks so a single prime gap is shared by several workers
+		chunk_size = max(64, 4*bit_length*len(nums)//workers)
+	searches = [PrimeSearch(num, chunk_size) for num in nums]
+
+	pending: t.Dict[cf.Future, t.Tuple[PrimeSearch, int, int]] = {}
+	with cf.ProcessPoolExecutor(max_workers=workers) as pool:
+		try:
+			while not all(search.done for search in searches):
+				while len(pending) < 2*workers:
+					open_searches = [search for search in searches if search.has_chunks]
+					if not open_searches:
+						break
+					for search in open_searches:
+						index, base, size = search.next_chunk()
+						future = pool.submit(sieve.first_prime_in, base, size, is_prime)
+						pending[future] = (search, search.generation, index)
+
+				finished, _ = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+				for future in finished:
+					search, generation, index = pending.pop(future)
+					if search.done or generation != search.generation:
+						continue
+					search.record(index, future.result())
+		finally:
+			# chunks above the winning ones are useless, don't wait for them
+			for future in pending:
+				future.cancel()
+	return [search.prime for search in searches] # type: ignore all searches are done
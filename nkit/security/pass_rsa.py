@@ -1,6 +1,5 @@
-import math
+import mmap
 import typing as t
-import random
 
 
 from Crypto.PublicKey import RSA
@@ -9,57 +8,30 @@ from Crypto.Cipher import PKCS1_v1_5, AES
 from Crypto.Hash import SHA256
 from Crypto.Random import get_random_bytes
 
+from . import sieve, parallel, arith
+from .data_keys import DataKeyCache
+
 
 # TODO:  add references
 def lcm(a: int, b: int) -> int:
-	return a*b // math.gcd(a, b)
+	return arith.lcm(a, b)
 
 def to_int(key: bytes) -> int:
 	return int(key.hex(), 16)
 
 def rabinMiller(num: int, trials: int = 40) -> bool:
-	s = num - 1
-	t = 0
-
-	while s % 2 == 0:
-		s = s // 2
-		t += 1
-	for _ in range(trials):
-		a = random.randrange(2, num - 1)
-		v = pow(a, s, num)
-		if v != 1:
-			i = 0
-			while v != (num - 1):
-				if i == t - 1:
-					return False
-				else:
-					i = i + 1
-					v = (v ** 2) % num
-	return True
+	return arith.miller_rabin(num, trials)
 
 def is_prime(num: int) -> bool:
-	# TODO: do more checks
-	if (num < 2):
-		return False
-	lowPrimes = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61,
-	67, 71, 73, 79, 83, 89, 97, 101, 103, 107, 109, 113, 127, 131, 137, 139, 149, 151,
-	157, 163, 167, 173, 179, 181, 191, 193, 197, 199, 211, 223, 227, 229, 233, 239, 241,
-	251, 257, 263, 269, 271, 277, 281, 283, 293, 307, 311, 313,317, 331, 337, 347, 349,
-	353, 359, 367, 373, 379, 383, 389, 397, 401, 409, 419, 421, 431, 433, 439, 443, 449,
-	457, 461, 463, 467, 479, 487, 491, 499, 503, 509, 521, 523, 541, 547, 557, 563, 569,
-	571, 577, 587, 593, 599, 601, 607, 613, 617, 619, 631, 641, 643, 647, 653, 659, 661,
-	673, 677, 683, 691, 701, 709, 719, 727, 733, 739, 743, 751, 757, 761, 769, 773, 787,
-	797, 809, 811, 821, 823, 827, 829, 839, 853, 857, 859, 863, 877, 881, 883, 887, 907,
-	911, 919, 929, 937, 941, 947, 953, 967, 971, 977, 983, 991, 997]
-
-	if num in lowPrimes:
-		return True
-	for prime in lowPrimes:
-		if (num % prime == 0):
-			return False
-	return rabinMiller(num)
+	# module level so process pools can pickle it, backend is looked up on every call
+	return arith.is_prime(num)
 
 def get_next_prime(num: int, cycle: bool = True) -> int:
+	# sieve finds exactly the prime `get_next_prime_linear` would, only faster
+	return sieve.next_prime(num, is_prime, cycle=cycle)
+
+def get_next_prime_linear(num: int, cycle: bool = True) -> int:
+	# reference implementation, kept for benchmarks and equivalence tests
 	assert num > 1
 	bit_length = len(bin(num)) - 2
 	max_for_bit_length = (1<<bit_length) - 1
@@ -73,7 +45,7 @@ def get_next_prime(num: int, cycle: bool = True) -> int:
 			return prime_candidate
 		prime_candidate += 1
 	if cycle:
-		return get_next_prime(min_for_bit_length)
+		return get_next_prime_linear(min_for_bit_length)
 	else:
 		raise ValueError(f"No prime greater then {num} in bit length of {bit_length}")
 
@@ -85,19 +57,10 @@ def get_var_hash(passphrase: bytes, length: int) -> bytes:
 	return shake.read(length)
 
 def egcd(a: int, b: int)-> t.Tuple[int, int, int]:
-	if a == 0:
-		return (b, 0, 1)
-	else:
-		g, y, x = egcd(b % a, a)
-		return (g, x - (b // a) * y, y)
+	return arith.egcd(a, b)
 
-#### https://stackoverflow.com/a/9758173/14624614
 def modinv(a:int, m:int) -> int:
-	g, x, _ = egcd(a, m)
-	if g != 1:
-		raise Exception('modular inverse does not exist')
-	else:
-		return x % m
+	return arith.invert(a, m)
 
 def get_components(p: int, q: int, e: int = 65537) -> t.Tuple[int, int, int, int, int, int]:
 	# TODO: make checks if they all are correct
@@ -119,7 +82,20 @@ def generate_keys_from_primes(prime1: int, prime2: int) -> RSA.RsaKey:
 
 
 
-def generate_rsa_key(passphrase: bytes, key_len: int = 2048) -> RSA.RsaKey:
+def get_prime_seeds(passphrase: bytes, key_len: int = 2048) -> t.Tuple[int, int]:
+	# integers the two primes are searched from, see `generate_rsa_key`
+	key_len_bytes = key_len//8
+	hash1 = get_var_hash(passphrase, key_len_bytes//2)
+	hash2 = get_var_hash(hash1, key_len_bytes - (key_len_bytes//2))
+	return to_int(hash1), to_int(hash2)
+
+def find_primes(seeds: t.Sequence[int], workers: t.Optional[int] = None) -> t.List[int]:
+	# workers > 1 searches all seeds together in a process pool, result is the same either way
+	if workers is None or workers <= 1:
+		return [get_next_prime(seed) for seed in seeds]
+	return parallel.next_primes(seeds, is_prime, workers)
+
+def generate_rsa_key(passphrase: bytes, key_len: int = 2048, workers: t.Optional[int] = None) -> RSA.RsaKey:
 	""" algorithm
 
 	passphrase ------------------------>   hash1 -----------------------> hash2
@@ -145,19 +121,17 @@ def generate_rsa_key(passphrase: bytes, key_len: int = 2048) -> RSA.RsaKey:
 	* ctr is for tweaking length of resulting prime numbers
 	* we can do as many sha-256+ctr iteration as we want to increase compute time
 	* if next prime number is not found in the bit range of number then start from 10000000...(i.e. 1<<(bit_length-1)) again
+	* with `workers` > 1 both primes are searched at the same time in a process pool, output doesn't change
 	"""
 
-	key_len_bytes = key_len//8
-	hash1 = get_var_hash(passphrase, key_len_bytes//2)
-	hash2 = get_var_hash(hash1, key_len_bytes - (key_len_bytes//2))
-	hash1_int = to_int(hash1)
-	hash2_int = to_int(hash2)
-	prime1 = get_next_prime(hash1_int)
-	prime2 = get_next_prime(hash2_int)
-	primes = [prime1, prime2]
-	private_key = generate_keys_from_primes(*sorted(primes))
+	private_key = generate_keys_from_primes(*generate_rsa_primes(passphrase, key_len, workers))
 	return private_key
 
+def generate_rsa_primes(passphrase: bytes, key_len: int = 2048, workers: t.Optional[int] = None) -> t.Tuple[int, int]:
+	# sorted primes behind `generate_rsa_key`, this is the expensive part
+	prime1, prime2 = sorted(find_primes(get_prime_seeds(passphrase, key_len), workers))
+	return prime1, prime2
+
 def encrypt(public_key: RSA.RsaKey, content: bytes) -> bytes:
 	cipher = PKCS1_v1_5.new(public_key)
 	try:
@@ -165,15 +139,22 @@ def encrypt(public_key: RSA.RsaKey, content: bytes) -> bytes:
 	except ValueError:
 		raise ValueError("content too long to encrypt. use encrypt_large which uses aes encryption")
 
-def decrypt(private_key: RSA.RsaKey, content: bytes) -> bytes:
+# returned by PKCS1_v1_5 on failure. not a byte string so nothing is allocated per call
+# and failure can be told apart from content by identity
+DECRYPT_FAILED = object()
+
+# anything supporting buffer protocol: bytes, bytearray, memoryview, mmap
+Buffer = t.Union[bytes, bytearray, memoryview, mmap.mmap]
+WritableBuffer = t.Union[bytearray, memoryview]
+
+def decrypt(private_key: RSA.RsaKey, content: Buffer) -> bytes:
 	cipher = PKCS1_v1_5.new(private_key)
-	# large length is necessary, because RSA generally cannot encrypt this long content. so it will raise ValueError
-	# TODO: lookup about maximum length contraint
-	large_senintel = b"a"*2048*2048
 	try:
-		original_content = cipher.decrypt(content, large_senintel) # type: ignore TODO: error in .pyi file
+		original_content = cipher.decrypt(content, DECRYPT_FAILED) # type: ignore TODO: error in .pyi file
 	except ValueError:
 		raise ValueError("Either content is invalid or private key is wrong")
+	if original_content is DECRYPT_FAILED:
+		raise ValueError("Either content is invalid or private key is wrong")
 
 	return original_content
 
@@ -188,24 +169,54 @@ def encrypt_large(public_key: RSA.RsaKey, content: bytes) -> bytes:
 	assert isinstance(cipher.nonce, bytes) # type: ignore pycryptodome: assert covers ^
 	return encrypt(public_key, aes_key) + tag + cipher.nonce + encoded_bytes # type: ignore pycryptodome: assert covers ^
 
-def decrypt_large(private_key: RSA.RsaKey, content: bytes) -> bytes:
-	key_length = private_key._n.size_in_bytes() # type: ignore pycryptodome: _n is dynamically added
+def split_large(content: Buffer, key_length: int) -> t.Tuple[memoryview, memoryview, memoryview, memoryview]:
+	# views of (wrapped key, tag, nonce, encrypted data) in `encrypt_large` output, nothing is copied
 	nonce_length = tag_length = 16
-	if len(content) < key_length + 16:
+	view = memoryview(content)
+	if len(view) < key_length + tag_length + nonce_length:
 		raise ValueError("Not valid content")
 
-	pointer = 0
-	aes_key = decrypt(private_key, content[pointer:pointer + key_length])
-	pointer += key_length
-
-	tag = content[pointer:pointer+tag_length]
+	pointer = key_length
+	tag = view[pointer:pointer+tag_length]
 	pointer += tag_length
-
-	nonce = content[pointer:pointer+nonce_length]
+	nonce = view[pointer:pointer+nonce_length]
 	pointer += nonce_length
+	return view[:key_length], tag, nonce, view[pointer:]
+
+def aes_decrypt_into(aes_key: bytes, nonce: Buffer, tag: Buffer, encrypted_data: Buffer, output: t.Optional[WritableBuffer] = None) -> WritableBuffer:
+	if output is None:
+		output = bytearray(len(encrypted_data))
+	elif len(output) != len(encrypted_data):
+		raise ValueError(f"output buffer must be of {len(encrypted_data)} bytes")
+	cipher = AES.new(aes_key, AES.MODE_GCM, nonce=nonce)
+	try:
+		cipher.decrypt_and_verify(encrypted_data, tag, output=output) # type: ignore decrypt_and_verify method isn't recognized
+	except ValueError:
+		# don't leave unauthenticated plain text in caller's buffer
+		output[:] = bytes(len(output))
+		raise
+	return output
 
-	encrypted_data = content[pointer:]
+def decrypted_length(private_key: RSA.RsaKey, content: Buffer) -> int:
+	# size of output buffer `decrypt_large_into` needs
+	return len(split_large(content, private_key.size_in_bytes())[3])
 
+def decrypt_large_into(private_key: RSA.RsaKey, content: Buffer, output: t.Optional[WritableBuffer] = None) -> WritableBuffer:
+	""" zero copy `decrypt_large`
+
+	content is only viewed, never sliced into new bytes. plain text is written into `output`
+	(of `decrypted_length` bytes) or into a newly allocated bytearray, and returned
+	"""
+	wrapped_key, tag, nonce, encrypted_data = split_large(content, private_key.size_in_bytes())
+	return aes_decrypt_into(decrypt(private_key, wrapped_key), nonce, tag, encrypted_data, output)
+
+def decrypt_large(private_key: RSA.RsaKey, content: Buffer, data_keys: t.Optional[DataKeyCache] = None, key_id: t.Optional[int] = None) -> bytes:
+	# with data_keys, aes key unwrapped earlier (for key_id e.g. secret id) is reused instead of rsa decrypting it again
+	wrapped_key, tag, nonce, encrypted_data = split_large(content, private_key.size_in_bytes())
+	if data_keys is not None:
+		aes_key = data_keys.unwrap(wrapped_key, lambda: decrypt(private_key, wrapped_key), key_id)
+	else:
+		aes_key = decrypt(private_key, wrapped_key)
 	cipher = AES.new(aes_key, AES.MODE_GCM, nonce=nonce)
 	decoded_content = cipher.decrypt_and_verify(encrypted_data, tag) # type: ignore decrypt_and_verify method isn't recognized
 
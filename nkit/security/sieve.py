@@ -0,0 +1,73 @@
+import functools
+import typing as t
+
+# primes below this are used to strike out candidates before miller-rabin
+SIEVE_LIMIT = 1<<16
+
+
+@functools.lru_cache(maxsize=None)
+def small_primes(limit: int = SIEVE_LIMIT) -> t.Tuple[int, ...]:
+	# plain sieve of eratosthenes, only runs once per limit
+	flags = bytearray([1]) * limit
+	flags[0:2] = b"\x00\x00"
+	for num in range(2, int(limit ** 0.5) + 1):
+		if flags[num]:
+			flags[num*num::num] = bytes(len(range(num*num, limit, num)))
+	return tuple(num for num in range(limit) if flags[num])
+
+
+def sieve_window(base: int, size: int, primes: t.Sequence[int]) -> bytearray:
+	""" returns flags for base, base+1 ... base+size-1
+
+	a flag is 0 when the candidate has a small prime factor (and isn't that prime itself)
+	so only flagged candidates need a full primality test
+	"""
+	window = bytearray([1]) * size
+	zeros = memoryview(bytes(size))
+	for prime in primes:
+		start = (-base) % prime
+		if base + start == prime:
+			# candidate is the small prime itself
+			start += prime
+		if start < size:
+			window[start::prime] = zeros[:(size - 1 - start)//prime + 1]
+	return window
+
+
+def first_prime_in(base: int, size: int, is_prime: t.Callable[[int], bool], primes: t.Optional[t.Sequence[int]] = None) -> t.Optional[int]:
+	# lowest prime in [base, base+size), None if there isn't any
+	window = sieve_window(base, size, small_primes() if primes is None else primes)
+	offset = window.find(1)
+	while offset != -1:
+		if is_prime(base + offset):
+			return base + offset
+		offset = window.find(1, offset + 1)
+	return None
+
+
+def next_prime(num: int, is_prime: t.Callable[[int], bool], cycle: bool = True, window_size: t.Optional[int] = None) -> int:
+	""" sieve backed equivalent of `pass_rsa.get_next_prime_linear`
+
+	candidates are walked in the same increasing order, sieve only skips the ones
+	that are composite anyway, so the first prime found (and hence the key) is the same.
+	"""
+	assert num > 1
+	bit_length = num.bit_length()
+	max_for_bit_length = (1<<bit_length) - 1
+	min_for_bit_length = 1<<(bit_length -1)
+	if window_size is None:
+		# expected prime gap is ~ln(num) i.e. ~0.7*bit_length, keep a few gaps per window
+		window_size = max(256, 4*bit_length)
+	primes = small_primes()
+
+	base = num + 1
+	while base < max_for_bit_length:
+		size = min(window_size, max_for_bit_length - base)
+		prime = first_prime_in(base, size, is_prime, primes)
+		if prime is not None:
+			return prime
+		base += size
+	if cycle:
+		return next_prime(min_for_bit_length, is_prime, window_size=window_size)
+	else:
+		raise ValueError(f"No prime greater then {num} in bit length of {bit_length}")
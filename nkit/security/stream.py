@@ -0,0 +1,157 @@
+""" chunked AES-GCM container, encrypts/decrypts files of any size in constant memory
+
+	MAGIC + 1version + 4chunk_size + 2key_length + ..wrapped aes key        (header)
+	1flags + 12nonce + 4length + ..encrypted chunk + 16tag                  (repeated)
+
+every chunk is authenticated together with the header, its index and flags, so chunks can't be
+reordered, moved between files or dropped; only the last chunk has FINAL flag, so truncation is caught.
+content without MAGIC is the single blob format of `pass_rsa.encrypt_large`
+"""
+import typing as t
+
+from Crypto.PublicKey import RSA
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+
+from . import pass_rsa
+
+MAGIC = b"NKST"
+VERSION = 1
+CHUNK_SIZE = 1<<20
+# chunk size comes from the unauthenticated header, decryption allocates a buffer of it
+MAX_CHUNK_SIZE = 16 * CHUNK_SIZE
+FINAL = 1
+NONCE_LENGTH = 12
+TAG_LENGTH = 16
+
+# rsa decryption of wrapped aes key, a private key or an agent can do it
+Unwrap = t.Callable[[bytes], bytes]
+
+
+def read_exact(f: t.BinaryIO, length: int) -> bytes:
+	data = f.read(length)
+	while len(data) < length:
+		more = f.read(length - len(data))
+		if not more:
+			break
+		data += more
+	return data
+
+
+def chunk_aad(header: bytes, index: int, flags: int) -> bytes:
+	return header + index.to_bytes(8, "big") + bytes([flags])
+
+
+def encrypt_stream(public_key: RSA.RsaKey, infile: t.BinaryIO, outfile: t.BinaryIO, chunk_size: int = CHUNK_SIZE) -> int:
+	# returns number of plain bytes encrypted
+	if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+		raise ValueError(f"chunk size has to be between 1 and {MAX_CHUNK_SIZE}")
+	aes_key = get_random_bytes(16)
+	wrapped = pass_rsa.encrypt(public_key, aes_key)
+	header = MAGIC + bytes([VERSION]) + chunk_size.to_bytes(4, "big") + len(wrapped).to_bytes(2, "big") + wrapped
+	outfile.write(header)
+
+	total = 0
+	index = 0
+	chunk = read_exact(infile, chunk_size)
+	while True:
+		# read ahead to know if this is the last chunk
+		next_chunk = read_exact(infile, chunk_size) if len(chunk) == chunk_size else b""
+		flags = FINAL if not next_chunk else 0
+		nonce = get_random_bytes(NONCE_LENGTH)
+		cipher = AES.new(aes_key, AES.MODE_GCM, nonce=nonce)
+		cipher.update(chunk_aad(header, index, flags))
+		encrypted, tag = cipher.encrypt_and_digest(chunk) # type: ignore encrypt_and_digest method isn't recognized
+		outfile.write(bytes([flags]) + nonce + len(chunk).to_bytes(4, "big"))
+		outfile.write(encrypted)
+		outfile.write(tag)
+		total += len(chunk)
+		if flags & FINAL:
+			return total
+		chunk = next_chunk
+		index += 1
+
+
+class BufferReader:
+	# file like reading over a buffer (e.g. mmap), reads return views instead of copies
+	def __init__(self, content: pass_rsa.Buffer):
+		self.view = memoryview(content)
+		self.position = 0
+
+	def read(self, length: int = -1) -> memoryview:
+		end = len(self.view) if length < 0 else min(len(self.view), self.position + length)
+		data = self.view[self.position:end]
+		self.position = end
+		return data
+
+
+def decrypt_stream(unwrap: Unwrap, key_length: int, infile: t.BinaryIO, outfile: t.BinaryIO) -> int:
+	""" decrypts both chunked and single blob content, returns number of plain bytes written
+
+	raises ValueError if content is invalid, truncated or key is wrong
+	"""
+	magic = read_exact(infile, len(MAGIC))
+	if magic != MAGIC:
+		# single blob format has to be read whole
+		return decrypt_blob(unwrap, key_length, magic + infile.read(), outfile)
+	return decrypt_chunks(unwrap, infile, outfile)
+
+
+def decrypt_buffer(unwrap: Unwrap, key_length: int, content: pass_rsa.Buffer, outfile: t.BinaryIO) -> int:
+	# `decrypt_stream` for content already in memory or mapped, encrypted bytes are never copied
+	view = memoryview(content)
+	if view[:len(MAGIC)] != MAGIC:
+		return decrypt_blob(unwrap, key_length, view, outfile)
+	return decrypt_chunks(unwrap, BufferReader(view[len(MAGIC):]), outfile) # type: ignore reads like a binary file
+
+
+def decrypt_chunks(unwrap: Unwrap, infile: t.BinaryIO, outfile: t.BinaryIO) -> int:
+	# infile is positioned right after MAGIC
+	fixed = read_exact(infile, 7)
+	if len(fixed) < 7:
+		raise ValueError("Not valid content")
+	if fixed[0] != VERSION:
+		raise ValueError(f"Unsupported format version {fixed[0]}")
+	chunk_size = int.from_bytes(fixed[1:5], "big")
+	if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+		raise ValueError("Not valid content")
+	wrapped = read_exact(infile, int.from_bytes(fixed[5:7], "big"))
+	header = MAGIC + fixed + wrapped
+	aes_key = unwrap(wrapped)
+
+	# every chunk is decrypted into the same buffer
+	plain = memoryview(bytearray(chunk_size))
+	total = 0
+	index = 0
+	while True:
+		prefix = read_exact(infile, 1 + NONCE_LENGTH + 4)
+		if len(prefix) < 1 + NONCE_LENGTH + 4:
+			raise ValueError("Content is truncated")
+		flags = prefix[0]
+		nonce = prefix[1:1 + NONCE_LENGTH]
+		length = int.from_bytes(prefix[1 + NONCE_LENGTH:], "big")
+		if length > chunk_size:
+			raise ValueError("Not valid content")
+		encrypted = read_exact(infile, length)
+		tag = read_exact(infile, TAG_LENGTH)
+		if len(encrypted) < length or len(tag) < TAG_LENGTH:
+			raise ValueError("Content is truncated")
+
+		cipher = AES.new(aes_key, AES.MODE_GCM, nonce=nonce)
+		cipher.update(chunk_aad(header, index, flags))
+		cipher.decrypt_and_verify(encrypted, tag, output=plain[:length]) # type: ignore decrypt_and_verify method isn't recognized
+		outfile.write(plain[:length])
+		total += length
+		if flags & FINAL:
+			if infile.read(1):
+				raise ValueError("Not valid content, data after last chunk")
+			return total
+		index += 1
+
+
+def decrypt_blob(unwrap: Unwrap, key_length: int, content: pass_rsa.Buffer, outfile: t.BinaryIO) -> int:
+	# single blob layout of `pass_rsa.encrypt_large`
+	wrapped_key, tag, nonce, encrypted_data = pass_rsa.split_large(content, key_length)
+	decrypted = pass_rsa.aes_decrypt_into(unwrap(wrapped_key), nonce, tag, encrypted_data)
+	outfile.write(decrypted)
+	return len(decrypted)
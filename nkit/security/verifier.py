@@ -0,0 +1,63 @@
+""" small record that tells a wrong password apart before the prime search of `pass_rsa.generate_rsa_key`
+
+verifier is scrypt over the SHAKE256 hash chain `pass_rsa.get_prime_seeds` starts from, salted.
+scrypt (~50ms) instead of one more SHAKE256 round: the file is next to pub.pem and a verifier
+checked in microseconds would make guessing passwords offline that much cheaper too, while 50ms is
+still far below the prime search.
+
+it belongs to the public key it was made with (by sha256 of pub.pem), one left behind by an
+interrupted password change is ignored instead of rejecting the right password.
+
+file layout: MAGIC + 32pub.pem sha256 + 16salt + 32digest
+"""
+import hmac
+import hashlib
+import typing as t
+from pathlib import Path
+
+from Crypto.Protocol.KDF import scrypt
+from Crypto.Random import get_random_bytes
+
+from . import pass_rsa
+
+MAGIC = b"NKV1"
+SALT_LENGTH = 16
+KDF_N = 1<<14
+# seeds of this key length are hashed, whatever length the key is derived with
+KEY_LEN = 2048
+
+
+def digest(passphrase: bytes, salt: bytes) -> bytes:
+	seeds = pass_rsa.get_prime_seeds(passphrase, KEY_LEN)
+	chain = b"".join(seed.to_bytes(KEY_LEN//16, "big") for seed in seeds)
+	return scrypt(chain, salt, 32, N=KDF_N, r=8, p=1) # type: ignore returns bytes for single key
+
+
+def write(path: Path, passphrase: bytes, public_key_pem: bytes):
+	salt = get_random_bytes(SALT_LENGTH)
+	tmp_path = path.with_suffix(".tmp")
+	tmp_path.write_bytes(MAGIC + hashlib.sha256(public_key_pem).digest() + salt + digest(passphrase, salt))
+	tmp_path.replace(path)
+
+
+def belongs_to(content: bytes, public_key_pem: bytes) -> bool:
+	if len(content) != len(MAGIC) + 32 + SALT_LENGTH + 32 or not content.startswith(MAGIC):
+		return False
+	return hmac.compare_digest(content[len(MAGIC):len(MAGIC) + 32], hashlib.sha256(public_key_pem).digest())
+
+
+def exists(path: Path, public_key_pem: bytes) -> bool:
+	return path.exists() and belongs_to(path.read_bytes(), public_key_pem)
+
+
+def check(path: Path, passphrase: bytes, public_key_pem: bytes) -> t.Optional[bool]:
+	# None when there's no verifier for this public key, derive the key and compare to find out
+	try:
+		content = path.read_bytes()
+	except FileNotFoundError:
+		return None
+	if not belongs_to(content, public_key_pem):
+		return None
+	content = content[len(MAGIC):]
+	salt = content[32:32 + SALT_LENGTH]
+	return hmac.compare_digest(content[32 + SALT_LENGTH:], digest(passphrase, salt))
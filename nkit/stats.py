@@ -0,0 +1,62 @@
+""" note statistics for `nkit notes stats`, computed from per day counts (`NoteStore.daily_counts`)
+
+everything here is linear in days with notes, nothing reads notes themselves. days are utc days
+"""
+import datetime
+import typing as t
+
+from .models import DayCount
+from .types import NoteType
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def totals(counts: t.Iterable[DayCount]) -> t.Dict[NoteType, int]:
+	by_type: t.Dict[NoteType, int] = {}
+	for count in counts:
+		by_type[count.ty] = by_type.get(count.ty, 0) + count.count
+	return by_type
+
+
+def per_day(counts: t.Iterable[DayCount]) -> t.Dict[datetime.date, int]:
+	days: t.Dict[datetime.date, int] = {}
+	for count in counts:
+		days[count.day] = days.get(count.day, 0) + count.count
+	return days
+
+
+def week_start(day: datetime.date) -> datetime.date:
+	# monday of day's iso week
+	return day - datetime.timedelta(days=day.weekday())
+
+
+def per_week(days: t.Mapping[datetime.date, int]) -> t.Dict[datetime.date, int]:
+	# keyed by monday
+	weeks: t.Dict[datetime.date, int] = {}
+	for day, count in days.items():
+		weeks[week_start(day)] = weeks.get(week_start(day), 0) + count
+	return weeks
+
+
+def streaks(days: t.Iterable[datetime.date], today: datetime.date) -> t.Tuple[int, int]:
+	""" (current, longest) runs of consecutive days with notes
+
+	current streak still counts when today has no note yet but yesterday had
+	"""
+	longest = run = 0
+	previous = None
+	for day in sorted(set(days)):
+		run = run + 1 if previous is not None and day - previous == ONE_DAY else 1
+		longest = max(longest, run)
+		previous = day
+	current = run if previous is not None and today - previous <= ONE_DAY else 0
+	return current, longest
+
+
+def histogram(buckets: t.Sequence[t.Tuple[str, int]], width: int = 40) -> t.Iterator[str]:
+	# label, bar scaled to the largest bucket, count
+	top = max((count for _, count in buckets), default=0)
+	label_width = max((len(label) for label, _ in buckets), default=0)
+	for label, count in buckets:
+		bar = "█" * (round(count * width / top) if top else 0)
+		yield f"{label:<{label_width}}  {bar}{' ' if bar else ''}{count}"
@@ -1,3 +1,2 @@
 from . import local
-# TODO:
-#from . import remote
+# remote is imported where it's used, it pulls in httpx
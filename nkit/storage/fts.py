@@ -0,0 +1,91 @@
+""" sqlite FTS5 index over notes.msg
+
+notes_fts keeps its own copy of msg with rowid = notes.id, triggers keep it in sync with notes.
+databases created before the index existed are backfilled in batches, progress is kept in
+notes_fts_backfill so an interrupted backfill carries on where it stopped.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Engine, Connection
+from sqlalchemy.exc import OperationalError
+
+from . import schema
+
+TABLE = "notes_fts"
+BACKFILL_BATCH = 5000
+
+SCHEMA = [
+	f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5(msg, tokenize = 'unicode61 remove_diacritics 2')",
+	# notes with id <= upto existed before index did, backfill indexes them
+	f"CREATE TABLE IF NOT EXISTS {TABLE}_backfill (upto INTEGER NOT NULL, done INTEGER NOT NULL)",
+	f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_insert AFTER INSERT ON notes BEGIN
+		INSERT INTO {TABLE}(rowid, msg) VALUES (new.id, new.msg);
+	END""",
+	f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_delete AFTER DELETE ON notes BEGIN
+		DELETE FROM {TABLE} WHERE rowid = old.id;
+	END""",
+	f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_update AFTER UPDATE OF msg ON notes BEGIN
+		DELETE FROM {TABLE} WHERE rowid = old.id;
+		INSERT INTO {TABLE}(rowid, msg) VALUES (new.id, new.msg);
+	END""",
+]
+
+
+def create(engine: Engine) -> bool:
+	""" creates index if it's missing and backfills existing notes, False if sqlite has no fts5 """
+	try:
+		schema.create(engine, SCHEMA, start_backfill)
+	except OperationalError:
+		return False
+	backfill(engine)
+	return True
+
+
+def start_backfill(conn: Connection):
+	# in the transaction schema is created in. a half index left by older versions is refilled whole
+	conn.execute(text(f"DELETE FROM {TABLE}"))
+	conn.execute(text(f"DELETE FROM {TABLE}_backfill"))
+	upto = conn.execute(text("SELECT coalesce(max(id), 0) FROM notes")).scalar()
+	conn.execute(text(f"INSERT INTO {TABLE}_backfill (upto, done) VALUES (:upto, 0)"), {"upto": upto})
+
+
+def backfill(engine: Engine, batch_size: int = BACKFILL_BATCH) -> int:
+	# indexes pre-existing notes, one transaction per batch. returns number of notes indexed
+	total = 0
+	while True:
+		with engine.begin() as conn:
+			state = conn.execute(text(f"SELECT upto, done FROM {TABLE}_backfill")).first()
+			if state is None:
+				return total
+			if state.done >= state.upto:
+				conn.execute(text(f"DELETE FROM {TABLE}_backfill"))
+				return total
+			last = conn.execute(text(
+				"SELECT max(id) FROM (SELECT id FROM notes WHERE id > :done AND id <= :upto ORDER BY id LIMIT :limit)"),
+				{"done": state.done, "upto": state.upto, "limit": batch_size}).scalar()
+			if last is None:
+				last = state.upto
+			# rows updated in the meantime were already indexed by trigger
+			total += conn.execute(text(
+				f"""INSERT INTO {TABLE}(rowid, msg) SELECT id, msg FROM notes
+				WHERE id > :done AND id <= :last AND NOT EXISTS (SELECT 1 FROM {TABLE} WHERE rowid = notes.id)"""),
+				{"done": state.done, "last": last}).rowcount
+			conn.execute(text(f"UPDATE {TABLE}_backfill SET done = :last"), {"last": last})
+
+
+def rebuild(conn: Connection):
+	# drops whole index and refills it from notes
+	conn.execute(text(f"DELETE FROM {TABLE}"))
+	conn.execute(text(f"INSERT INTO {TABLE}(rowid, msg) SELECT id, msg FROM notes"))
+
+
+def to_query(search: str) -> str:
+	""" plain words to fts5 query, every word has to be present
+
+	words are quoted so punctuation isn't read as fts5 syntax, trailing * keeps prefix search
+	"""
+	terms = []
+	for word in search.split():
+		star = "*" if word.endswith("*") and len(word) > 1 else ""
+		word = word[:-1] if star else word
+		terms.append('"' + word.replace('"', '""') + '"' + star)
+	return " ".join(terms)
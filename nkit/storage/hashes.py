@@ -0,0 +1,97 @@
+""" content hashes of notes and keys, what sync identifies rows by
+
+hash covers what a row says, not where it lives: ids and refer_id are local to a database
+and left out. a delete (or a change of hash) leaves a tombstone in sync_deleted via triggers,
+so sync can tell a row deleted here from a row added on remote. rows from before hashes
+existed are backfilled on engine creation.
+"""
+import json
+import hashlib
+import datetime
+import typing as t
+
+from sqlalchemy import Table, select, bindparam, text
+from sqlalchemy.sql import ColumnElement
+from sqlalchemy.engine import Engine
+
+from .. import models
+from ..types import Hash, NoteType
+from . import schema
+
+TABLES = ["notes", "keys"]
+BACKFILL_BATCH = 5000
+
+SCHEMA = ["CREATE TABLE IF NOT EXISTS sync_deleted (kind TEXT NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (kind, hash))"]
+for name in TABLES:
+	SCHEMA += [
+		f"""CREATE TRIGGER IF NOT EXISTS {name}_sync_delete AFTER DELETE ON {name} WHEN old.hash IS NOT NULL BEGIN
+			INSERT OR IGNORE INTO sync_deleted (kind, hash) VALUES ('{name}', old.hash);
+		END""",
+		f"""CREATE TRIGGER IF NOT EXISTS {name}_sync_update AFTER UPDATE OF hash ON {name}
+			WHEN old.hash IS NOT NULL AND old.hash != new.hash BEGIN
+			INSERT OR IGNORE INTO sync_deleted (kind, hash) VALUES ('{name}', old.hash);
+		END""",
+		# same content added again isn't deleted anymore
+		f"""CREATE TRIGGER IF NOT EXISTS {name}_sync_insert AFTER INSERT ON {name} BEGIN
+			DELETE FROM sync_deleted WHERE kind = '{name}' AND hash = new.hash;
+		END""",
+	]
+
+
+def time_text(value: t.Optional[datetime.datetime]) -> t.Optional[str]:
+	# naive, like sqlite stores it
+	return value.replace(tzinfo=None).isoformat(timespec="microseconds") if value else None
+
+def parse_time(value: t.Optional[str]) -> t.Optional[datetime.datetime]:
+	return datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f") if value else None
+
+
+def sha256(fields: t.List[t.Any]) -> Hash:
+	return hashlib.sha256(json.dumps(fields, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def note_hash(row: t.Mapping[str, t.Any]) -> Hash:
+	# row is column values of notes
+	ty = row["ty"].value if isinstance(row["ty"], NoteType) else row["ty"]
+	return sha256(["notes", ty, row["msg"], time_text(row["created_at"]), bool(row["draft"]),
+		time_text(row["deadline"]), row["resources"], row["completed"]])
+
+def model_note_hash(note: t.Union[models.NoteCreate, models.AnyNote]) -> Hash:
+	# note_hash of a pydantic note or a NoteRow, for backends without a hash column
+	return note_hash({"ty": note.ty, "msg": note.msg, "created_at": note.created_at.to("utc").naive, "draft": note.draft,
+		"deadline": note.deadline.to("utc").naive if note.deadline else None, "resources": "\n".join(note.resources),
+		"completed": note.completed})
+
+def secret_hash(row: t.Mapping[str, t.Any]) -> Hash:
+	return sha256(["keys", row["title"], hashlib.sha256(row["data"]).hexdigest()])
+
+ROW_HASH = {"notes": note_hash, "keys": secret_hash}
+
+
+def add_columns(engine: Engine):
+	# hash column for databases from before sync, index is added by `local.create_indexes`
+	with engine.begin() as conn:
+		for name in TABLES:
+			columns = [row[1] for row in conn.execute(text(f"PRAGMA table_info({name})"))]
+			if "hash" not in columns:
+				conn.execute(text(f"ALTER TABLE {name} ADD COLUMN hash TEXT"))
+
+
+def create(engine: Engine, tables: t.Dict[str, t.Tuple[Table, t.List[ColumnElement]]]):
+	# tables maps name -> (table, its columns labeled with names row hash expects)
+	schema.create(engine, SCHEMA)
+	for name, (db_table, columns) in tables.items():
+		backfill(engine, db_table, columns, ROW_HASH[name])
+
+
+def backfill(engine: Engine, db_table: Table, columns: t.List[ColumnElement], row_hash: t.Callable[[t.Mapping[str, t.Any]], Hash],
+		batch_size: int = BACKFILL_BATCH) -> int:
+	# hashes rows that have none, one transaction per batch. returns number of rows hashed
+	total = 0
+	update = db_table.update().where(db_table.c.id == bindparam("row_id")).values(hash=bindparam("row_hash"))
+	while True:
+		with engine.begin() as conn:
+			rows = conn.execute(select(columns).where(db_table.c.hash.is_(None)).limit(batch_size)).fetchall()
+			if not rows:
+				return total
+			conn.execute(update, [{"row_id": row.id, "row_hash": row_hash(row._mapping)} for row in rows])
+			total += len(rows)
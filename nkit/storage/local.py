@@ -1,19 +1,39 @@
 # TODO: file needs split
 from .. import constants as c
+import re
+import base64
+import datetime
+import sys
+import threading
 import typing as t
+from pathlib import Path
 import arrow
 from .. import models
-from ..exceptions import CrudException
-from sqlalchemy import Column, Integer, Enum, Text, DateTime, Boolean, ForeignKey, BLOB
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from ..exceptions import CrudException, SyncError
+from . import fts, hashes, rollup
+from .storage import Storage, NoteStore, SecretStore, decode_cursor, note_cursor
+from ..types import Hash, Json
+from sqlalchemy import Column, Integer, Enum, Text, DateTime, Boolean, ForeignKey, BLOB, Index
+from sqlalchemy import inspect, create_engine, event, and_, func, text, literal_column, table, column, tuple_, literal, select
+from sqlalchemy.orm import sessionmaker, Session, aliased
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
+T = t.TypeVar("T")
+
 # TODO: add command to support all fields
 class Note(Base):
 	__tablename__ = "notes"
+	__table_args__ = (
+		# keyset pagination over (created_at, id), see `NoteDb.iter_recent`
+		Index("ix_notes_created_at_id", "created_at", "id"),
+		# replies of a note, see `NoteDb.thread`
+		Index("ix_notes_refer_id", "refer_id"),
+		# deadlines of notes not done yet, see `NoteDb.due`. queries repeat OPEN for sqlite to pick it
+		Index("ix_notes_open_deadline", "deadline", sqlite_where=text("completed IS NOT 1")),
+	)
 
 	id = Column('id', Integer, primary_key=True)
 	ty = Column('ty', Enum(models.NoteType), nullable=False)
@@ -24,10 +44,17 @@ class Note(Base):
 	resources = Column('resources', Text, nullable=False)
 	refer_id = Column('refer_id', ForeignKey('notes.id'), nullable=True)
 	completed = Column('completed', Boolean, nullable=True)
+	# content hash, see `hashes.note_hash`
+	hash = Column('hash', Text, nullable=True, index=True)
 
 	@classmethod
 	def from_pydantic(cls, note: t.Union[models.NoteCreate, models.Note]):
-		return cls(
+		return cls(**cls.row_from_pydantic(note))
+
+	@staticmethod
+	def row_from_pydantic(note: t.Union[models.NoteCreate, models.Note]) -> t.Dict[str, t.Any]:
+		# column values, for bulk inserts without ORM objects
+		row = dict(
 			id=note.id if isinstance(note, models.Note) else None,
 			ty=note.ty,
 			msg=note.msg,
@@ -38,6 +65,8 @@ class Note(Base):
 			refer_id=note.refer_id,
 			completed=note.completed
 			)
+		row["hash"] = hashes.note_hash(row)
+		return row
 
 	def to_pydantic(self) -> models.Note:
 		return models.Note(
@@ -46,25 +75,38 @@ class Note(Base):
 			msg=self.msg,
 			created_at=arrow.get(self.created_at),
 			draft=self.draft,
-			deadline=arrow.get(self.deadline),
+			deadline=arrow.get(self.deadline) if self.deadline else None,
 			resources=[a for a in self.resources.split("\n") if len(a)>0],
 			refer_id=self.refer_id,
 			completed=self.completed
 			)
 
+OPEN = text("completed IS NOT 1")
+
+# read paths select these columns with core and build rows from them, no orm objects or validation
+NOTE_COLUMNS = [Note.id, Note.ty, Note.msg, Note.created_at, Note.draft, Note.deadline, Note.resources, Note.refer_id, Note.completed]
+
+def note_rows(rows: t.Iterable[t.Sequence[t.Any]]) -> t.Iterator[models.NoteRow]:
+	NoteRow = models.NoteRow
+	return (NoteRow(*row) for row in rows)
+
+
 class Secret(Base):
 	__tablename__ = "keys"
 
 	id = Column('id', Integer, primary_key=True)
 	title = Column('title', Text, nullable=False, unique=True)
 	data = Column('encypted_bytes', BLOB, nullable=False)
+	# content hash, see `hashes.secret_hash`
+	hash = Column('hash', Text, nullable=True, index=True)
 
 	@classmethod
 	def from_pydantic(cls, secret: t.Union[models.Secret, models.SecretCreate]):
 		return cls(
 			id=secret.id if isinstance(secret, models.Secret) else None,
 			title=secret.title,
-			data=secret.data
+			data=secret.data,
+			hash=hashes.secret_hash({"title": secret.title, "data": secret.data})
 			)
 
 	def to_pydantic(self) -> models.Secret:
@@ -75,23 +117,174 @@ class Secret(Base):
 			)
 
 
-DB_PATH = f"sqlite:///{c.APP_DIR/'notes.db'}"
+DB_PATH = c.APP_DIR/'notes.db'
+
+
+def regexp(pattern: str, value: t.Optional[str]) -> bool:
+	# sqlite calls it for `value REGEXP pattern`, match (not search) like titles always did
+	return value is not None and re.match(pattern, value) is not None
+
+
+def register_functions(dbapi_connection, _connection_record):
+	dbapi_connection.create_function("REGEXP", 2, regexp)
+
+
+def named_columns(model) -> t.List[t.Any]:
+	# columns labeled with attribute names, db name of Secret.data differs
+	return [getattr(model, attribute.key).label(attribute.key) for attribute in inspect(model).column_attrs]
+
+
+def create_indexes(engine: Engine):
+	# create_all skips existing tables together with their indexes, add ones older databases miss
+	for db_table in Base.metadata.sorted_tables:
+		for index in db_table.indexes:
+			index.create(bind=engine, checkfirst=True)
+
+
+# every connection: readers don't wait for a writer and a writer doesn't wait for readers
+PRAGMAS: t.Dict[str, t.Any] = {
+	"journal_mode": "WAL",
+}
+
+# pragmas of sqlite-wal storage on top: fsync only at checkpoints, reads through mmap and a bigger page cache
+WAL_PRAGMAS: t.Dict[str, t.Any] = {
+	"synchronous": "NORMAL",
+	"mmap_size": 1<<28,
+	# negative is KiB
+	"cache_size": -(64<<10),
+	"temp_store": "MEMORY",
+}
+
+
+class SqliteStorage(Storage):
+	""" notes and keys in a sqlite database at path, pragmas (on top of PRAGMAS) are set on every connection
+
+	a connection waits up to busy_timeout seconds for another process' write to finish instead of
+	failing with `database is locked`
+	"""
+	def __init__(self, path: Path = DB_PATH, pragmas: t.Optional[t.Dict[str, t.Any]] = None, busy_timeout: float = c.BUSY_TIMEOUT):
+		self.path = Path(path)
+		self.pragmas = {**PRAGMAS, **(pragmas or {})}
+		self.busy_timeout = busy_timeout
+		self.fts_enabled = False
+		self.rollup_enabled = False
+		self._engine: t.Optional[Engine] = None
+		self._engine_lock = threading.Lock()
+		self._sessionmaker = sessionmaker(autocommit=False, autoflush=False)
+
+	def on_connect(self, dbapi_connection, connection_record):
+		register_functions(dbapi_connection, connection_record)
+		cursor = dbapi_connection.cursor()
+		for name, value in self.pragmas.items():
+			cursor.execute(f"PRAGMA {name} = {value}")
+		cursor.close()
 
-engine = create_engine(DB_PATH, echo=c.DEBUG, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+	@property
+	def engine(self) -> Engine:
+		""" engine is created, and schema checked, on first use instead of at import """
+		with self._engine_lock:
+			if self._engine is None:
+				self.path.parent.mkdir(parents=True, exist_ok=True)
+				engine = create_engine(f"sqlite:///{self.path}", echo=c.DEBUG, connect_args={"check_same_thread": False, "timeout": self.busy_timeout})
+				event.listen(engine, "connect", self.on_connect)
+				Base.metadata.create_all(bind=engine) # type: ignore
+				hashes.add_columns(engine)
+				create_indexes(engine)
+				hashes.create(engine, {"notes": (Note.__table__, named_columns(Note)), "keys": (Secret.__table__, named_columns(Secret))})
+				self.fts_enabled = fts.create(engine)
+				self.rollup_enabled = rollup.create(engine)
+				self._engine = engine
+		return self._engine
 
-Base.metadata.create_all(bind=engine) # type: ignore
+	def session(self) -> Session:
+		return self._sessionmaker(bind=self.engine)
+
+	def notes(self) -> "NoteDb":
+		return NoteDb(self)
+
+	def secrets(self) -> "SecretDb":
+		return SecretDb(self)
+
+	def sync(self) -> "SyncDb":
+		return SyncDb(self)
+
+
+# the one at DB_PATH, what NoteDb()/SecretDb() without a storage use
+default_storage = SqliteStorage()
+
+def open_storage(wal: bool = False, path: t.Optional[Path] = None, busy_timeout: t.Optional[float] = None) -> SqliteStorage:
+	# backend factory of `storage.BACKENDS`
+	if path is None and not wal and busy_timeout is None:
+		return default_storage
+	return SqliteStorage(path or DB_PATH, WAL_PRAGMAS if wal else None, c.BUSY_TIMEOUT if busy_timeout is None else busy_timeout)
+
+def get_engine() -> Engine:
+	return default_storage.engine
+
+def SessionLocal() -> Session:
+	# named like the sessionmaker it replaces
+	return default_storage.session()
+
+
+def literal_prefix(regex_pattern: str) -> str:
+	# text every `re.match` of regex_pattern starts with, "" when it can't be told
+	if "|" in regex_pattern:
+		return ""
+	prefix = ""
+	for char in regex_pattern:
+		if char in "?*{":
+			# quantifier may drop last literal character
+			return prefix[:-1]
+		if char in ".^$+[]()\\":
+			return prefix
+		prefix += char
+	return prefix
+
+
+def prefix_range(column, prefix: str):
+	# prefix match as a range, so sqlite walks the index instead of scanning
+	if ord(prefix[-1]) < sys.maxunicode:
+		return and_(column >= prefix, column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+	return column >= prefix
+
+
+def title_matches(regex_pattern: str):
+	# REGEXP on title, narrowed to an index range by literal start of regex
+	regex_prefix = literal_prefix(regex_pattern)
+	condition = Secret.title.op("REGEXP")(regex_pattern)
+	if regex_prefix:
+		return and_(prefix_range(Secret.title, regex_prefix), condition)
+	return condition
+
+
+def created_key(created_at: datetime.datetime, id: int):
+	# typed binds, so datetime is formatted the way sqlalchemy stores it
+	return tuple_(literal(created_at, Note.created_at.type), literal(id, Integer))
+
+
+def chunked(items: t.Iterable[T], size: int) -> t.Iterator[t.List[T]]:
+	batch: t.List[T] = []
+	for item in items:
+		batch.append(item)
+		if len(batch) == size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
 
 
 class BaseDb():
+	def __init__(self, storage: t.Optional[SqliteStorage] = None):
+		self.storage = storage or default_storage
+
 	def __enter__(self):
-		self.db = SessionLocal()
+		self.db = self.storage.session()
 		return self
 	def __exit__(self, _exc_type, _exc_value, _tb):
 		self.db.close()
 
 
-class NoteDb(BaseDb):
+class NoteDb(BaseDb, NoteStore):
 	def insert(self, note: models.NoteCreate) -> models.Note:
 		db_note = Note.from_pydantic(note)
 		self.db.add(db_note)
@@ -99,9 +292,177 @@ class NoteDb(BaseDb):
 		self.db.refresh(db_note)
 		return db_note.to_pydantic()
 
-	def get_recent(self, limit: int) -> t.List[models.Note]:
-		db_notes = self.db.query(Note).order_by(Note.created_at.desc()).limit(limit).all()
-		return [db_note.to_pydantic() for db_note in db_notes]
+	def insert_all(self, notes: t.Sequence[models.NoteCreate]) -> t.List[models.Note]:
+		# in one transaction, ids are known after flush so nothing is read back
+		db_notes = [Note.from_pydantic(note) for note in notes]
+		self.db.add_all(db_notes)
+		self.db.flush()
+		saved = [db_note.to_pydantic() for db_note in db_notes]
+		self.db.commit()
+		return saved
+
+	def insert_new(self, notes: t.Sequence[models.NoteCreate]) -> int:
+		# in one transaction, notes with a hash already in db (or earlier in notes) are skipped
+		rows = {}
+		for note in notes:
+			row = Note.row_from_pydantic(note)
+			rows.setdefault(row["hash"], row)
+		for batch in chunked(list(rows), 500):
+			for (hash,) in self.db.execute(select(Note.hash).where(Note.hash.in_(batch))):
+				rows.pop(hash, None)
+		if rows:
+			self.db.execute(Note.__table__.insert(), list(rows.values()))
+		self.db.commit()
+		return len(rows)
+
+	def insert_many(self, notes: t.Iterable[t.Union[models.NoteCreate, models.Note]], batch_size: int = 5000) -> int:
+		""" bulk insert, one executemany and one commit per batch_size notes
+
+		notes can be a generator, only one batch is held in memory. returns number of inserted notes
+		"""
+		total = 0
+		for batch in chunked((Note.row_from_pydantic(note) for note in notes), batch_size):
+			self.db.execute(Note.__table__.insert(), batch)
+			self.db.commit()
+			total += len(batch)
+		return total
+
+	def iter_all(self, batch_size: int = 5000) -> t.Iterator[models.NoteRow]:
+		# every note in id order, rows are fetched batch_size at a time
+		query = select(NOTE_COLUMNS).order_by(Note.id).execution_options(stream_results=True)
+		for rows in self.db.execute(query).partitions(batch_size):
+			yield from note_rows(rows)
+
+	def search(self, query: str, type: t.Optional[models.NoteType] = None, since: t.Optional[arrow.Arrow] = None,
+			limit: int = 20, highlight: t.Tuple[str, str] = ("[", "]"), raw: bool = False) -> t.List[models.NoteMatch]:
+		""" full text search over msg, best match first
+
+		query is plain words that all have to match (word* for prefix) or fts5 syntax if raw
+		"""
+		if not self.storage.fts_enabled:
+			raise CrudException("search needs sqlite with fts5")
+		index = table(fts.TABLE, column("rowid"))
+		rank = func.bm25(literal_column(fts.TABLE))
+		highlighted = func.highlight(literal_column(fts.TABLE), 0, highlight[0], highlight[1])
+		db_query = self.db.query(*NOTE_COLUMNS, highlighted, rank) \
+			.join(index, index.c.rowid == Note.id) \
+			.filter(text(f"{fts.TABLE} MATCH :query").bindparams(query=query if raw else fts.to_query(query)))
+		if type is not None:
+			db_query = db_query.filter(Note.ty == type)
+		if since is not None:
+			db_query = db_query.filter(Note.created_at >= since.to("utc").naive)
+		return [models.NoteMatch(models.NoteRow(*row[:-2]), row[-2], row[-1]) for row in db_query.order_by(rank).limit(limit)]
+
+	def rebuild_search_index(self):
+		if not self.storage.fts_enabled:
+			raise CrudException("search needs sqlite with fts5")
+		fts.rebuild(self.db.connection())
+		self.db.commit()
+
+	def iter_recent(self, limit: int, before: t.Optional[str] = None, after: t.Optional[str] = None, page_size: int = 1000) -> t.Iterator[models.NoteRow]:
+		""" `limit` notes oldest first, fetched page_size at a time with keyset pagination
+
+		by default the newest notes (older than `before` cursor if given),
+		with `after` cursor the oldest notes newer than it. cursors come from `note_cursor`
+		"""
+		if limit <= 0:
+			return
+		key = tuple_(Note.created_at, Note.id)
+		upper = decode_cursor(before) if before is not None else None
+		if after is not None:
+			lower, inclusive = decode_cursor(after), False
+		else:
+			# limit-th newest note is where we start, index alone answers it
+			start_query = self.db.query(Note.created_at, Note.id)
+			if upper is not None:
+				start_query = start_query.filter(key < created_key(*upper))
+			start = start_query.order_by(Note.created_at.desc(), Note.id.desc()).offset(limit - 1).limit(1).first()
+			lower, inclusive = (tuple(start), True) if start is not None else (None, True)
+
+		remaining = limit
+		while remaining > 0:
+			query = self.db.query(*NOTE_COLUMNS)
+			if lower is not None:
+				query = query.filter(key >= created_key(*lower) if inclusive else key > created_key(*lower))
+			if upper is not None:
+				query = query.filter(key < created_key(*upper))
+			page = query.order_by(Note.created_at, Note.id).limit(min(page_size, remaining)).all()
+			yield from note_rows(page)
+			if len(page) < min(page_size, remaining):
+				return
+			remaining -= len(page)
+			lower, inclusive = (page[-1].created_at, page[-1].id), False
+
+	def get_recent(self, limit: int) -> t.List[models.NoteRow]:
+		return list(note_rows(self.db.execute(select(NOTE_COLUMNS).order_by(Note.created_at.desc()).limit(limit))))
+
+	def get_note(self, id: int) -> t.Optional[models.NoteRow]:
+		row = self.db.execute(select(NOTE_COLUMNS).where(Note.id == id)).first()
+		return models.NoteRow(*row) if row is not None else None
+
+	def due(self, before: t.Optional[datetime.datetime] = None, after: t.Optional[datetime.datetime] = None,
+			type: t.Optional[models.NoteType] = None, limit: t.Optional[int] = None) -> t.List[models.NoteRow]:
+		# range scan of ix_notes_open_deadline
+		query = select(NOTE_COLUMNS).where(OPEN, Note.deadline.isnot(None))
+		if before is not None:
+			query = query.where(Note.deadline < before)
+		if after is not None:
+			query = query.where(Note.deadline > after)
+		if type is not None:
+			query = query.where(Note.ty == type)
+		query = query.order_by(Note.deadline, Note.id)
+		if limit is not None:
+			query = query.limit(limit)
+		return list(note_rows(self.db.execute(query)))
+
+	def complete(self, id: int, completed: bool = True) -> models.NoteRow:
+		# hash covers completed, it's updated along so sync sees the change
+		row = self.db.execute(select(named_columns(Note)).where(Note.id == id)).first()
+		if row is None:
+			raise CrudException("Note is not in db", id)
+		values = dict(row._mapping, completed=completed)
+		values["hash"] = hashes.note_hash(values)
+		self.db.execute(Note.__table__.update().where(Note.id == id).values(completed=completed, hash=values["hash"]))
+		self.db.commit()
+		return models.NoteRow(*[values[column.key] for column in NOTE_COLUMNS])
+
+	def thread(self, root_id: int, depth: t.Optional[int] = None) -> t.List[models.ThreadNote]:
+		# one recursive query walking ix_notes_refer_id, path of zero padded ids orders it depth first
+		segment = lambda id: func.printf("/%010d", id, type_=Text)
+		tree = select(NOTE_COLUMNS + [literal(0).label("depth"), segment(Note.id).label("path")]).where(Note.id == root_id) \
+			.cte("thread", recursive=True)
+		replies = (select(NOTE_COLUMNS + [(tree.c.depth + 1).label("depth"), (tree.c.path + segment(Note.id)).label("path")])
+			.select_from(Note.__table__.join(tree, Note.refer_id == tree.c.id))
+			# note already on the path is a refer_id cycle, not followed again
+			.where(func.instr(tree.c.path, segment(Note.id)) == 0))
+		if depth is not None:
+			replies = replies.where(tree.c.depth < depth)
+		tree = tree.union_all(replies)
+		query = select([tree.c[column.key] for column in NOTE_COLUMNS] + [tree.c.depth]).order_by(tree.c.path)
+		return [models.ThreadNote(row[-1], models.NoteRow(*row[:-1])) for row in self.db.execute(query)]
+
+	def daily_counts(self, since: t.Optional[datetime.date] = None, type: t.Optional[models.NoteType] = None) -> t.List[models.DayCount]:
+		if not self.storage.rollup_enabled:
+			# sqlite without upsert, notes are grouped on every call
+			day = func.date(Note.created_at)
+			query = select([day, Note.ty, func.count()]).group_by(day, Note.ty).order_by(day, Note.ty)
+			if since is not None:
+				query = query.where(Note.created_at >= datetime.datetime.combine(since, datetime.time()))
+			if type is not None:
+				query = query.where(Note.ty == type)
+			return [models.DayCount(datetime.date.fromisoformat(day), ty, count) for day, ty, count in self.db.execute(query)]
+		daily = table(rollup.TABLE, column("day"), column("ty"), column("count"))
+		query = select([daily.c.day, daily.c.ty, daily.c.count]).order_by(daily.c.day, daily.c.ty)
+		if since is not None:
+			query = query.where(daily.c.day >= since.isoformat())
+		if type is not None:
+			query = query.where(daily.c.ty == type.name)
+		return [models.DayCount(datetime.date.fromisoformat(day), models.NoteType[ty], count) for day, ty, count in self.db.execute(query)]
+
+	def rebuild_stats(self):
+		if self.storage.rollup_enabled:
+			rollup.rebuild(self.db.connection())
+			self.db.commit()
 
 	def delete_note(self, note: models.Note) -> bool:
 		return self.delete_by_id(id=note.id)
@@ -113,7 +474,7 @@ class NoteDb(BaseDb):
 			raise CrudException("Note is not in db", id)
 		return rt == 1
 
-class SecretDb(BaseDb):
+class SecretDb(BaseDb, SecretStore):
 	def insert(self, secret: models.SecretCreate) -> models.Secret:
 		db_secret = Secret.from_pydantic(secret)
 		self.db.add(db_secret)
@@ -121,24 +482,45 @@ class SecretDb(BaseDb):
 		self.db.refresh(db_secret)
 		return db_secret.to_pydantic()
 
-	def titles(self, regex_pattern: t.Optional[str] = None) -> t.List[str]:
-		# TODO: see the sqlalchemy of doing this that works with sqlite3 and postgresql
-		import re
-		results = self.db.query(Secret).all()
-		return [result.title for result in results if regex_pattern is None or re.match(regex_pattern, result.title)]
+	def titles(self, regex_pattern: t.Optional[str] = None, prefix: t.Optional[str] = None, glob: t.Optional[str] = None) -> t.List[str]:
+		""" titles in sorted order, only title column is read (never the encrypted blobs)
+
+		prefix (and literal start of regex) becomes a range on title index, so it costs O(matches).
+		glob is sqlite GLOB, it uses the index for the part before first wildcard.
+		"""
+		query = self.db.query(Secret.title)
+		if prefix:
+			query = query.filter(prefix_range(Secret.title, prefix))
+		if regex_pattern is not None:
+			query = query.filter(title_matches(regex_pattern))
+		if glob is not None:
+			query = query.filter(Secret.title.op("GLOB")(glob))
+		return [title for (title,) in query.order_by(Secret.title)]
 
-	def get_secret(self, title: str) -> t.Optional[models.Secret]:
-		result = self.db.query(Secret).filter(Secret.title==title).first()
-		if result is None:
+	def get_secrets(self, regex_pattern: str) -> t.List[models.SecretRow]:
+		# one query, blobs are read only for matching titles
+		query = select([Secret.id, Secret.title, Secret.data]).where(title_matches(regex_pattern)).order_by(Secret.title)
+		return [models.SecretRow(*row) for row in self.db.execute(query)]
+
+	def get_secret(self, title: str) -> t.Optional[models.SecretRow]:
+		row = self.db.execute(select([Secret.id, Secret.title, Secret.data]).where(Secret.title==title)).first()
+		if row is None:
 			return None
-		return result.to_pydantic()
+		return models.SecretRow(*row)
+
+	def update_all(self, secrets: t.Sequence[models.SecretRow]) -> int:
+		self.db.bulk_update_mappings(Secret, [
+			{"id": secret.id, "data": secret.data, "hash": hashes.secret_hash({"title": secret.title, "data": secret.data})}
+			for secret in secrets])
+		self.db.commit()
+		return len(secrets)
 
-	def delete_secret(self, secret: models.Secret) -> bool:
+	def delete_secret(self, secret: t.Union[models.Secret, models.SecretRow]) -> bool:
 		return self.delete_by_title(secret.title)
 
 	def delete_all(self) -> int:
 		rt = self.db.query(Secret).delete()
-		self.db.comit()
+		self.db.commit()
 		return rt
 
 	def delete_by_title(self, title: str) -> bool:
@@ -147,3 +529,109 @@ class SecretDb(BaseDb):
 		if rt == 0:
 			raise CrudException("Note is not in db", id)
 		return rt == 1
+
+
+def note_record(row: t.Mapping[str, t.Any], refer: t.Optional[Hash]) -> Json:
+	# refer_id is local, referred note goes by its hash
+	return {
+		"hash": row["hash"],
+		"ty": row["ty"].value,
+		"msg": row["msg"],
+		"created_at": hashes.time_text(row["created_at"]),
+		"draft": row["draft"],
+		"deadline": hashes.time_text(row["deadline"]),
+		"resources": row["resources"],
+		"completed": row["completed"],
+		"refer": refer,
+	}
+
+def note_row(record: Json) -> t.Dict[str, t.Any]:
+	return dict(
+		ty=models.NoteType(record["ty"]),
+		msg=record["msg"],
+		created_at=hashes.parse_time(record["created_at"]),
+		draft=record["draft"],
+		deadline=hashes.parse_time(record["deadline"]),
+		resources=record["resources"],
+		completed=record["completed"],
+		hash=record["hash"],
+	)
+
+def secret_record(row: t.Mapping[str, t.Any]) -> Json:
+	return {"hash": row["hash"], "title": row["title"], "data": base64.b64encode(row["data"]).decode("ascii")}
+
+def secret_row(record: Json) -> t.Dict[str, t.Any]:
+	return dict(title=record["title"], data=base64.b64decode(record["data"]), hash=record["hash"])
+
+
+class SyncDb(BaseDb):
+	""" content of synced tables by hash, for `nkit.sync`
+
+	kind is a table name of `hashes.TABLES`, records are json-able dicts carrying their hash
+	"""
+	models = {"notes": Note, "keys": Secret}
+
+	def hashes(self, kind: str) -> t.List[Hash]:
+		model = self.models[kind]
+		return [row_hash for (row_hash,) in self.db.query(model.hash).filter(model.hash.isnot(None)).distinct().order_by(model.hash)]
+
+	def deleted(self, kind: str) -> t.Set[Hash]:
+		# tombstones of rows deleted here since last push
+		return {row_hash for (row_hash,) in self.db.execute(text("SELECT hash FROM sync_deleted WHERE kind = :kind"), {"kind": kind})}
+
+	def forget_deleted(self, kind: str, row_hashes: t.Optional[t.Collection[Hash]] = None):
+		if row_hashes is None:
+			self.db.execute(text("DELETE FROM sync_deleted WHERE kind = :kind"), {"kind": kind})
+		elif row_hashes:
+			self.db.execute(text("DELETE FROM sync_deleted WHERE kind = :kind AND hash = :hash"),
+				[{"kind": kind, "hash": row_hash} for row_hash in row_hashes])
+		self.db.commit()
+
+	def records(self, kind: str, row_hashes: t.Iterable[Hash], batch_size: int = 500) -> t.Iterator[Json]:
+		for batch in chunked(row_hashes, batch_size):
+			if kind == "notes":
+				refer = aliased(Note)
+				query = self.db.query(*named_columns(Note), refer.hash.label("refer")).outerjoin(refer, refer.id == Note.refer_id)
+				for row in query.filter(Note.hash.in_(batch)):
+					yield note_record(row._mapping, row.refer)
+			else:
+				for row in self.db.execute(select(named_columns(Secret)).where(Secret.hash.in_(batch))):
+					yield secret_record(row._mapping)
+
+	def add(self, kind: str, records: t.Sequence[Json]) -> t.List[Json]:
+		""" inserts records, returns ones skipped for conflicting with a local row (keys with same title)
+
+		raises SyncError if a record doesn't match its hash
+		"""
+		if kind == "notes":
+			rows = [note_row(record) for record in records]
+			skipped: t.List[Json] = []
+		else:
+			taken = {title for (title,) in self.db.query(Secret.title).filter(Secret.title.in_([record["title"] for record in records]))}
+			skipped = [record for record in records if record["title"] in taken]
+			rows = [secret_row(record) for record in records if record["title"] not in taken]
+		for row in rows:
+			if hashes.ROW_HASH[kind](row) != row["hash"]:
+				raise SyncError(f"{kind} record doesn't match its hash {row['hash']}")
+		if rows:
+			# by attribute names, db name of Secret.data differs
+			self.db.bulk_insert_mappings(self.models[kind], rows)
+		self.db.commit()
+		return skipped
+
+	def link(self, refers: t.Dict[Hash, Hash]):
+		# sets refer_id of notes by hash -> referred note hash, once both are here
+		if not refers:
+			return
+		self.db.execute(text(
+			"UPDATE notes SET refer_id = (SELECT min(id) FROM notes WHERE hash = :refer) WHERE hash = :hash"),
+			[{"hash": note_hash, "refer": refer} for note_hash, refer in refers.items()])
+		self.db.commit()
+
+	def remove(self, kind: str, row_hashes: t.Iterable[Hash]) -> int:
+		model = self.models[kind]
+		total = 0
+		for batch in chunked(row_hashes, 500):
+			total += self.db.query(model).filter(model.hash.in_(batch)).delete(synchronize_session=False)
+		self.db.commit()
+		return total
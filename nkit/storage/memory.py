@@ -0,0 +1,242 @@
+""" storage kept in process memory, nothing touches disk. for tests and benchmarks
+
+notes are a dict by id plus a list of (created_at, id) kept sorted, so recent notes and cursors
+are a bisect away like the (created_at, id) index of sqlite. note counts per (day, type) are kept
+up to date like sqlite's notes_daily. keys are a dict by title plus sorted titles.
+"""
+import re
+import bisect
+import datetime
+import fnmatch
+import threading
+import typing as t
+
+import arrow
+
+from .. import models
+from ..exceptions import CrudException
+from .storage import Storage, NoteStore, SecretStore, decode_cursor
+
+
+def note_row(id: int, note: t.Union[models.NoteCreate, models.Note]) -> models.NoteRow:
+	return models.NoteRow(id, note.ty, note.msg, note.created_at.to("utc").naive, note.draft,
+		note.deadline.to("utc").naive if note.deadline else None, "\n".join(note.resources), note.refer_id, note.completed)
+
+
+class MemoryStorage(Storage):
+	def __init__(self):
+		self.lock = threading.RLock()
+		self.notes_by_id: t.Dict[int, models.NoteRow] = {}
+		self.created: t.List[t.Tuple[t.Any, int]] = []
+		self.daily: t.Dict[t.Tuple[datetime.date, models.NoteType], int] = {}
+		self.secrets_by_title: t.Dict[str, models.SecretRow] = {}
+		self.sorted_titles: t.List[str] = []
+		self.next_id = 1
+
+	def notes(self) -> "MemoryNoteDb":
+		return MemoryNoteDb(self)
+
+	def secrets(self) -> "MemorySecretDb":
+		return MemorySecretDb(self)
+
+	def new_id(self) -> int:
+		self.next_id += 1
+		return self.next_id - 1
+
+	def count(self, row: models.NoteRow, delta: int):
+		# call holding lock
+		key = (row.created_at_utc.date(), row.ty)
+		count = self.daily.get(key, 0) + delta
+		if count > 0:
+			self.daily[key] = count
+		else:
+			self.daily.pop(key, None)
+
+
+class MemoryNoteDb(NoteStore):
+	def __init__(self, storage: MemoryStorage):
+		self.storage = storage
+
+	def insert(self, note: models.NoteCreate) -> models.Note:
+		with self.storage.lock:
+			row = note_row(self.storage.new_id(), note)
+			self.storage.notes_by_id[row.id] = row
+			self.storage.count(row, 1)
+			bisect.insort(self.storage.created, (row.created_at.naive, row.id))
+		return row.to_pydantic()
+
+	def insert_many(self, notes: t.Iterable[t.Union[models.NoteCreate, models.Note]], batch_size: int = 5000) -> int:
+		with self.storage.lock:
+			rows = [note_row(note.id if isinstance(note, models.Note) else self.storage.new_id(), note) for note in notes]
+			for row in rows:
+				if row.id in self.storage.notes_by_id:
+					self.storage.count(self.storage.notes_by_id[row.id], -1)
+				self.storage.notes_by_id[row.id] = row
+				self.storage.count(row, 1)
+				self.storage.next_id = max(self.storage.next_id, row.id + 1)
+			self.storage.created += [(row.created_at.naive, row.id) for row in rows]
+			self.storage.created.sort()
+		return len(rows)
+
+	def iter_all(self, batch_size: int = 5000) -> t.Iterator[models.NoteRow]:
+		with self.storage.lock:
+			rows = [self.storage.notes_by_id[id] for id in sorted(self.storage.notes_by_id)]
+		return iter(rows)
+
+	def iter_recent(self, limit: int, before: t.Optional[str] = None, after: t.Optional[str] = None, page_size: int = 1000) -> t.Iterator[models.NoteRow]:
+		# same as `local.NoteDb.iter_recent`, oldest first
+		if limit <= 0:
+			return iter([])
+		with self.storage.lock:
+			created = self.storage.created
+			end = bisect.bisect_left(created, decode_cursor(before)) if before is not None else len(created)
+			if after is not None:
+				start = bisect.bisect_right(created, decode_cursor(after))
+				keys = created[start:min(end, start + limit)]
+			else:
+				keys = created[max(0, end - limit):end]
+			return iter([self.storage.notes_by_id[id] for _, id in keys])
+
+	def get_recent(self, limit: int) -> t.List[models.NoteRow]:
+		return list(reversed(list(self.iter_recent(limit))))
+
+	def search(self, query: str, type: t.Optional[models.NoteType] = None, since: t.Optional[arrow.Arrow] = None,
+			limit: int = 20, highlight: t.Tuple[str, str] = ("[", "]"), raw: bool = False) -> t.List[models.NoteMatch]:
+		""" every word has to be in msg (word* for prefix), more occurrences rank better """
+		if raw:
+			raise CrudException("raw search needs sqlite storage")
+		patterns = [re.compile(r"\b" + re.escape(word[:-1]) if word.endswith("*") and len(word) > 1 else r"\b" + re.escape(word) + r"\b", re.IGNORECASE)
+			for word in query.split()]
+		matches = []
+		with self.storage.lock:
+			rows = list(self.storage.notes_by_id.values())
+		for row in rows:
+			if type is not None and row.ty != type:
+				continue
+			if since is not None and row.created_at < since:
+				continue
+			found = [pattern.findall(row.msg) for pattern in patterns]
+			if not all(found):
+				continue
+			marked = row.msg
+			for pattern in patterns:
+				marked = pattern.sub(lambda match: highlight[0] + match.group(0) + highlight[1], marked)
+			matches.append(models.NoteMatch(row, marked, -float(sum(len(words) for words in found))))
+		return sorted(matches, key=lambda match: match.rank)[:limit]
+
+	def get_note(self, id: int) -> t.Optional[models.NoteRow]:
+		return self.storage.notes_by_id.get(id)
+
+	def due(self, before: t.Optional[datetime.datetime] = None, after: t.Optional[datetime.datetime] = None,
+			type: t.Optional[models.NoteType] = None, limit: t.Optional[int] = None) -> t.List[models.NoteRow]:
+		with self.storage.lock:
+			rows = [row for row in self.storage.notes_by_id.values() if row.deadline_utc is not None and row.completed is not True
+				and (before is None or row.deadline_utc < before) and (after is None or row.deadline_utc > after)
+				and (type is None or row.ty == type)]
+		return sorted(rows, key=lambda row: (row.deadline_utc, row.id))[:limit]
+
+	def complete(self, id: int, completed: bool = True) -> models.NoteRow:
+		with self.storage.lock:
+			row = self.storage.notes_by_id.get(id)
+			if row is None:
+				raise CrudException("Note is not in db", id)
+			row = models.NoteRow(row.id, row.ty, row.msg, row._created_at, row.draft, row._deadline, row._resources, row.refer_id, completed)
+			self.storage.notes_by_id[id] = row
+		return row
+
+	def thread(self, root_id: int, depth: t.Optional[int] = None) -> t.List[models.ThreadNote]:
+		with self.storage.lock:
+			if root_id not in self.storage.notes_by_id:
+				return []
+			replies: t.Dict[int, t.List[models.NoteRow]] = {}
+			for id in sorted(self.storage.notes_by_id):
+				row = self.storage.notes_by_id[id]
+				if row.refer_id is not None:
+					replies.setdefault(row.refer_id, []).append(row)
+			thread = []
+			stack = [(0, self.storage.notes_by_id[root_id])]
+			seen = set()
+			while stack:
+				level, row = stack.pop()
+				if row.id in seen:
+					continue
+				seen.add(row.id)
+				thread.append(models.ThreadNote(level, row))
+				if depth is None or level < depth:
+					stack += [(level + 1, reply) for reply in reversed(replies.get(row.id, []))]
+			return thread
+
+	def daily_counts(self, since: t.Optional[datetime.date] = None, type: t.Optional[models.NoteType] = None) -> t.List[models.DayCount]:
+		with self.storage.lock:
+			counts = [models.DayCount(day, ty, count) for (day, ty), count in self.storage.daily.items()
+				if (since is None or day >= since) and (type is None or ty == type)]
+		return sorted(counts, key=lambda count: (count.day, count.ty.name))
+
+	def rebuild_stats(self):
+		with self.storage.lock:
+			self.storage.daily = {}
+			for row in self.storage.notes_by_id.values():
+				self.storage.count(row, 1)
+
+	def rebuild_search_index(self):
+		# search scans notes, there is no index
+		pass
+
+	def delete_by_id(self, id: int) -> bool:
+		with self.storage.lock:
+			row = self.storage.notes_by_id.pop(id, None)
+			if row is None:
+				raise CrudException("Note is not in db", id)
+			self.storage.count(row, -1)
+			self.storage.created.remove((row.created_at.naive, row.id))
+		return True
+
+
+class MemorySecretDb(SecretStore):
+	def __init__(self, storage: MemoryStorage):
+		self.storage = storage
+
+	def insert(self, secret: models.SecretCreate) -> models.Secret:
+		with self.storage.lock:
+			if secret.title in self.storage.secrets_by_title:
+				raise CrudException(f"key {secret.title} already exists")
+			row = models.SecretRow(self.storage.new_id(), secret.title, secret.data)
+			self.storage.secrets_by_title[secret.title] = row
+			bisect.insort(self.storage.sorted_titles, secret.title)
+		return models.Secret(id=row.id, title=row.title, data=row.data)
+
+	def titles(self, regex_pattern: t.Optional[str] = None, prefix: t.Optional[str] = None, glob: t.Optional[str] = None) -> t.List[str]:
+		with self.storage.lock:
+			titles = self.storage.sorted_titles
+			if prefix:
+				titles = titles[bisect.bisect_left(titles, prefix):]
+				titles = [title for title in titles[:bisect.bisect_left(titles, prefix + "\U0010ffff")] if title.startswith(prefix)]
+			titles = list(titles)
+		if regex_pattern is not None:
+			titles = [title for title in titles if re.match(regex_pattern, title)]
+		if glob is not None:
+			titles = [title for title in titles if fnmatch.fnmatchcase(title, glob)]
+		return titles
+
+	def get_secret(self, title: str) -> t.Optional[models.SecretRow]:
+		return self.storage.secrets_by_title.get(title)
+
+	def update_all(self, secrets: t.Sequence[models.SecretRow]) -> int:
+		with self.storage.lock:
+			for secret in secrets:
+				self.storage.secrets_by_title[secret.title] = secret
+		return len(secrets)
+
+	def delete_all(self) -> int:
+		with self.storage.lock:
+			count = len(self.storage.secrets_by_title)
+			self.storage.secrets_by_title.clear()
+			self.storage.sorted_titles.clear()
+		return count
+
+	def delete_by_title(self, title: str) -> bool:
+		with self.storage.lock:
+			if self.storage.secrets_by_title.pop(title, None) is None:
+				raise CrudException("Note is not in db", title)
+			self.storage.sorted_titles.remove(title)
+		return True
@@ -0,0 +1,350 @@
+""" notes and keys on a remote server (`remote_server` has the api), async counterparts of `local.NoteDb`/`local.SecretDb`
+
+every request goes through one pooled httpx.AsyncClient: connections are kept alive and reused,
+at most `concurrency` requests are in flight, failed requests (connection errors, 502/503/504)
+are retried with exponential backoff. bulk uploads send batches concurrently instead of waiting
+for each response, retried batches carry an Idempotency-Key so they're applied once.
+
+	async with RemoteNoteDb(url) as db:
+		await db.insert_many(notes)
+
+`RemoteStorage` puts them behind the sync `Storage` interface, NKIT_STORAGE=remote with NKIT_REMOTE_URL.
+"""
+import gzip
+import json
+import uuid
+import base64
+import bisect
+import datetime
+import threading
+import asyncio as aio
+import typing as t
+from urllib.parse import quote
+
+import arrow
+import httpx
+
+from .. import models, notes_io
+from .. import constants as c
+from . import local
+from .storage import Storage, NoteStore, SecretStore, decode_cursor
+from ..types import Json
+from ..exceptions import CrudException, RemoteError
+
+RETRY_STATUSES = {502, 503, 504}
+
+T = t.TypeVar("T")
+
+
+class RemoteClient:
+	def __init__(self, url: str, concurrency: int = 8, retries: int = 3, backoff: float = 0.1, timeout: float = 30.0):
+		self.url = url
+		self.concurrency = concurrency
+		self.retries = retries
+		self.backoff = backoff
+		self.timeout = timeout
+
+	async def __aenter__(self):
+		limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+		self.client = httpx.AsyncClient(base_url=self.url, limits=limits, timeout=self.timeout)
+		# made here so it belongs to the running loop
+		self.slots = aio.Semaphore(self.concurrency)
+		return self
+
+	async def __aexit__(self, _exc_type, _exc_value, _tb):
+		await self.client.aclose()
+
+	async def request(self, method: str, path: str, body: t.Any = None, params: t.Optional[t.Dict[str, t.Any]] = None,
+			idempotent: bool = True) -> t.Any:
+		""" json response of request, body is sent gzipped
+
+		non idempotent requests get an Idempotency-Key, so retrying them is safe too.
+		raises CrudException for 404/409 and RemoteError when retries run out
+		"""
+		headers = {"Accept-Encoding": "gzip"}
+		content = None
+		if body is not None:
+			content = gzip.compress(json.dumps(body).encode("utf-8"), compresslevel=1)
+			headers.update({"Content-Type": "application/json", "Content-Encoding": "gzip"})
+		if not idempotent:
+			headers["Idempotency-Key"] = uuid.uuid4().hex
+
+		error = ""
+		for attempt in range(self.retries + 1):
+			if attempt:
+				await aio.sleep(self.backoff * 2 ** (attempt - 1))
+			try:
+				async with self.slots:
+					response = await self.client.request(method, path, content=content, params=params, headers=headers)
+			except httpx.TransportError as e:
+				error = f"{type(e).__name__}: {e}"
+				continue
+			if response.status_code in RETRY_STATUSES:
+				error = f"{response.status_code} from {path}"
+				continue
+			if response.status_code in (404, 409):
+				raise CrudException(response.json().get("error", response.text))
+			if response.is_error:
+				raise RemoteError(f"{response.status_code} from {path}: {response.text}")
+			return response.json()
+		raise RemoteError(f"{method} {path} failed after {self.retries + 1} attempts, {error}")
+
+
+def note_row(record: Json) -> models.NoteRow:
+	# server sends `notes_io.to_record`s, read like rows of local db
+	return models.NoteRow(
+		record["id"], models.NoteType(record["ty"]), record["msg"], arrow.get(record["created_at"]).to("utc").naive, record["draft"],
+		arrow.get(record["deadline"]).to("utc").naive if record.get("deadline") else None,
+		"\n".join(record["resources"]), record.get("refer_id"), record.get("completed"))
+
+
+class RemoteDb():
+	def __init__(self, url: str, **client_options: t.Any):
+		self.remote = RemoteClient(url, **client_options)
+
+	async def __aenter__(self):
+		await self.remote.__aenter__()
+		return self
+
+	async def __aexit__(self, *exc_info):
+		await self.remote.__aexit__(*exc_info)
+
+
+class RemoteNoteDb(RemoteDb):
+	async def insert(self, note: models.NoteCreate) -> models.Note:
+		record = notes_io.to_record(note)
+		record.pop("id")
+		response = await self.remote.request("POST", "/notes", [record], idempotent=False)
+		return models.Note(id=response["ids"][0], **note.dict())
+
+	async def insert_many(self, notes: t.Iterable[t.Union[models.NoteCreate, models.Note]], batch_size: int = 1000) -> int:
+		""" uploads batches of batch_size notes, up to `concurrency` of them in flight at once
+
+		notes can be a generator, only batches in flight are held in memory. batches may be stored out of
+		order, ids follow arrival. returns number of inserted notes
+		"""
+		async def upload(batch: t.List[Json]) -> int:
+			response = await self.remote.request("POST", "/notes", batch, idempotent=False)
+			return len(response["ids"])
+
+		def collect(done: t.Set[aio.Future]) -> int:
+			# exception of every finished batch is retrieved, first one is raised
+			errors = [task.exception() for task in done if task.exception() is not None]
+			if errors:
+				raise errors[0]
+			return sum(task.result() for task in done)
+
+		total = 0
+		pending: t.Set[aio.Future] = set()
+		try:
+			for batch in local.chunked((notes_io.to_record(note) for note in notes), batch_size):
+				for record in batch:
+					record.pop("id")
+				pending.add(aio.ensure_future(upload(batch)))
+				if len(pending) >= self.remote.concurrency:
+					done, pending = await aio.wait(pending, return_when=aio.FIRST_COMPLETED)
+					total += collect(done)
+			if pending:
+				done, pending = await aio.wait(pending)
+				total += collect(done)
+		finally:
+			# a failed batch stops the upload, batches still in flight are cancelled and their errors collected
+			for task in pending:
+				task.cancel()
+			await aio.gather(*pending, return_exceptions=True)
+		return total
+
+	async def page(self, after: int, limit: int) -> t.List[models.NoteRow]:
+		# up to limit notes with id above after, in id order
+		return [note_row(record) for record in await self.remote.request("GET", "/notes", params={"after": after, "limit": limit})]
+
+	async def iter_all(self, batch_size: int = 5000) -> t.AsyncIterator[models.NoteRow]:
+		# every note in id order, fetched batch_size at a time
+		after = 0
+		while True:
+			rows = await self.page(after, batch_size)
+			for row in rows:
+				yield row
+			if len(rows) < batch_size:
+				return
+			after = rows[-1].id
+
+	async def get_recent(self, limit: int) -> t.List[models.NoteRow]:
+		records = await self.remote.request("GET", "/notes/recent", params={"limit": limit})
+		return [note_row(record) for record in reversed(records)]
+
+	async def get_note(self, id: int) -> t.Optional[models.NoteRow]:
+		try:
+			return note_row(await self.remote.request("GET", f"/notes/{id}"))
+		except CrudException:
+			return None
+
+	async def delete_note(self, note: models.AnyNote) -> bool:
+		return await self.delete_by_id(note.id)
+
+	async def delete_by_id(self, id: int) -> bool:
+		await self.remote.request("DELETE", f"/notes/{id}")
+		return True
+
+
+class RemoteSecretDb(RemoteDb):
+	async def insert(self, secret: models.SecretCreate) -> models.Secret:
+		body = {"title": secret.title, "data": base64.b64encode(secret.data).decode("ascii")}
+		response = await self.remote.request("POST", "/keys", body, idempotent=False)
+		return models.Secret(id=response["id"], title=secret.title, data=secret.data)
+
+	async def titles(self, regex_pattern: t.Optional[str] = None, prefix: t.Optional[str] = None, glob: t.Optional[str] = None) -> t.List[str]:
+		params = {name: value for name, value in [("regex", regex_pattern), ("prefix", prefix), ("glob", glob)] if value is not None}
+		return await self.remote.request("GET", "/keys", params=params)
+
+	async def get_secret(self, title: str) -> t.Optional[models.SecretRow]:
+		try:
+			record = await self.remote.request("GET", f"/keys/{quote(title, safe='')}")
+		except CrudException:
+			return None
+		return models.SecretRow(record["id"], record["title"], base64.b64decode(record["data"]))
+
+	async def delete_secret(self, secret: t.Union[models.Secret, models.SecretRow]) -> bool:
+		return await self.delete_by_title(secret.title)
+
+	async def delete_by_title(self, title: str) -> bool:
+		await self.remote.request("DELETE", f"/keys/{quote(title, safe='')}")
+		return True
+
+
+class RemoteStorage(Storage):
+	""" remote api behind the `Storage` interface, for code that isn't async
+
+	calls run on an event loop of a background thread, each `notes()`/`secrets()` block has its own
+	pooled client. only what the api serves is there: search, due notes, threads, stats and updates
+	of keys raise CrudException, and sync works with local storage only
+	"""
+	def __init__(self, url: t.Optional[str] = None, **client_options: t.Any):
+		self.url = url or c.REMOTE_URL
+		if not self.url:
+			raise CrudException("remote storage needs a url, set NKIT_REMOTE_URL")
+		self.client_options = client_options
+		self._loop: t.Optional[aio.AbstractEventLoop] = None
+		self._loop_lock = threading.Lock()
+
+	def run(self, coroutine: t.Awaitable[T]) -> T:
+		with self._loop_lock:
+			if self._loop is None:
+				self._loop = aio.new_event_loop()
+				threading.Thread(target=self._loop.run_forever, daemon=True).start()
+		return aio.run_coroutine_threadsafe(coroutine, self._loop).result() # type: ignore awaitable is a coroutine
+
+	def notes(self) -> "RemoteNoteStore":
+		return RemoteNoteStore(self, RemoteNoteDb(self.url, **self.client_options))
+
+	def secrets(self) -> "RemoteSecretStore":
+		return RemoteSecretStore(self, RemoteSecretDb(self.url, **self.client_options))
+
+
+class RemoteStore:
+	# runs methods of an async remote db on loop of storage
+	def __init__(self, storage: RemoteStorage, db: t.Any):
+		self.storage = storage
+		self.db = db
+
+	def __enter__(self):
+		self.storage.run(self.db.__aenter__())
+		return self
+
+	def __exit__(self, *exc_info):
+		self.storage.run(self.db.__aexit__(*exc_info))
+
+
+def unsupported(operation: str) -> CrudException:
+	return CrudException(f"{operation} isn't supported by remote storage")
+
+
+class RemoteNoteStore(RemoteStore, NoteStore):
+	def insert(self, note: models.NoteCreate) -> models.Note:
+		return self.storage.run(self.db.insert(note))
+
+	def insert_many(self, notes: t.Iterable[t.Union[models.NoteCreate, models.Note]], batch_size: int = 1000) -> int:
+		return self.storage.run(self.db.insert_many(notes, batch_size))
+
+	def iter_all(self, batch_size: int = 5000) -> t.Iterator[models.NoteRow]:
+		# a page at a time, like `local.NoteDb.iter_all`
+		after = 0
+		while True:
+			rows = self.storage.run(self.db.page(after, batch_size))
+			yield from rows
+			if len(rows) < batch_size:
+				return
+			after = rows[-1].id
+
+	def iter_recent(self, limit: int, before: t.Optional[str] = None, after: t.Optional[str] = None, page_size: int = 1000) -> t.Iterator[models.NoteRow]:
+		""" same as `local.NoteDb.iter_recent`, oldest first
+
+		api pages notes in id order only, cursors are applied here over every note
+		"""
+		if limit <= 0:
+			return iter([])
+		if before is None and after is None:
+			return iter(list(reversed(self.get_recent(limit))))
+		rows = sorted(self.iter_all(page_size), key=lambda row: (row.created_at_utc, row.id))
+		keys = [(row.created_at_utc, row.id) for row in rows]
+		end = bisect.bisect_left(keys, decode_cursor(before)) if before is not None else len(rows)
+		if after is not None:
+			start = bisect.bisect_right(keys, decode_cursor(after))
+			return iter(rows[start:min(end, start + limit)])
+		return iter(rows[max(0, end - limit):end])
+
+	def get_recent(self, limit: int) -> t.List[models.NoteRow]:
+		return self.storage.run(self.db.get_recent(limit))
+
+	def get_note(self, id: int) -> t.Optional[models.NoteRow]:
+		return self.storage.run(self.db.get_note(id))
+
+	def due(self, before: t.Optional[datetime.datetime] = None, after: t.Optional[datetime.datetime] = None,
+			type: t.Optional[models.NoteType] = None, limit: t.Optional[int] = None) -> t.List[models.NoteRow]:
+		raise unsupported("due notes")
+
+	def complete(self, id: int, completed: bool = True) -> models.NoteRow:
+		raise unsupported("completing notes")
+
+	def search(self, query: str, type: t.Optional[models.NoteType] = None, since: t.Optional[t.Any] = None,
+			limit: int = 20, highlight: t.Tuple[str, str] = ("[", "]"), raw: bool = False) -> t.List[models.NoteMatch]:
+		raise unsupported("search")
+
+	def rebuild_search_index(self):
+		raise unsupported("search")
+
+	def thread(self, root_id: int, depth: t.Optional[int] = None) -> t.List[models.ThreadNote]:
+		raise unsupported("note threads")
+
+	def daily_counts(self, since: t.Optional[datetime.date] = None, type: t.Optional[models.NoteType] = None) -> t.List[models.DayCount]:
+		raise unsupported("note stats")
+
+	def rebuild_stats(self):
+		raise unsupported("note stats")
+
+	def delete_by_id(self, id: int) -> bool:
+		return self.storage.run(self.db.delete_by_id(id))
+
+
+class RemoteSecretStore(RemoteStore, SecretStore):
+	def insert(self, secret: models.SecretCreate) -> models.Secret:
+		return self.storage.run(self.db.insert(secret))
+
+	def titles(self, regex_pattern: t.Optional[str] = None, prefix: t.Optional[str] = None, glob: t.Optional[str] = None) -> t.List[str]:
+		return self.storage.run(self.db.titles(regex_pattern, prefix, glob))
+
+	def get_secret(self, title: str) -> t.Optional[models.SecretRow]:
+		return self.storage.run(self.db.get_secret(title))
+
+	def update_all(self, secrets: t.Sequence[models.SecretRow]) -> int:
+		# api has no update, replacing keys one by one could lose some halfway
+		raise unsupported("updating keys")
+
+	def delete_all(self) -> int:
+		titles = self.titles()
+		for title in titles:
+			self.delete_by_title(title)
+		return len(titles)
+
+	def delete_by_title(self, title: str) -> bool:
+		return self.storage.run(self.db.delete_by_title(title))
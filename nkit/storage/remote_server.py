@@ -0,0 +1,186 @@
+""" small http server `remote` talks to, keeps everything in memory. for tests and benchmarks
+
+	POST   /notes            [note record, ..]          -> {"ids": [..]}
+	GET    /notes            ?after=id&limit=n          -> [note record, ..] in id order
+	GET    /notes/recent     ?limit=n                   -> newest n, oldest first
+	GET    /notes/<id>                                  -> note record
+	DELETE /notes/<id>
+	POST   /keys             {"title", "data"}          -> {"id": ..}, 409 if title is taken
+	GET    /keys             ?prefix=&glob=&regex=      -> [title, ..]
+	GET    /keys/<title>                                -> {"id", "title", "data"}
+	DELETE /keys/<title>
+
+note records are `notes_io.to_record`, key data is base64. request bodies may be gzipped.
+a POST with Idempotency-Key header is applied once, a retried upload gets the first response.
+
+usage: python -m nkit.storage.remote_server [port]
+"""
+import re
+import sys
+import gzip
+import time
+import json
+import fnmatch
+import threading
+import contextlib
+import typing as t
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ..types import Json
+
+Response = t.Tuple[int, t.Any]
+
+
+class MemoryStore:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.notes: t.Dict[int, Json] = {}
+		self.keys: t.Dict[str, Json] = {}
+		self.next_id = 1
+		self.applied: t.Dict[str, Response] = {}
+
+	def handle(self, method: str, path: str, query: t.Dict[str, str], body: t.Any, key: t.Optional[str] = None) -> Response:
+		# lookup, apply and record of an idempotency key under one lock, a retry racing the original waits for it
+		with self.lock:
+			if key is not None and key in self.applied:
+				return self.applied[key]
+			response = self.route(method, path, query, body)
+			if key is not None:
+				self.applied[key] = response
+			return response
+
+	def route(self, method: str, path: str, query: t.Dict[str, str], body: t.Any) -> Response:
+		parts = [unquote(part) for part in path.strip("/").split("/")]
+		if parts[0] == "notes":
+			return self.notes_request(method, parts[1:], query, body)
+		if parts[0] == "keys":
+			return self.keys_request(method, parts[1:], query, body)
+		return 404, {"error": "not found"}
+
+	def notes_request(self, method: str, parts: t.List[str], query: t.Dict[str, str], body: t.Any) -> Response:
+		if method == "POST" and not parts:
+			ids = []
+			for record in body:
+				record = dict(record, id=self.next_id)
+				self.notes[self.next_id] = record
+				ids.append(self.next_id)
+				self.next_id += 1
+			return 200, {"ids": ids}
+		if method == "GET" and not parts:
+			after, limit = int(query.get("after", 0)), int(query.get("limit", 1000))
+			return 200, [self.notes[id] for id in sorted(self.notes) if id > after][:limit]
+		if method == "GET" and parts == ["recent"]:
+			newest = sorted(self.notes.values(), key=lambda record: (record["created_at"], record["id"]))[-int(query.get("limit", 5)):]
+			return 200, newest
+		if method == "GET" and len(parts) == 1 and parts[0].isdigit() and int(parts[0]) in self.notes:
+			return 200, self.notes[int(parts[0])]
+		if method == "DELETE" and len(parts) == 1:
+			if self.notes.pop(int(parts[0]), None) is None:
+				return 404, {"error": "Note is not in db"}
+			return 200, {}
+		return 404, {"error": "not found"}
+
+	def keys_request(self, method: str, parts: t.List[str], query: t.Dict[str, str], body: t.Any) -> Response:
+		if method == "POST" and not parts:
+			if body["title"] in self.keys:
+				return 409, {"error": f"key {body['title']} already exists"}
+			record = {"id": self.next_id, "title": body["title"], "data": body["data"]}
+			self.keys[body["title"]] = record
+			self.next_id += 1
+			return 200, {"id": record["id"]}
+		if method == "GET" and not parts:
+			titles = sorted(self.keys)
+			if query.get("prefix"):
+				titles = [title for title in titles if title.startswith(query["prefix"])]
+			if query.get("regex"):
+				titles = [title for title in titles if re.match(query["regex"], title)]
+			if query.get("glob"):
+				titles = [title for title in titles if fnmatch.fnmatchcase(title, query["glob"])]
+			return 200, titles
+		if len(parts) == 1 and parts[0] in self.keys:
+			if method == "GET":
+				return 200, self.keys[parts[0]]
+			if method == "DELETE":
+				del self.keys[parts[0]]
+				return 200, {}
+		return 404, {"error": "Key is not in db"}
+
+
+class RemoteServer(ThreadingHTTPServer):
+	daemon_threads = True
+
+	def __init__(self, address: t.Tuple[str, int]):
+		super().__init__(address, Handler)
+		self.store = MemoryStore()
+		# tests set these: requests answered with 503 before serving again, seconds added to every
+		# response (like network latency), connections accepted so far
+		self.fail_next = 0
+		self.delay = 0.0
+		self.connections = 0
+
+	@property
+	def url(self) -> str:
+		host, port = self.server_address[:2]
+		return f"http://{host}:{port}"
+
+
+class Handler(BaseHTTPRequestHandler):
+	# keeps connections alive between requests
+	protocol_version = "HTTP/1.1"
+	server: RemoteServer
+
+	def setup(self):
+		super().setup()
+		self.server.connections += 1
+
+	def log_message(self, format: str, *args: t.Any):
+		pass
+
+	def respond(self, status: int, value: t.Any):
+		body = json.dumps(value).encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		if len(body) > 1024 and "gzip" in self.headers.get("Accept-Encoding", ""):
+			body = gzip.compress(body, compresslevel=1)
+			self.send_header("Content-Encoding", "gzip")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def handle_request(self):
+		url = urlsplit(self.path)
+		length = int(self.headers.get("Content-Length", 0))
+		body = self.rfile.read(length) if length else b""
+		if self.server.delay:
+			time.sleep(self.server.delay)
+		if self.server.fail_next > 0:
+			self.server.fail_next -= 1
+			return self.respond(503, {"error": "try again"})
+		if self.headers.get("Content-Encoding") == "gzip":
+			body = gzip.decompress(body)
+		query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+		response = self.server.store.handle(self.command, url.path, query, json.loads(body) if body else None,
+			self.headers.get("Idempotency-Key"))
+		self.respond(*response)
+
+	do_GET = do_POST = do_DELETE = handle_request
+
+
+@contextlib.contextmanager
+def running_server(port: int = 0) -> t.Iterator[RemoteServer]:
+	# serves in a background thread until the block exits
+	server = RemoteServer(("127.0.0.1", port))
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	try:
+		yield server
+	finally:
+		server.shutdown()
+		server.server_close()
+
+
+if __name__ == "__main__":
+	with running_server(int(sys.argv[1]) if len(sys.argv) > 1 else 8765) as server:
+		print(f"serving on {server.url}")
+		threading.Event().wait()
@@ -0,0 +1,50 @@
+""" per day, per type note counts for `nkit notes stats`
+
+notes_daily has one row per (utc day of created_at, ty) with the number of notes in it, triggers keep
+it in sync with notes so stats read days instead of notes. databases created before it existed
+are counted once when it's created, `rebuild` recounts everything.
+upsert in triggers needs sqlite 3.24, without it stats group notes on every read.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Engine, Connection
+from sqlalchemy.exc import OperationalError
+
+from . import schema
+
+TABLE = "notes_daily"
+
+# date() of stored "YYYY-MM-DD HH:MM:SS.ffffff" is its utc day
+ADD = f"""INSERT INTO {TABLE}(day, ty, count) VALUES (date(new.created_at), new.ty, 1)
+		ON CONFLICT(day, ty) DO UPDATE SET count = count + 1;"""
+REMOVE = f"""UPDATE {TABLE} SET count = count - 1 WHERE day = date(old.created_at) AND ty = old.ty;
+		DELETE FROM {TABLE} WHERE day = date(old.created_at) AND ty = old.ty AND count <= 0;"""
+
+SCHEMA = [
+	f"CREATE TABLE IF NOT EXISTS {TABLE} (day TEXT NOT NULL, ty TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (day, ty)) WITHOUT ROWID",
+	f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_insert AFTER INSERT ON notes BEGIN
+		{ADD}
+	END""",
+	f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_delete AFTER DELETE ON notes BEGIN
+		{REMOVE}
+	END""",
+	f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_update AFTER UPDATE OF created_at, ty ON notes BEGIN
+		{REMOVE}
+		{ADD}
+	END""",
+]
+
+
+def create(engine: Engine) -> bool:
+	""" creates rollup if it's missing and counts existing notes into it, False if sqlite can't keep it """
+	try:
+		# count is in the transaction triggers are created in, no note is missed or counted twice
+		schema.create(engine, SCHEMA, rebuild)
+	except OperationalError:
+		return False
+	return True
+
+
+def rebuild(conn: Connection):
+	# recounts rollup from notes
+	conn.execute(text(f"DELETE FROM {TABLE}"))
+	conn.execute(text(f"INSERT INTO {TABLE}(day, ty, count) SELECT date(created_at), ty, count(*) FROM notes GROUP BY 1, 2"))
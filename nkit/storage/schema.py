@@ -0,0 +1,62 @@
+""" sqlite objects outside of the orm models (triggers, fts and rollup tables), created once per database
+
+pysqlite doesn't begin a transaction before DDL and commits each statement on its own, so
+`engine.begin()` alone would leave a table behind when a trigger after it fails, and a later open
+would take that half schema for a complete one. here the transaction is begun explicitly: a
+failing statement leaves nothing behind, and a schema is only skipped when every object of it exists.
+"""
+import re
+import contextlib
+import typing as t
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine, Connection
+
+
+def object_name(statement: str) -> str:
+	# statements are CREATE ... IF NOT EXISTS name
+	match = re.search(r"IF NOT EXISTS (\w+)", statement)
+	if match is None:
+		raise ValueError(f"schema statement has no IF NOT EXISTS name: {statement[:60]}")
+	return match.group(1)
+
+
+def missing(conn: Connection, names: t.Sequence[str]) -> t.Set[str]:
+	found = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master"))}
+	return set(names) - found
+
+
+@contextlib.contextmanager
+def transaction(engine: Engine) -> t.Iterator[Connection]:
+	""" connection in a transaction that covers DDL too, rolled back on exception """
+	with engine.connect() as conn:
+		dbapi_connection = conn.connection.dbapi_connection
+		isolation_level = dbapi_connection.isolation_level
+		# stops pysqlite from managing transactions itself, commit/rollback still end the one begun here
+		dbapi_connection.isolation_level = None
+		try:
+			with conn.begin():
+				conn.exec_driver_sql("BEGIN IMMEDIATE")
+				yield conn
+		finally:
+			dbapi_connection.isolation_level = isolation_level
+
+
+def create(engine: Engine, statements: t.Sequence[str], fill: t.Optional[t.Callable[[Connection], None]] = None):
+	""" runs statements, then fill, in one transaction unless everything they create exists already
+
+	a half schema left by older versions is completed and filled again. when a statement fails
+	(e.g. sqlite without fts5) nothing is created and its OperationalError is raised
+	"""
+	names = [object_name(statement) for statement in statements]
+	with engine.connect() as conn:
+		# no write lock when schema is there
+		if not missing(conn, names):
+			return
+	with transaction(engine) as conn:
+		# another process may have created it meanwhile
+		if missing(conn, names):
+			for statement in statements:
+				conn.execute(text(statement))
+			if fill is not None:
+				fill(conn)
@@ -1,4 +1,230 @@
-import uuid
-class Storage:
-	def get_latest_hash(self):
-		return uuid.uuid4().hex
+""" what a storage backend provides, and the registry backends are picked from
+
+	with get_storage().notes() as db:
+		db.insert(note)
+
+backend comes from NKIT_STORAGE (sqlite by default), see BACKENDS. required methods are abstract,
+a backend missing one fails when it's created instead of halfway through a command
+"""
+import abc
+import sys
+import hashlib
+import datetime
+import importlib
+import typing as t
+
+from .. import models
+from .. import constants as c
+from ..types import Hash
+from ..exceptions import CrudException
+
+
+def encode_cursor(created_at: datetime.datetime, id: int) -> str:
+	# position of a note in created order, naive utc like stored in db
+	return f"{created_at.replace(tzinfo=None).isoformat()}_{id}"
+
+def decode_cursor(cursor: str) -> t.Tuple[datetime.datetime, int]:
+	created_at, _, id = cursor.rpartition("_")
+	try:
+		return datetime.datetime.strptime(created_at, "%Y-%m-%dT%H:%M:%S.%f" if "." in created_at else "%Y-%m-%dT%H:%M:%S"), int(id)
+	except ValueError:
+		raise CrudException(f"Not a valid cursor: {cursor}")
+
+def note_cursor(note: models.AnyNote) -> str:
+	return encode_cursor(note.created_at.to("utc").naive, note.id)
+
+
+class NoteStore(abc.ABC):
+	""" notes of a backend, used as a context manager. reads return `models.NoteRow`s """
+	def __enter__(self):
+		return self
+
+	def __exit__(self, _exc_type, _exc_value, _tb):
+		pass
+
+	@abc.abstractmethod
+	def insert(self, note: models.NoteCreate) -> models.Note:
+		...
+
+	def insert_all(self, notes: t.Sequence[models.NoteCreate]) -> t.List[models.Note]:
+		# inserted together (one transaction where there are any), returns them with ids
+		return [self.insert(note) for note in notes]
+
+	def insert_new(self, notes: t.Sequence[models.NoteCreate]) -> int:
+		""" like insert_all but skips notes whose content hash is stored already (or earlier in notes), returns number inserted
+
+		stored notes created from the earliest of notes on are hashed, backends keeping hashes look them up instead
+		"""
+		from .hashes import model_note_hash
+		new: t.Dict[Hash, models.NoteCreate] = {}
+		for note in notes:
+			new.setdefault(model_note_hash(note), note)
+		if new:
+			earliest = min(note.created_at.to("utc").naive for note in new.values())
+			for row in self.iter_recent(sys.maxsize, after=encode_cursor(earliest, 0)):
+				new.pop(model_note_hash(row), None)
+		return len(self.insert_all(list(new.values())))
+
+	@abc.abstractmethod
+	def insert_many(self, notes: t.Iterable[t.Union[models.NoteCreate, models.Note]], batch_size: int = 5000) -> int:
+		...
+
+	@abc.abstractmethod
+	def iter_all(self, batch_size: int = 5000) -> t.Iterator[models.NoteRow]:
+		...
+
+	@abc.abstractmethod
+	def iter_recent(self, limit: int, before: t.Optional[str] = None, after: t.Optional[str] = None, page_size: int = 1000) -> t.Iterator[models.NoteRow]:
+		...
+
+	@abc.abstractmethod
+	def get_recent(self, limit: int) -> t.List[models.NoteRow]:
+		...
+
+	@abc.abstractmethod
+	def get_note(self, id: int) -> t.Optional[models.NoteRow]:
+		...
+
+	@abc.abstractmethod
+	def due(self, before: t.Optional[datetime.datetime] = None, after: t.Optional[datetime.datetime] = None,
+			type: t.Optional[models.NoteType] = None, limit: t.Optional[int] = None) -> t.List[models.NoteRow]:
+		""" notes with a deadline that aren't completed, earliest deadline first
+
+		before/after bound deadline (naive utc, exclusive)
+		"""
+
+	@abc.abstractmethod
+	def complete(self, id: int, completed: bool = True) -> models.NoteRow:
+		# marks note done (or not), returns it updated. CrudException if there's no such note
+		...
+
+	@abc.abstractmethod
+	def search(self, query: str, type: t.Optional[models.NoteType] = None, since: t.Optional[t.Any] = None,
+			limit: int = 20, highlight: t.Tuple[str, str] = ("[", "]"), raw: bool = False) -> t.List[models.NoteMatch]:
+		...
+
+	@abc.abstractmethod
+	def rebuild_search_index(self):
+		...
+
+	@abc.abstractmethod
+	def thread(self, root_id: int, depth: t.Optional[int] = None) -> t.List[models.ThreadNote]:
+		""" root note and notes following it up through refer_id, at most depth levels below root
+
+		depth first, replies in id order under the note they refer to. empty if root doesn't exist
+		"""
+
+	@abc.abstractmethod
+	def daily_counts(self, since: t.Optional[datetime.date] = None, type: t.Optional[models.NoteType] = None) -> t.List[models.DayCount]:
+		""" number of notes per utc day of created_at and type, by day then type. days without notes are left out
+
+		since is the first day counted
+		"""
+
+	@abc.abstractmethod
+	def rebuild_stats(self):
+		...
+
+	def delete_note(self, note: models.AnyNote) -> bool:
+		return self.delete_by_id(id=note.id)
+
+	@abc.abstractmethod
+	def delete_by_id(self, id: int) -> bool:
+		...
+
+
+class SecretStore(abc.ABC):
+	""" keys of a backend, used as a context manager """
+	def __enter__(self):
+		return self
+
+	def __exit__(self, _exc_type, _exc_value, _tb):
+		pass
+
+	@abc.abstractmethod
+	def insert(self, secret: models.SecretCreate) -> models.Secret:
+		...
+
+	@abc.abstractmethod
+	def titles(self, regex_pattern: t.Optional[str] = None, prefix: t.Optional[str] = None, glob: t.Optional[str] = None) -> t.List[str]:
+		...
+
+	@abc.abstractmethod
+	def get_secret(self, title: str) -> t.Optional[models.SecretRow]:
+		...
+
+	def get_secrets(self, regex_pattern: str) -> t.List[models.SecretRow]:
+		# secrets with title matching regex, in title order
+		return [secret for secret in map(self.get_secret, self.titles(regex_pattern)) if secret is not None]
+
+	@abc.abstractmethod
+	def update_all(self, secrets: t.Sequence[models.SecretRow]) -> int:
+		# replaces data of secrets (by id) together, one transaction where there are any
+		...
+
+	def delete_secret(self, secret: t.Union[models.Secret, models.SecretRow]) -> bool:
+		return self.delete_by_title(secret.title)
+
+	@abc.abstractmethod
+	def delete_all(self) -> int:
+		...
+
+	@abc.abstractmethod
+	def delete_by_title(self, title: str) -> bool:
+		...
+
+
+class Storage(abc.ABC):
+	name = ""
+
+	@abc.abstractmethod
+	def notes(self) -> NoteStore:
+		...
+
+	@abc.abstractmethod
+	def secrets(self) -> SecretStore:
+		...
+
+	def sync(self) -> t.Any:
+		# `local.SyncDb` over this storage, for backends sync works with
+		raise CrudException(f"sync isn't supported by {self.name} storage")
+
+	def get_latest_hash(self) -> Hash:
+		# root digests of notes and keys, same on every machine that is in sync
+		from .. import sync
+		with self.sync() as db:
+			roots = [sync.build_tree(db.hashes(kind)).get("", "") for kind in sync.KINDS]
+		return hashlib.sha256(":".join(roots).encode("ascii")).hexdigest()
+
+
+# name -> ("module", "factory attribute", factory options), imported only when picked
+BACKENDS: t.Dict[str, t.Tuple[str, str, t.Dict[str, t.Any]]] = {
+	"sqlite": ("nkit.storage.local", "open_storage", {}),
+	"sqlite-wal": ("nkit.storage.local", "open_storage", {"wal": True}),
+	"memory": ("nkit.storage.memory", "MemoryStorage", {}),
+	"remote": ("nkit.storage.remote", "RemoteStorage", {}),
+}
+
+_storages: t.Dict[str, Storage] = {}
+
+
+def register(name: str, module: str, factory: str, **options: t.Any):
+	BACKENDS[name] = (module, factory, options)
+
+
+def create_storage(name: str, **options: t.Any) -> Storage:
+	""" new storage of backend name, options are passed on to its factory """
+	if name not in BACKENDS:
+		raise CrudException(f"Unknown storage {name}, choose from {', '.join(sorted(BACKENDS))}")
+	module, factory, defaults = BACKENDS[name]
+	storage = getattr(importlib.import_module(module), factory)(**{**defaults, **options})
+	storage.name = name
+	return storage
+
+
+def get_storage(name: t.Optional[str] = None) -> Storage:
+	# one storage per backend for the whole process, configured one by default
+	name = name or c.STORAGE
+	if name not in _storages:
+		_storages[name] = create_storage(name)
+	return _storages[name]
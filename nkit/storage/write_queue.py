@@ -0,0 +1,69 @@
+""" single writer for notes, many inserts are committed in one transaction
+
+used where one long lived process writes for many clients (the agent). a background thread takes
+everything submitted while the previous transaction ran, up to max_batch notes, and inserts it
+together: a burst of n writers costs a few commits instead of n, and they never compete for the lock.
+"""
+import queue
+import threading
+import typing as t
+import concurrent.futures as cf
+
+from .. import models
+from .storage import Storage
+
+# submitted note and future its saved version is set on, None stops the writer
+Item = t.Optional[t.Tuple[models.NoteCreate, cf.Future]]
+
+
+class WriteQueue:
+	def __init__(self, storage: Storage, max_batch: int = 1000):
+		self.storage = storage
+		self.max_batch = max_batch
+		self.queue: "queue.Queue[Item]" = queue.Queue()
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+
+	def submit(self, note: models.NoteCreate) -> "cf.Future[models.Note]":
+		future: "cf.Future[models.Note]" = cf.Future()
+		self.queue.put((note, future))
+		return future
+
+	def insert(self, note: models.NoteCreate) -> models.Note:
+		return self.submit(note).result()
+
+	def close(self):
+		# writes what's already submitted, then stops
+		self.queue.put(None)
+		self.thread.join()
+
+	def run(self):
+		while True:
+			item = self.queue.get()
+			if item is None:
+				return
+			batch = [item]
+			stop = False
+			while len(batch) < self.max_batch:
+				try:
+					item = self.queue.get_nowait()
+				except queue.Empty:
+					break
+				if item is None:
+					stop = True
+					break
+				batch.append(item)
+			self.write(batch)
+			if stop:
+				return
+
+	def write(self, batch: t.List[t.Tuple[models.NoteCreate, cf.Future]]):
+		try:
+			with self.storage.notes() as db:
+				saved = db.insert_all([note for note, _ in batch])
+		except Exception as e:
+			for _, future in batch:
+				future.set_exception(e)
+			return
+		for (_, future), note in zip(batch, saved):
+			future.set_result(note)
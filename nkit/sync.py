@@ -0,0 +1,359 @@
+""" incremental sync of notes and keys with a remote
+
+rows are identified by content hash (`storage.hashes`). both sides keep their hashes in a prefix
+tree DEPTH hex characters deep, a node's digest covers every hash under its prefix. comparing
+trees top down descends only into differing subtrees, so finding what changed takes DEPTH + 1
+requests and O(changes * log n) digests instead of sending every hash. only changed rows are
+then sent, BATCH at a time.
+
+deletions travel as tombstones, so a row deleted on one machine isn't brought back by another.
+
+keys are encrypted to a random master key (`security.envelope`), its wrapped record travels along
+as one file so another machine can decrypt them with the same password.
+"""
+import os
+import abc
+import gzip
+import json
+import hashlib
+import typing as t
+from pathlib import Path
+from collections import defaultdict
+
+from .types import Hash, Json
+from .storage import hashes
+from .security import envelope
+from .storage.local import SyncDb
+from .exceptions import SyncError
+
+FANOUT = "0123456789abcdef"
+DEPTH = 3
+BATCH = 1000
+KINDS = hashes.TABLES
+
+# prefix -> digest, for every non empty node
+Tree = t.Dict[str, str]
+
+
+def leaf_digest(row_hashes: t.Iterable[Hash]) -> str:
+	return hashlib.sha256("\n".join(sorted(row_hashes)).encode("ascii")).hexdigest()
+
+
+def update_tree(tree: Tree, leaves: t.Dict[str, t.Optional[str]]):
+	""" sets digests of changed leaves (None for empty ones) and recomputes their ancestors in place """
+	changed = set()
+	for prefix, digest in leaves.items():
+		if digest is None:
+			tree.pop(prefix, None)
+		else:
+			tree[prefix] = digest
+		changed.add(prefix[:-1])
+	for depth in range(DEPTH - 1, -1, -1):
+		parents = set()
+		for prefix in (p for p in changed if len(p) == depth):
+			children = [f"{prefix + char}:{tree[prefix + char]}" for char in FANOUT if prefix + char in tree]
+			if children:
+				tree[prefix] = hashlib.sha256("\n".join(children).encode("ascii")).hexdigest()
+			else:
+				tree.pop(prefix, None)
+			if depth:
+				parents.add(prefix[:-1])
+		changed = parents
+
+
+def group_leaves(row_hashes: t.Iterable[Hash]) -> t.Dict[str, t.List[Hash]]:
+	leaves: t.Dict[str, t.List[Hash]] = defaultdict(list)
+	for row_hash in row_hashes:
+		leaves[row_hash[:DEPTH]].append(row_hash)
+	return leaves
+
+
+def build_tree(row_hashes: t.Iterable[Hash]) -> Tree:
+	tree: Tree = {}
+	update_tree(tree, {prefix: leaf_digest(members) for prefix, members in group_leaves(row_hashes).items()})
+	return tree
+
+
+class Remote(abc.ABC):
+	""" what sync needs from a remote, kind is one of KINDS """
+	@abc.abstractmethod
+	def digests(self, kind: str, prefixes: t.List[str]) -> Tree:
+		# digests of given tree nodes, empty ones are left out
+		...
+
+	@abc.abstractmethod
+	def hashes(self, kind: str, leaves: t.List[str]) -> t.Set[Hash]:
+		# every hash under given leaf prefixes
+		...
+
+	@abc.abstractmethod
+	def deleted(self, kind: str, row_hashes: t.Iterable[Hash]) -> t.Set[Hash]:
+		# which of row_hashes have a tombstone
+		...
+
+	@abc.abstractmethod
+	def fetch(self, kind: str, row_hashes: t.List[Hash]) -> t.List[Json]:
+		...
+
+	@abc.abstractmethod
+	def store(self, kind: str, records: t.List[Json]):
+		...
+
+	@abc.abstractmethod
+	def remove(self, kind: str, row_hashes: t.List[Hash]):
+		# deletes rows and leaves tombstones
+		...
+
+	@abc.abstractmethod
+	def master(self) -> t.Optional[Json]:
+		# master key record, as `envelope.read` returns it
+		...
+
+	@abc.abstractmethod
+	def store_master(self, record: Json):
+		...
+
+
+class DirectoryRemote(Remote):
+	""" remote in a (possibly shared or mounted) directory
+
+		<kind>/tree.json            digest tree
+		<kind>/deleted.json         tombstones
+		<kind>/<leaf>.json.gz       records of a leaf, hash -> record
+		master.json                 master key record keys are encrypted to
+
+	files are replaced atomically, there should be one writer at a time
+	"""
+	def __init__(self, path: Path):
+		self.path = Path(path)
+		self.trees: t.Dict[str, Tree] = {}
+
+	def read(self, path: Path, default: t.Any) -> t.Any:
+		if not path.exists():
+			return default
+		opener = gzip.open if path.suffix == ".gz" else open
+		with opener(path, "rt", encoding="utf-8") as f: # type: ignore gzip.open and open differ in signature only
+			return json.load(f)
+
+	def write(self, path: Path, value: t.Any):
+		path.parent.mkdir(parents=True, exist_ok=True)
+		tmp_path = path.with_name(f".{path.name}.tmp")
+		opener = gzip.open if path.suffix == ".gz" else open
+		with opener(tmp_path, "wt", encoding="utf-8") as f: # type: ignore
+			json.dump(value, f)
+		os.replace(tmp_path, path)
+
+	def tree(self, kind: str) -> Tree:
+		if kind not in self.trees:
+			self.trees[kind] = self.read(self.path/kind/"tree.json", {})
+		return self.trees[kind]
+
+	def leaf_path(self, kind: str, leaf: str) -> Path:
+		return self.path/kind/f"{leaf}.json.gz"
+
+	def digests(self, kind: str, prefixes: t.List[str]) -> Tree:
+		tree = self.tree(kind)
+		return {prefix: tree[prefix] for prefix in prefixes if prefix in tree}
+
+	def hashes(self, kind: str, leaves: t.List[str]) -> t.Set[Hash]:
+		return {row_hash for leaf in leaves for row_hash in self.read(self.leaf_path(kind, leaf), {})}
+
+	def deleted(self, kind: str, row_hashes: t.Iterable[Hash]) -> t.Set[Hash]:
+		return set(row_hashes) & set(self.read(self.path/kind/"deleted.json", []))
+
+	def fetch(self, kind: str, row_hashes: t.List[Hash]) -> t.List[Json]:
+		records = []
+		for leaf, members in group_leaves(row_hashes).items():
+			stored = self.read(self.leaf_path(kind, leaf), {})
+			records += [stored[row_hash] for row_hash in members if row_hash in stored]
+		return records
+
+	def change(self, kind: str, row_hashes: t.Iterable[Hash], update: t.Callable[[str, t.Dict[Hash, Json]], None], deleted: t.Set[Hash]):
+		# applies update to every touched leaf, then saves tree and tombstones
+		leaves = {}
+		for leaf in group_leaves(row_hashes):
+			stored = self.read(self.leaf_path(kind, leaf), {})
+			update(leaf, stored)
+			self.write(self.leaf_path(kind, leaf), stored)
+			leaves[leaf] = leaf_digest(stored) if stored else None
+		update_tree(self.tree(kind), leaves)
+		self.write(self.path/kind/"deleted.json", sorted(deleted))
+		self.write(self.path/kind/"tree.json", self.tree(kind))
+
+	def store(self, kind: str, records: t.List[Json]):
+		by_hash = {record["hash"]: record for record in records}
+		deleted = set(self.read(self.path/kind/"deleted.json", [])) - set(by_hash)
+		def update(leaf: str, stored: t.Dict[Hash, Json]):
+			stored.update((row_hash, record) for row_hash, record in by_hash.items() if row_hash.startswith(leaf))
+		self.change(kind, by_hash, update, deleted)
+
+	def remove(self, kind: str, row_hashes: t.List[Hash]):
+		deleted = set(self.read(self.path/kind/"deleted.json", [])) | set(row_hashes)
+		def update(leaf: str, stored: t.Dict[Hash, Json]):
+			for row_hash in row_hashes:
+				stored.pop(row_hash, None)
+		self.change(kind, row_hashes, update, deleted)
+
+	def master(self) -> t.Optional[Json]:
+		return self.read(self.path/"master.json", None)
+
+	def store_master(self, record: Json):
+		self.write(self.path/"master.json", record)
+
+
+def open_remote(location: str) -> Remote:
+	if not location:
+		raise SyncError("No remote, pass --remote or set NKIT_REMOTE")
+	return DirectoryRemote(Path(location).expanduser())
+
+
+class Diff(t.NamedTuple):
+	# local rows remote doesn't have and hasn't deleted
+	push: t.Set[Hash]
+	# remote rows not here and not deleted here
+	pull: t.Set[Hash]
+	# deleted here, still on remote
+	push_deletes: t.Set[Hash]
+	# deleted on remote, still here
+	pull_deletes: t.Set[Hash]
+	# local rows remote doesn't have, whatever the reason
+	local_only: t.Set[Hash]
+	remote_only: t.Set[Hash]
+
+	@property
+	def in_sync(self) -> bool:
+		return not (self.local_only or self.remote_only)
+
+
+def diverged(tree: Tree, remote: Remote, kind: str) -> t.List[str]:
+	# leaf prefixes whose digests differ, one remote request per tree level
+	level = [""]
+	for depth in range(DEPTH + 1):
+		theirs = remote.digests(kind, level)
+		level = [prefix for prefix in level if tree.get(prefix) != theirs.get(prefix)]
+		if depth == DEPTH or not level:
+			return level
+		level = [prefix + char for prefix in level for char in FANOUT]
+	return level
+
+
+def diff(db: SyncDb, remote: Remote, kind: str) -> Diff:
+	local_hashes = db.hashes(kind)
+	leaves = diverged(build_tree(local_hashes), remote, kind)
+	by_leaf = group_leaves(local_hashes)
+	ours = {row_hash for leaf in leaves for row_hash in by_leaf.get(leaf, [])}
+	theirs = remote.hashes(kind, leaves) if leaves else set()
+	local_only, remote_only = ours - theirs, theirs - ours
+	deleted_here = db.deleted(kind)
+	deleted_there = remote.deleted(kind, local_only) if local_only else set()
+	return Diff(
+		push=local_only - deleted_there,
+		pull=remote_only - deleted_here,
+		push_deletes=remote_only & deleted_here,
+		pull_deletes=deleted_there,
+		local_only=local_only,
+		remote_only=remote_only,
+	)
+
+
+class Result(t.NamedTuple):
+	sent: int
+	received: int
+	deleted: int
+	# records left out because they clash with a local row, e.g. keys with same title
+	conflicts: t.List[Json]
+
+
+def push(db: SyncDb, remote: Remote, kind: str, changes: t.Optional[Diff] = None) -> Result:
+	changes = changes or diff(db, remote, kind)
+	if changes.push_deletes:
+		remote.remove(kind, sorted(changes.push_deletes))
+	sent = 0
+	batch: t.List[Json] = []
+	for record in db.records(kind, sorted(changes.push)):
+		batch.append(record)
+		if len(batch) == BATCH:
+			remote.store(kind, batch)
+			sent, batch = sent + len(batch), []
+	if batch:
+		remote.store(kind, batch)
+		sent += len(batch)
+	db.forget_deleted(kind)
+	return Result(sent, 0, len(changes.push_deletes), [])
+
+
+def receive(db: SyncDb, remote: Remote, kind: str, row_hashes: t.Set[Hash]) -> t.Tuple[int, t.List[Json]]:
+	received = 0
+	conflicts: t.List[Json] = []
+	refers: t.Dict[Hash, Hash] = {}
+	ordered = sorted(row_hashes)
+	for start in range(0, len(ordered), BATCH):
+		records = remote.fetch(kind, ordered[start:start + BATCH])
+		skipped = db.add(kind, records)
+		conflicts += skipped
+		received += len(records) - len(skipped)
+		refers.update((record["hash"], record["refer"]) for record in records if record.get("refer"))
+	# referred note may come in a later batch
+	db.link(refers)
+	return received, conflicts
+
+
+def pull(db: SyncDb, remote: Remote, kind: str, changes: t.Optional[Diff] = None) -> Result:
+	changes = changes or diff(db, remote, kind)
+	deleted = db.remove(kind, changes.pull_deletes) if changes.pull_deletes else 0
+	# already deleted on remote, nothing to push
+	db.forget_deleted(kind, changes.pull_deletes)
+	received, conflicts = receive(db, remote, kind, changes.pull)
+	return Result(0, received, deleted, conflicts)
+
+
+def reset(db: SyncDb, remote: Remote, kind: str) -> Result:
+	# local rows become exactly what remote has, local changes are dropped
+	changes = diff(db, remote, kind)
+	deleted = db.remove(kind, changes.local_only) if changes.local_only else 0
+	db.forget_deleted(kind)
+	received, conflicts = receive(db, remote, kind, changes.remote_only)
+	return Result(0, received, deleted, conflicts)
+
+
+LEGACY_KEYS = "Keys here are encrypted to password key (from before master keys) and remote's to a master key, `nkit sync reset` to use remote's"
+
+
+def push_master(remote: Remote, path: Path, has_keys: bool) -> bool:
+	""" local master key record replaces remote's, so machines pulling keys pushed from here can open them
+
+	refused when remote keys are encrypted to another master key. True if remote's changed
+	"""
+	if not path.exists():
+		if has_keys and remote.master() is not None:
+			raise SyncError(LEGACY_KEYS)
+		return False
+	ours = envelope.read(path)
+	if ours.get("migrating"):
+		raise SyncError("Password change was interrupted, run `nkit keys rotate-password` before syncing")
+	theirs = remote.master()
+	if theirs == ours:
+		return False
+	if theirs is not None and theirs["public"] != ours["public"]:
+		raise SyncError("Remote keys are encrypted to another master key. Pull first, or `nkit sync reset` to use remote's")
+	remote.store_master(ours)
+	return True
+
+
+def pull_master(remote: Remote, path: Path, has_keys: bool) -> bool:
+	""" remote master key record is installed when there's none here or no keys are encrypted to local one yet
+
+	same master key here is kept as is, it's wrapped for this machine's password. True if installed
+	"""
+	theirs = remote.master()
+	if theirs is None:
+		return False
+	if path.exists():
+		if envelope.read(path)["public"] == theirs["public"]:
+			return False
+		if has_keys:
+			raise SyncError("Keys here are encrypted to another master key than remote's, `nkit sync reset` to use remote's")
+	elif has_keys:
+		raise SyncError(LEGACY_KEYS)
+	envelope.write_record(path, theirs)
+	return True
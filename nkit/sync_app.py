@@ -1,19 +1,79 @@
 import typer
 
+from . import constants as c
+from . import sync
+from . import keys_app
+from . import journal
+from .storage.storage import get_storage
+from .utils import catch_error
+
 sync_app = typer.Typer()
+
+options = {"remote": c.REMOTE}
+
+
+@sync_app.callback()
+def sync_options(remote: str = typer.Option(c.REMOTE, envvar="NKIT_REMOTE", help="directory to sync with")):
+	options["remote"] = remote
+
+
+def echo_result(kind: str, result: sync.Result):
+	typer.echo(f"{kind}: {result.sent} sent, {result.received} received, {result.deleted} deleted")
+	for record in result.conflicts:
+		# only keys can conflict, same title with different content
+		typer.secho(f"{kind}: skipped {record.get('title', record['hash'])}, conflicts with local one", fg=typer.colors.YELLOW, err=True)
+
+
+def echo_master(changed: bool, action: str):
+	if changed:
+		typer.echo(f"master key: {action}")
+
+
 @sync_app.command("status")
+@catch_error
 def sync_status():
-	pass
+	# journaled notes are diffed like the rest
+	journal.fold(get_storage())
+	remote = sync.open_remote(options["remote"])
+	with get_storage().sync() as db:
+		for kind in sync.KINDS:
+			changes = sync.diff(db, remote, kind)
+			if changes.in_sync and not changes.push_deletes:
+				typer.echo(f"{kind}: in sync")
+				continue
+			typer.echo(f"{kind}: {len(changes.push)} to push, {len(changes.pull)} to pull, "
+				f"{len(changes.push_deletes)} deletions to push, {len(changes.pull_deletes)} deletions to pull")
 
 @sync_app.command("reset")
-def sync_reset():
-	pass
+@catch_error
+def sync_reset(yes: bool = typer.Option(False, "--yes", help="don't ask for confirmation")):
+	if not yes:
+		typer.confirm("Local notes and keys will be replaced with what remote has, continue?", abort=True)
+	journal.fold(get_storage())
+	remote = sync.open_remote(options["remote"])
+	with get_storage().sync() as db:
+		# local keys are replaced too, nothing here needs local master key anymore
+		echo_master(sync.pull_master(remote, keys_app.MASTER_PATH, has_keys=False), "installed")
+		for kind in sync.KINDS:
+			echo_result(kind, sync.reset(db, remote, kind))
 
 @sync_app.command("pull")
+@catch_error
 def sync_pull():
-	pass
+	journal.fold(get_storage())
+	remote = sync.open_remote(options["remote"])
+	with get_storage().sync() as db:
+		# before keys come in, they're encrypted to remote's master key
+		echo_master(sync.pull_master(remote, keys_app.MASTER_PATH, has_keys=bool(db.hashes("keys"))), "installed")
+		for kind in sync.KINDS:
+			echo_result(kind, sync.pull(db, remote, kind))
 
 @sync_app.command("push")
+@catch_error
 def sync_push():
-	pass
-
+	journal.fold(get_storage())
+	remote = sync.open_remote(options["remote"])
+	with get_storage().sync() as db:
+		echo_master(sync.push_master(remote, keys_app.MASTER_PATH, has_keys=bool(db.hashes("keys"))), "sent")
+		for kind in sync.KINDS:
+			echo_result(kind, sync.push(db, remote, kind))
@@ -1,4 +1,12 @@
+import enum
 import typing as t
 
 Hash = str
 Json = t.Dict[str, t.Any]
+
+# lives here instead of models so cli can use it without importing pydantic
+class NoteType(enum.Enum):
+	task = "task"
+	update = "update"
+	habit = "habit"
+	think_block = "think"
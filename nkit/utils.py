@@ -1,14 +1,52 @@
 import functools
-import asyncio as aio
+import importlib
+import typing as t
+import click
 import typer
 import traceback
 
 def blocking_run(f):
 	@functools.wraps(f)
 	def block_fn(*args, **kwargs):
+		# asyncio is imported only by commands that need it
+		import asyncio as aio
 		aio.run(f(*args, **kwargs))
 	return block_fn
 
+
+class LazyGroup(click.Group):
+	""" click group whose sub apps are imported only when they're invoked
+
+	lazy_subcommands maps name -> ("module", "typer app attribute", "help shown in --help"),
+	so `--help` and unrelated commands never import them
+	"""
+	lazy_subcommands: t.Dict[str, t.Tuple[str, str, str]] = {}
+
+	def list_commands(self, ctx: click.Context) -> t.List[str]:
+		return sorted(set(super().list_commands(ctx)) | set(self.lazy_subcommands))
+
+	def get_command(self, ctx: click.Context, name: str) -> t.Optional[click.Command]:
+		if name in self.lazy_subcommands and name not in getattr(self, "_loaded", set()):
+			module, attribute, _ = self.lazy_subcommands[name]
+			group = typer.main.get_group(getattr(importlib.import_module(module), attribute))
+			group.name = name
+			self.add_command(group, name)
+			self._loaded = getattr(self, "_loaded", set()) | {name}
+		return super().get_command(ctx, name)
+
+	def format_commands(self, ctx: click.Context, formatter: click.HelpFormatter):
+		rows = []
+		for name in self.list_commands(ctx):
+			if name in self.lazy_subcommands:
+				rows.append((name, self.lazy_subcommands[name][2]))
+				continue
+			command = super().get_command(ctx, name)
+			if command is not None and not command.hidden:
+				rows.append((name, command.get_short_help_str(formatter.width - 6 - max(len(name) for name in self.list_commands(ctx)))))
+		if rows:
+			with formatter.section("Commands"):
+				formatter.write_dl(rows)
+
 def catch_error(f):
 	@functools.wraps(f)
 	def smooth(*args, **kwargs):
@@ -1,12 +1,47 @@
 from typer.testing import CliRunner
 import shutil
 import os
+import io
+import gzip
+import json
+import base64
+import subprocess
+from pathlib import Path
+import mmap
+import sys
+import functools
+import random
+import datetime
+import arrow
+import httpx
+import time
+import threading
+import multiprocessing
+from sqlalchemy import event
+import asyncio as aio
+import pytest
+from concurrent.futures import ThreadPoolExecutor
 
 from nkit import __version__
 from nkit.main import app
-from nkit.storage.local import SessionLocal, Note as DbNote
-from nkit.security.pass_rsa import generate_rsa_key, encrypt, decrypt, encrypt_large, decrypt_large
+from nkit.storage import fts, schema
+from sqlalchemy.exc import OperationalError
+from nkit.storage.storage import get_storage, create_storage, NoteStore
+from nkit import sync
+from nkit.storage.local import SqliteStorage, SessionLocal, SecretDb, NoteDb, SyncDb, literal_prefix, note_cursor, Note as DbNote, Secret as DbSecret
+from nkit import models
+from nkit.models import SecretCreate, NoteCreate, NoteType
+from nkit.security.pass_rsa import generate_rsa_key, encrypt, decrypt, encrypt_large, decrypt_large, decrypt_large_into, decrypted_length
+from nkit.security.sieve import small_primes
+from nkit.security import pass_rsa, parallel, arith, KeyCache, DataKeyCache, encrypt_stream, decrypt_stream
 from nkit.constants import APP_DIR
+from nkit.agent import Agent, AgentClient
+from nkit.exceptions import AgentUnavailable, AgentError, SyncError, CrudException, RemoteError
+from nkit.storage.write_queue import WriteQueue
+from nkit import journal, notes_io
+from nkit import stats
+from nkit.storage.remote import RemoteNoteDb, RemoteSecretDb
+from nkit.storage.remote_server import running_server
 
 runner = CliRunner()
 
@@ -29,6 +64,17 @@ def setup_function():
 def test_environment():
     assert os.environ["TESTING"] == "1"
 
+def test_env_numbers(monkeypatch, capsys):
+    from nkit import constants
+    monkeypatch.setenv("NKIT_WORKERS", "4")
+    assert constants.env_number("NKIT_WORKERS", 1) == 4
+    monkeypatch.setenv("NKIT_BUSY_TIMEOUT", "2.5")
+    assert constants.env_number("NKIT_BUSY_TIMEOUT", 30.0) == 2.5
+    # malformed value doesn't fail the import of constants
+    monkeypatch.setenv("NKIT_WORKERS", "four")
+    assert constants.env_number("NKIT_WORKERS", 1) == 1
+    assert "NKIT_WORKERS" in capsys.readouterr().err
+
 def test_save():
     output = runner.invoke(app, ["note", "__test some note"])
     assert output.exit_code == 0
@@ -87,3 +133,951 @@ def test_encryption_decryption_large():
     decrypted = decrypt_large(key, encrypted)
     assert data == decrypted
 
+def test_data_key_cache(monkeypatch, tmp_path):
+    key = generate_rsa_key(b"Hyy3", 512)
+    contents = [encrypt_large(key.publickey(), f"secret {i}".encode()) for i in range(3)]
+    unwraps = []
+    real_decrypt = pass_rsa.decrypt
+    monkeypatch.setattr(pass_rsa, "decrypt", lambda *args: unwraps.append(1) or real_decrypt(*args))
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+
+    cache = DataKeyCache(maxsize=2, ttl=60)
+    for _ in range(3):
+        assert decrypt_large(key, contents[0], cache, 1) == b"secret 0"
+    assert len(unwraps) == 1
+    # rewritten secret has another wrapped key, it isn't served the old one
+    assert decrypt_large(key, contents[1], cache, 1) == b"secret 1"
+    assert len(unwraps) == 2
+
+    held = [entry for entry, _ in cache._entries.values()]
+    decrypt_large(key, contents[2], cache, 2)
+    assert len(cache) == 2 and held[0] == bytearray(16)
+    now[0] += 61
+    cache.expire()
+    assert len(cache) == 0 and all(entry == bytearray(16) for entry in held)
+    assert cache.cache_info() == (2, 3, 3)
+
+    with SqliteStorage(tmp_path/"notes.db").secrets() as db:
+        for title in ["aws/prod", "aws/dev", "gcp/prod"]:
+            db.insert(SecretCreate(title=title, data=contents[0]))
+        assert [secret.title for secret in db.get_secrets(".*prod")] == ["aws/prod", "gcp/prod"]
+        assert [secret.title for secret in db.get_secrets("aws/")] == ["aws/dev", "aws/prod"]
+
+def test_rotate_password(monkeypatch, tmp_path):
+    from nkit import keys_app
+    from nkit.security import envelope
+    storage = create_storage("memory")
+    monkeypatch.setattr(keys_app, "get_storage", lambda: storage)
+    monkeypatch.setattr(keys_app, "KEY_PATH", tmp_path/"pub.pem")
+    monkeypatch.setattr(keys_app, "MASTER_PATH", tmp_path/"master.key")
+    monkeypatch.setattr(keys_app, "VERIFIER_PATH", tmp_path/"pub.verifier")
+    keys = functools.lru_cache()(lambda password: generate_rsa_key(password.encode(), 512))
+    monkeypatch.setattr(keys_app, "derive_key", keys)
+
+    # install from before master keys, secrets are encrypted to password key
+    (tmp_path/"pub.pem").write_bytes(keys("old").publickey().export_key("PEM"))
+    with storage.secrets() as db:
+        for title in ["a", "b", "c"]:
+            db.insert(SecretCreate(title=title, data=encrypt_large(keys("old").publickey(), title.encode())))
+    (tmp_path/"plain.txt").write_bytes(b"file from before master keys")
+    output = runner.invoke(app, ["keys", "encrypt", "--password", "old", "--inpath", str(tmp_path/"plain.txt"), "--outpath", str(tmp_path/"old.enc")])
+    assert output.exit_code == 0
+
+    output = runner.invoke(app, ["keys", "rotate-password", "--password", "old", "--new-password", "new"])
+    assert output.exit_code == 0, output.stdout
+    assert "Re-encrypted 3 secrets" in output.stdout
+    master = envelope.unwrap(tmp_path/"master.key", keys("new"))
+    with pytest.raises(ValueError):
+        envelope.unwrap(tmp_path/"master.key", keys("old"))
+    assert [decrypt_large(master, secret.data) for secret in storage.secrets().get_secrets("")] == [b"a", b"b", b"c"]
+
+    # from now on only master key is rewrapped, secrets aren't touched
+    before = {secret.title: secret.data for secret in storage.secrets().get_secrets("")}
+    output = runner.invoke(app, ["keys", "rotate-password", "--password", "new", "--new-password", "newer"])
+    assert output.exit_code == 0 and "Re-encrypted" not in output.stdout
+    assert {secret.title: secret.data for secret in storage.secrets().get_secrets("")} == before
+    assert runner.invoke(app, ["keys", "rotate-password", "--password", "new", "--new-password", "x"], input="new\nnew\nnew\n").exit_code != 0
+
+    assert runner.invoke(app, ["keys", "add", "d-value", "--title", "d"]).exit_code == 0
+    output = runner.invoke(app, ["keys", "get", "--all-matching", "[bd]", "--password", "newer"])
+    assert output.stdout.splitlines() == ["b: b", "d: d-value"]
+
+    # files encrypted to the old password key open with the current password, through the agent too
+    output = runner.invoke(app, ["keys", "decrypt", "--password", "newer", "--inpath", str(tmp_path/"old.enc"), "--outpath", str(tmp_path/"old.txt")])
+    assert output.exit_code == 0 and (tmp_path/"old.txt").read_bytes() == b"file from before master keys"
+    master = envelope.unwrap(tmp_path/"master.key", keys("newer"))
+    assert envelope.legacy_key(tmp_path/"master.key", master) == keys("old")
+    agent = Agent(master, tmp_path/"agent.sock", storage=storage, legacy_key=keys("old"))
+    legacy_secret = encrypt_large(keys("old").publickey(), b"legacy")
+    assert base64.b64decode(aio.run(agent.decrypt(base64.b64encode(legacy_secret).decode()))["data"]) == b"legacy"
+
+def test_password_verifier(monkeypatch, tmp_path):
+    from nkit import keys_app
+    monkeypatch.setattr(keys_app, "KEY_PATH", tmp_path/"pub.pem")
+    monkeypatch.setattr(keys_app, "MASTER_PATH", tmp_path/"master.key")
+    monkeypatch.setattr(keys_app, "VERIFIER_PATH", tmp_path/"pub.verifier")
+    derived = []
+    monkeypatch.setattr(keys_app, "derive_key", lambda password: derived.append(password) or generate_rsa_key(password.encode(), 512))
+
+    # install from before verifiers
+    (tmp_path/"pub.pem").write_bytes(generate_rsa_key(b"right", 512).publickey().export_key("PEM"))
+    assert keys_app.check_password_and_retry("right") is not None
+    assert (tmp_path/"pub.verifier").exists()
+
+    derived.clear()
+    assert runner.invoke(app, ["keys", "decrypt", "--password", "wrong"], input=b"x"*100).exit_code != 0
+    assert keys_app.unlock("wrong", (tmp_path/"pub.pem").read_bytes()) is None and "wrong" not in derived
+    assert keys_app.check_password_and_retry("right") is not None and derived == ["right"]
+
+    # verifier of another public key is ignored, not trusted
+    (tmp_path/"pub.pem").write_bytes(generate_rsa_key(b"other", 512).publickey().export_key("PEM"))
+    assert keys_app.check_password_and_retry("other") is not None
+
+
+def test_sieve_prime_search_matches_linear():
+    # key derivation must not change when prime search changes
+    for num in list(range(4, 3000)) + [(1<<64) - 300, (1<<127) + 12345]:
+        assert pass_rsa.get_next_prime(num) == pass_rsa.get_next_prime_linear(num)
+
+    for key_phrase in [b"Hello", b"sdfu#@4jodsfjo324"]:
+        for seed in pass_rsa.get_prime_seeds(key_phrase, 512):
+            assert pass_rsa.get_next_prime(seed) == pass_rsa.get_next_prime_linear(seed)
+
+def test_arith_backends():
+    rng = random.Random(7)
+    for _ in range(200):
+        m = rng.getrandbits(2048) | 1
+        a = rng.getrandbits(2048) % m
+        g, x, y = arith.egcd(a, m)
+        assert a*x + m*y == g
+        if g == 1:
+            inverse = arith.egcd_invert(a, m)
+            assert inverse == arith.python_invert(a, m) and a * inverse % m == 1
+            # negative exponents in pow are 3.8+
+            if sys.version_info >= (3, 8):
+                assert inverse == pow(a, -1, m)
+    # deep enough to overflow the stack of a recursive egcd
+    fib = [1, 1]
+    while len(fib) < 5000:
+        fib.append(fib[-1] + fib[-2])
+    assert arith.egcd(fib[-2], fib[-1])[0] == 1
+    with pytest.raises(ValueError):
+        arith.python_invert(6, 9)
+
+    # same key whichever backend derives it
+    keys = {}
+    previous = arith.backend
+    for name in sorted(arith.BACKENDS):
+        arith.use(name)
+        try:
+            assert [num for num in range(2000) if pass_rsa.is_prime(num)] == list(small_primes(2000))
+            keys[name] = generate_rsa_key(b"Hyy3", 512).export_key("PEM")
+        finally:
+            arith.use(previous)
+    assert len(set(keys.values())) == 1
+
+def test_parallel_key_gen():
+    for key_phrase in [b"Hello", b"bye"]:
+        serial = generate_rsa_key(key_phrase, 512).export_key("PEM")
+        assert generate_rsa_key(key_phrase, 512, workers=2).export_key("PEM") == serial
+
+    # tiny chunks force out of order completion and a cycle back to the start of bit range
+    nums = [1021, 4093, 12345]
+    assert parallel.next_primes(nums, pass_rsa.is_prime, 3, chunk_size=2) == [pass_rsa.get_next_prime(num) for num in nums]
+
+def test_key_cache(tmp_path, monkeypatch):
+    cache = KeyCache(tmp_path/"key_cache.bin", ttl=60)
+    expected = generate_rsa_key(b"Hello", 512).export_key("PEM")
+
+    assert cache.get(b"Hello", 512).export_key("PEM") == expected
+    assert cache.get(b"Hello", 512).export_key("PEM") == expected
+    assert cache.cache_info() == (1, 0, 1)
+    assert not (tmp_path/"key_cache.bin").exists()
+
+    cache.keep(b"Hello", cache.get(b"Hello", 512), 512)
+    fresh = KeyCache(tmp_path/"key_cache.bin", ttl=60)
+    assert fresh.get(b"Hello", 512).export_key("PEM") == expected
+    assert fresh.cache_info() == (0, 1, 0)
+
+    # wrong passphrase can't open the cache file
+    fresh.get(b"bye", 512)
+    assert fresh.cache_info() == (0, 1, 1)
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    expired = KeyCache(tmp_path/"key_cache.bin", ttl=60)
+    assert expired.get(b"Hello", 512).export_key("PEM") == expected
+    assert expired.cache_info() == (0, 0, 1)
+
+@pytest.mark.skipif(sys.platform == "win32", reason="agent listens on unix socket")
+def test_agent(monkeypatch, tmp_path):
+    key = generate_rsa_key(b"Hyy3", 512)
+    socket_path = tmp_path/"agent.sock"
+    client = AgentClient(socket_path)
+    with pytest.raises(AgentUnavailable):
+        client.ping()
+
+    # socket is bound private, not made private after
+    monkeypatch.setattr(os, "chmod", lambda *args, **kwargs: None)
+    server = threading.Thread(target=Agent(key, socket_path).run)
+    server.start()
+    for _ in range(50):
+        if client.available():
+            break
+        time.sleep(0.1)
+    monkeypatch.undo()
+    assert socket_path.stat().st_mode & 0o077 == 0
+
+    secrets = [f"secret {i}".encode("utf-8")*100 for i in range(32)]
+    with ThreadPoolExecutor(8) as pool:
+        decrypted = list(pool.map(lambda data: client.decrypt(encrypt_large(key.publickey(), data)), secrets))
+    assert decrypted == secrets
+    assert client.public_key() == key.publickey()
+    with pytest.raises(AgentError):
+        client.decrypt(b"not encrypted")
+
+    client.stop()
+    server.join(5)
+    assert not server.is_alive()
+    assert not socket_path.exists()
+
+def test_stream_encryption_decryption():
+    key = generate_rsa_key(b"Hyy3", 512)
+    unwrap = functools.partial(decrypt, key)
+    for size in [0, 1, 63, 64, 65, 64*3 + 5]:
+        data = os.urandom(size)
+        encrypted = io.BytesIO()
+        assert encrypt_stream(key.publickey(), io.BytesIO(data), encrypted, chunk_size=64) == size
+        decrypted = io.BytesIO()
+        assert decrypt_stream(unwrap, key.size_in_bytes(), io.BytesIO(encrypted.getvalue()), decrypted) == size
+        assert decrypted.getvalue() == data
+
+    # single blob format is still readable
+    decrypted = io.BytesIO()
+    decrypt_stream(unwrap, key.size_in_bytes(), io.BytesIO(encrypt_large(key.publickey(), b"old format")), decrypted)
+    assert decrypted.getvalue() == b"old format"
+
+    encrypted = io.BytesIO()
+    encrypt_stream(key.publickey(), io.BytesIO(b"a"*192), encrypted, chunk_size=64)
+    record = 1 + 12 + 4 + 64 + 16
+    # chunk size of header is checked before a buffer of it is allocated
+    huge = encrypted.getvalue()[:5] + ((1<<32) - 1).to_bytes(4, "big") + encrypted.getvalue()[9:]
+    zero = encrypted.getvalue()[:5] + bytes(4) + encrypted.getvalue()[9:]
+    for tampered in [encrypted.getvalue()[:-record], encrypted.getvalue()[:-1], encrypted.getvalue() + b"\0", huge, zero]:
+        with pytest.raises(ValueError):
+            decrypt_stream(unwrap, key.size_in_bytes(), io.BytesIO(tampered), io.BytesIO())
+
+def test_external_encrypt_decrypt(tmp_path):
+    data = os.urandom(3 * (1<<20) + 7)
+    (tmp_path/"plain").write_bytes(data)
+    output = runner.invoke(app, ["keys", "encrypt", "--password", "pw", "--inpath", str(tmp_path/"plain"), "--outpath", str(tmp_path/"enc")])
+    assert output.exit_code == 0
+    output = runner.invoke(app, ["keys", "decrypt", "--password", "pw", "--inpath", str(tmp_path/"enc"), "--outpath", str(tmp_path/"dec")])
+    assert output.exit_code == 0
+    assert (tmp_path/"dec").read_bytes() == data
+
+    output = runner.invoke(app, ["keys", "decrypt", "--password", "pw"], input=(tmp_path/"enc").read_bytes())
+    assert output.exit_code == 0
+    assert output.stdout_bytes == data
+
+def test_decrypt_large_buffers(tmp_path):
+    key = generate_rsa_key(b"Hyy3", 512)
+    data = b"Some secure piece"*10000
+    encrypted = encrypt_large(key.publickey(), data)
+    (tmp_path/"enc").write_bytes(encrypted)
+
+    with open(tmp_path/"enc", "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for content in [bytearray(encrypted), memoryview(encrypted), mapped]:
+            assert decrypt_large(key, content) == data
+            assert decrypt_large_into(key, content) == data
+            del content
+
+    output = bytearray(decrypted_length(key, encrypted))
+    assert decrypt_large_into(key, encrypted, memoryview(output)).obj is output
+    assert output == data
+
+    tampered = bytearray(encrypted)
+    tampered[-1] ^= 1
+    with pytest.raises(ValueError):
+        decrypt_large_into(key, tampered, output)
+    assert output == bytes(len(output))
+
+    with pytest.raises(ValueError):
+        decrypt_large(generate_rsa_key(b"other", 512), encrypted)
+
+def test_external_decrypt_mmap(tmp_path):
+    data = os.urandom((1<<20) + 7)
+    (tmp_path/"plain").write_bytes(data)
+    runner.invoke(app, ["keys", "encrypt", "--password", "pw", "--inpath", str(tmp_path/"plain"), "--outpath", str(tmp_path/"enc")])
+    output = runner.invoke(app, ["keys", "decrypt", "--mmap", "--password", "pw", "--inpath", str(tmp_path/"enc"), "--outpath", str(tmp_path/"dec")])
+    assert output.exit_code == 0
+    assert (tmp_path/"dec").read_bytes() == data
+
+def test_batch_encrypt_decrypt(tmp_path):
+    files = {"a.yaml": b"a: 1", "nested/b.yaml": os.urandom(5000), "nested/c.txt": b""}
+    for name, data in files.items():
+        (tmp_path/"src"/name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path/"src"/name).write_bytes(data)
+
+    output = runner.invoke(app, ["keys", "encrypt-batch", str(tmp_path/"src"), "--outdir", str(tmp_path/"enc"), "--password", "pw"])
+    assert output.exit_code == 0
+    assert "encrypted 3 files" in output.stdout
+    assert (tmp_path/"enc"/"nested"/"b.yaml.enc").exists()
+
+    # existing outputs aren't overridden without --force
+    output = runner.invoke(app, ["keys", "encrypt-batch", str(tmp_path/"src"/"*.yaml"), "--outdir", str(tmp_path/"enc"), "--password", "pw"])
+    assert output.exit_code == 1
+
+    (tmp_path/"manifest").write_text(f"{tmp_path/'enc'/'a.yaml.enc'}\t{tmp_path/'a.out'}\n")
+    output = runner.invoke(app, ["keys", "decrypt-batch", str(tmp_path/"enc"/"nested"), "--manifest", str(tmp_path/"manifest"), "--outdir", str(tmp_path/"dec"), "--password", "pw"])
+    assert output.exit_code == 0
+    assert (tmp_path/"a.out").read_bytes() == files["a.yaml"]
+    assert (tmp_path/"dec"/"b.yaml").read_bytes() == files["nested/b.yaml"]
+    assert (tmp_path/"dec"/"c.txt").read_bytes() == b""
+
+def query_plans(engine, call):
+    # EXPLAIN QUERY PLAN of the selects call runs, with the parameters they ran with
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            statements.append((statement, parameters))
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        call()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    with engine.connect() as conn:
+        return [str(conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()) for statement, parameters in statements]
+
+def test_secret_titles():
+    with SecretDb() as db:
+        db.db.query(DbSecret).delete()
+        db.db.commit()
+        for title in ["aws/prod", "aws/dev", "awsx", "gcp/prod", "b"]:
+            db.insert(SecretCreate(title=title, data=b"\0"*1000))
+
+        assert db.titles() == ["aws/dev", "aws/prod", "awsx", "b", "gcp/prod"]
+        assert db.titles("aws/") == ["aws/dev", "aws/prod"]
+        assert db.titles(".*prod") == ["aws/prod", "gcp/prod"]
+        assert db.titles("aws/?x|b") == ["awsx", "b"]
+        assert db.titles("aws+x") == ["awsx"]
+        assert db.titles(prefix="aws") == ["aws/dev", "aws/prod", "awsx"]
+        assert db.titles("aws", prefix="gcp") == []
+        assert db.titles(glob="*/prod") == ["aws/prod", "gcp/prod"]
+
+        # prefix lookups only walk the title index, blobs aren't touched
+        plans = query_plans(db.db.get_bind(), lambda: (db.titles(prefix="aws"), db.titles("aws/")))
+        assert len(plans) == 2 and all("SEARCH keys USING COVERING INDEX" in plan for plan in plans)
+
+    assert literal_prefix("aws/.*") == "aws/"
+    assert literal_prefix("abc?d") == "ab"
+    assert literal_prefix("a|b") == ""
+
+def test_notes_import_export(tmp_path):
+    notes = [NoteCreate(ty=NoteType.task, msg=f"note, {i}\nline", created_at=arrow.get(1600000000 + i), draft=False,
+        deadline=arrow.get(1700000000) if i % 2 else None, resources=["a", "b"] if i % 3 else [], refer_id=None,
+        completed=True if i % 2 else None) for i in range(25)]
+    with NoteDb() as db:
+        assert db.insert_many(iter(notes), batch_size=10) == 25
+        exported = list(db.iter_all(batch_size=7))
+    assert [note.msg for note in exported] == [note.msg for note in notes]
+    assert exported[1].deadline == arrow.get(1700000000) and exported[0].deadline is None
+
+    for name in ["notes.jsonl", "notes.csv"]:
+        output = runner.invoke(app, ["notes", "export", str(tmp_path/name)])
+        assert output.exit_code == 0
+        setup_function()
+        output = runner.invoke(app, ["notes", "import", str(tmp_path/name)])
+        assert output.exit_code == 0
+        with NoteDb() as db:
+            assert list(db.iter_all()) == exported
+
+def test_note_rows_match_pydantic():
+    notes = [NoteCreate(ty=NoteType.task, msg=f"note {i}", created_at=arrow.get(1600000000 + i), draft=False,
+        deadline=arrow.get(1700000000) if i % 2 else None, resources=["a"] if i % 2 else [], refer_id=None,
+        completed=True if i % 2 else None) for i in range(4)]
+    with NoteDb() as db:
+        db.insert_many(notes)
+        rows = list(db.iter_all())
+        validated = [db_note.to_pydantic() for db_note in db.db.query(DbNote).order_by(DbNote.id)]
+        assert [row.to_pydantic() for row in rows] == validated
+        assert db.get_recent(1)[0] == rows[-1]
+
+def test_notes_search():
+    def note(msg, ty=NoteType.think_block, created=1600000000):
+        return NoteCreate(ty=ty, msg=msg, created_at=arrow.get(created), draft=False, deadline=None, resources=[], refer_id=None, completed=None)
+
+    with NoteDb() as db:
+        db.insert_many([note("deploy api to staging"), note("deploy api to production", NoteType.task, 1700000000),
+            note("lunch with team"), note("c++ build broke, deployment blocked")])
+        assert sorted(m.note.msg for m in db.search("deploy api")) == ["deploy api to production", "deploy api to staging"]
+        assert [m.note.msg for m in db.search("deploy*", type=NoteType.task)] == ["deploy api to production"]
+        assert [m.note.msg for m in db.search("deploy", since=arrow.get(1650000000))] == ["deploy api to production"]
+        assert [m.note.msg for m in db.search("c++ broke")] == ["c++ build broke, deployment blocked"]
+        assert db.search("lunch")[0].highlighted == "[lunch] with team"
+        assert [m.note.msg for m in db.search("deploy NOT staging", raw=True)] == ["deploy api to production"]
+
+        # index follows updates and deletes
+        db.db.query(DbNote).filter(DbNote.msg == "lunch with team").update({"msg": "dinner with team"}, synchronize_session=False)
+        db.db.commit()
+        assert db.search("lunch") == []
+        assert len(db.search("dinner")) == 1
+        db.delete_by_id(db.search("dinner")[0].note.id)
+        assert db.search("dinner") == []
+
+        # databases from before the index are backfilled
+        db.db.execute("DROP TABLE notes_fts")
+        db.db.commit()
+        fts.create(db.db.get_bind())
+        assert len(db.search("deploy*")) == 3
+
+        # index without a trigger isn't taken for a whole one
+        db.db.execute("DROP TRIGGER notes_fts_update")
+        db.db.commit()
+        fts.create(db.db.get_bind())
+        db.db.query(DbNote).filter(DbNote.msg == "deploy api to staging").update({"msg": "deploy api to qa"}, synchronize_session=False)
+        db.db.commit()
+        assert [m.note.msg for m in db.search("qa")] == ["deploy api to qa"]
+        db.db.query(DbNote).filter(DbNote.msg == "deploy api to qa").update({"msg": "deploy api to staging"}, synchronize_session=False)
+        db.db.commit()
+
+    output = runner.invoke(app, ["notes", "search", "staging"])
+    assert output.exit_code == 0
+    assert "deploy api to [staging]" not in output.stdout
+    assert "deploy api to staging" in output.stdout
+
+def test_notes_show_pages():
+    # same created_at for some notes, id breaks the tie
+    notes = [NoteCreate(ty=NoteType.think_block, msg=f"note {i}", created_at=arrow.get(1600000000 + i // 3), draft=False,
+        deadline=None, resources=[], refer_id=None, completed=None) for i in range(30)]
+    with NoteDb() as db:
+        db.insert_many(notes)
+        newest = list(db.iter_recent(10, page_size=4))
+        assert [note.msg for note in newest] == [f"note {i}" for i in range(20, 30)]
+        older = list(db.iter_recent(10, before=note_cursor(newest[0]), page_size=3))
+        assert [note.msg for note in older] == [f"note {i}" for i in range(10, 20)]
+        newer = list(db.iter_recent(5, after=note_cursor(older[-1])))
+        assert [note.msg for note in newer] == [f"note {i}" for i in range(20, 25)]
+        assert list(db.iter_recent(100, before=note_cursor(older[0]))) == list(db.iter_all())[:10]
+
+    output = runner.invoke(app, ["notes", "show", "--limit", "3", "--before", note_cursor(newest[0])])
+    assert output.exit_code == 0
+    assert [line.split(" - ")[-1] for line in output.stdout.splitlines() if " - " in line] == ["note 17", "note 18", "note 19"]
+
+def make_note(msg="note", ty=NoteType.task, created_at=None, deadline=None, resources=None, refer_id=None, completed=None):
+    # created_at is anything arrow.get takes, now by default
+    return NoteCreate(ty=ty, msg=msg, created_at=arrow.utcnow() if created_at is None else arrow.get(created_at), draft=False,
+        deadline=deadline, resources=resources or [], refer_id=refer_id, completed=completed)
+
+@pytest.fixture
+def storage(request, tmp_path):
+    # parametrize with indirect=True to pick the backend, sqlite by default
+    backend = getattr(request, "param", "sqlite")
+    return create_storage(backend) if backend == "memory" else create_storage(backend, path=tmp_path/"notes.db")
+
+@pytest.mark.parametrize("storage", ["sqlite", "memory"], indirect=True)
+def test_note_thread(storage):
+    note = functools.partial(make_note, ty=NoteType.update)
+    with storage.notes() as db:
+        root = db.insert(note("root"))
+        a = db.insert(note("a", refer_id=root.id))
+        b = db.insert(note("b", refer_id=root.id))
+        a1 = db.insert(note("a1", refer_id=a.id))
+        db.insert(note("other"))
+        # wide thread comes back from one query
+        db.insert_all([note(f"b{i}", refer_id=b.id) for i in range(2000)])
+
+        thread = db.thread(root.id)
+        assert [(depth, row.msg) for depth, row in thread[:5]] == [(0, "root"), (1, "a"), (2, "a1"), (1, "b"), (2, "b0")]
+        assert len(thread) == 2004
+        assert [row.msg for _, row in db.thread(root.id, depth=1)] == ["root", "a", "b"]
+        assert [row.msg for _, row in db.thread(a1.id)] == ["a1"]
+        assert db.thread(10**9) == []
+
+    if isinstance(storage, SqliteStorage):
+        with storage.notes() as db:
+            plans = query_plans(storage.engine, lambda: db.thread(root.id))
+        assert len(plans) == 1 and "ix_notes_refer_id" in plans[0]
+
+    from nkit.notes_app import thread_lines
+    thread = [models.ThreadNote(depth, models.NoteRow(id, NoteType.update, str(id), datetime.datetime(2021, 1, 1), False, None, "", None, None))
+        for id, depth in enumerate([0, 1, 2, 2, 1, 2])]
+    assert [prefix for prefix, _ in thread_lines(thread)] == ["", "├── ", "│   ├── ", "│   └── ", "└── ", "    └── "]
+
+@pytest.mark.parametrize("backend", ["sqlite", "memory"])
+def test_due_notes(backend, tmp_path):
+    storage = create_storage(backend) if backend == "memory" else create_storage(backend, path=tmp_path/"notes.db")
+    now = arrow.utcnow()
+    def note(msg, deadline, completed=None):
+        return NoteCreate(ty=NoteType.task, msg=msg, created_at=now, draft=False, deadline=deadline,
+            resources=[], refer_id=None, completed=completed)
+    with storage.notes() as db:
+        late = db.insert(note("late", now.shift(days=-1)))
+        db.insert(note("done", now.shift(days=-2), completed=True))
+        db.insert(note("soon", now.shift(days=1)))
+        db.insert(note("later", now.shift(days=30)))
+        db.insert(note("whenever", None))
+
+        assert [row.msg for row in db.due(before=now.shift(days=7).naive)] == ["late", "soon"]
+        assert [row.msg for row in db.due(before=now.naive)] == ["late"]
+        assert [row.msg for row in db.due(after=now.naive)] == ["soon", "later"]
+        assert db.complete(late.id).completed is True
+        assert [row.msg for row in db.due(before=now.naive)] == []
+        assert db.get_note(late.id).completed is True
+        with pytest.raises(CrudException):
+            db.complete(10**9)
+
+    if backend == "sqlite":
+        with storage.notes() as db:
+            plans = query_plans(storage.engine, lambda: (db.due(before=now.naive), db.due(after=now.naive, limit=10)))
+        assert len(plans) == 2 and all("ix_notes_open_deadline" in plan for plan in plans)
+
+@pytest.mark.parametrize("backend", ["sqlite", "memory"])
+def test_note_stats(backend, tmp_path):
+    storage = create_storage(backend) if backend == "memory" else create_storage(backend, path=tmp_path/"notes.db")
+    start = arrow.get("2021-03-01T23:30:00")
+    def note(ty, days):
+        return NoteCreate(ty=ty, msg="x", created_at=start.shift(days=days), draft=False, deadline=None,
+            resources=[], refer_id=None, completed=None)
+    day = lambda days: start.shift(days=days).date()
+    with storage.notes() as db:
+        db.insert_all([note(NoteType.habit, days) for days in [0, 1, 2, 4, 5]] + [note(NoteType.think_block, 0)])
+        db.insert_many([note(NoteType.habit, 0), note(NoteType.update, 5)])
+        extra = db.insert(note(NoteType.habit, 6))
+        db.delete_by_id(extra.id)
+
+        counts = db.daily_counts()
+        assert counts[:2] == [models.DayCount(day(0), NoteType.habit, 2), models.DayCount(day(0), NoteType.think_block, 1)]
+        assert stats.totals(counts) == {NoteType.habit: 6, NoteType.think_block: 1, NoteType.update: 1}
+        assert db.daily_counts(since=day(5), type=NoteType.habit) == [models.DayCount(day(5), NoteType.habit, 1)]
+        assert stats.streaks(stats.per_day(db.daily_counts(type=NoteType.habit)), day(6)) == (2, 3)
+        assert stats.streaks([day(0)], day(6)) == (0, 1)
+        # 2021-03-01 is a monday
+        assert stats.per_week(stats.per_day(counts)) == {day(0): 8}
+        db.rebuild_stats()
+        assert db.daily_counts() == counts
+
+    if backend == "sqlite":
+        # databases from before the rollup are counted when it's created
+        with storage.engine.begin() as conn:
+            conn.exec_driver_sql("DROP TABLE notes_daily")
+            for trigger in ["insert", "delete", "update"]:
+                conn.exec_driver_sql(f"DROP TRIGGER notes_daily_{trigger}")
+        with SqliteStorage(tmp_path/"notes.db").notes() as db:
+            assert db.daily_counts() == counts
+        # a half schema isn't taken for a whole one, it's completed and recounted
+        with storage.engine.begin() as conn:
+            conn.exec_driver_sql("DROP TRIGGER notes_daily_update")
+            conn.exec_driver_sql("DELETE FROM notes_daily")
+        with SqliteStorage(tmp_path/"notes.db").notes() as db:
+            assert db.daily_counts() == counts
+        # failing statement leaves nothing behind, ddl is in the transaction
+        with pytest.raises(OperationalError):
+            schema.create(storage.engine, ["CREATE TABLE IF NOT EXISTS half (a)", "CREATE TRIGGER IF NOT EXISTS half_t AFTER INSERT ON nope BEGIN SELECT 1; END"])
+        with storage.engine.connect() as conn:
+            assert schema.missing(conn, ["half"]) == {"half"}
+
+def test_reminders(tmp_path):
+    from nkit.reminders import Reminders
+    storage = SqliteStorage(tmp_path/"notes.db")
+    # schema is created on first open, not counted into deadlines below
+    with storage.notes():
+        pass
+    now = arrow.utcnow()
+    def note(msg, deadline):
+        return NoteCreate(ty=NoteType.task, msg=msg, created_at=now, draft=False, deadline=deadline,
+            resources=[], refer_id=None, completed=None)
+    with storage.notes() as db:
+        soon = db.insert(note("soon", now.shift(seconds=1)))
+        done = db.insert(note("done before due", now.shift(seconds=0.2)))
+        db.insert(note("far", now.shift(days=1)))
+        db.complete(done.id)
+    reminded = []
+    reminders = Reminders(storage, notify=lambda row: reminded.append(row.msg))
+
+    async def scenario():
+        task = aio.ensure_future(reminders.run())
+        await aio.sleep(0.1)
+        # loaded once, sleeping until the earliest deadline
+        assert sorted(deadline for deadline, _ in reminders.heap)[0] == soon.deadline.to("utc").naive
+        assert 0 < reminders.sleep_time(datetime.datetime.utcnow()) < 1
+        with storage.notes() as db:
+            added = db.insert(note("added through agent", arrow.utcnow().shift(seconds=0.1)))
+        reminders.add(added.id, added.deadline.to("utc").naive)
+        await aio.sleep(1.5)
+        task.cancel()
+
+    aio.run(scenario())
+    assert reminded == ["added through agent", "soon"]
+    assert len(reminders.heap) == 1
+
+@pytest.mark.parametrize("backend", ["sqlite", "sqlite-wal", "memory"])
+def test_storage_backends(backend, tmp_path):
+    storage = create_storage(backend) if backend == "memory" else create_storage(backend, path=tmp_path/"notes.db")
+    notes = [NoteCreate(ty=NoteType.task if i % 2 else NoteType.update, msg=f"backend note {i}", created_at=arrow.get(1600000000 + i // 2),
+        draft=False, deadline=None, resources=[], refer_id=None, completed=None) for i in range(20)]
+    with storage.notes() as db:
+        assert db.insert_many(notes[1:]) == 19
+        first = db.insert(notes[0])
+        assert [note.msg for note in db.iter_all()][-1] == "backend note 0"
+        newest = list(db.iter_recent(5))
+        assert [note.msg for note in newest] == [f"backend note {i}" for i in range(15, 20)]
+        assert [note.msg for note in db.iter_recent(2, before=note_cursor(newest[0]))] == ["backend note 13", "backend note 14"]
+        assert [note.msg for note in db.get_recent(2)] == ["backend note 19", "backend note 18"]
+        assert [m.note.msg for m in db.search("note 7")] == ["backend note 7"]
+        assert [m.note.msg for m in db.search("backend", type=NoteType.update, since=arrow.get(1600000009))] == ["backend note 18"]
+        db.delete_by_id(first.id)
+        with pytest.raises(CrudException):
+            db.delete_by_id(first.id)
+    with storage.secrets() as db:
+        for title in ["b/2", "a/1", "a/2"]:
+            db.insert(SecretCreate(title=title, data=title.encode()))
+        assert db.titles(prefix="a/") == ["a/1", "a/2"]
+        assert db.titles(glob="*2") == ["a/2", "b/2"]
+        assert db.get_secret("b/2").data == b"b/2"
+        assert db.delete_all() == 3
+        assert db.titles() == []
+
+    # backend missing a method fails when it's made, not when the method is first called
+    class Partial(NoteStore):
+        def insert(self, note):
+            pass
+    with pytest.raises(TypeError, match="abstract"):
+        Partial()
+
+def test_sync(monkeypatch, tmp_path):
+    def note(msg, created):
+        return NoteCreate(ty=NoteType.task, msg=msg, created_at=arrow.get(created), draft=False, deadline=None, resources=[], refer_id=None, completed=None)
+
+    def fresh_machine():
+        with SyncDb() as db:
+            db.db.query(DbNote).delete()
+            db.db.query(DbSecret).delete()
+            db.db.commit()
+            for kind in sync.KINDS:
+                db.forget_deleted(kind)
+
+    fresh_machine()
+    remote = sync.DirectoryRemote(tmp_path/"remote")
+    # remote without master key methods fails when it's made
+    class NoMaster(sync.DirectoryRemote):
+        master = store_master = sync.Remote.master
+    with pytest.raises(TypeError, match="abstract"):
+        NoMaster(tmp_path/"remote")
+    with NoteDb() as db:
+        db.insert_many([note("first", 1600000000), note("second", 1600000001), note("reply", 1600000002)])
+        first = db.db.query(DbNote).filter(DbNote.msg == "first").one()
+        db.db.query(DbNote).filter(DbNote.msg == "reply").update({"refer_id": first.id})
+        db.db.commit()
+    with SecretDb() as db:
+        db.insert(SecretCreate(title="sync/a", data=b"encrypted a"))
+
+    output = runner.invoke(app, ["sync", "--remote", str(tmp_path/"remote"), "status"])
+    assert output.exit_code == 0
+    assert "notes: 3 to push, 0 to pull" in output.stdout
+    output = runner.invoke(app, ["sync", "--remote", str(tmp_path/"remote"), "push"])
+    assert "notes: 3 sent" in output.stdout and "keys: 1 sent" in output.stdout
+    with SyncDb() as db:
+        assert all(sync.diff(db, remote, kind).in_sync for kind in sync.KINDS)
+    synced = get_storage().get_latest_hash()
+
+    # second machine gets everything, including which note the reply refers to
+    fresh_machine()
+    with SyncDb() as db:
+        assert sync.pull(db, remote, "notes").received == 3
+        assert sync.pull(db, remote, "keys").received == 1
+    assert get_storage().get_latest_hash() == synced
+    with NoteDb() as db:
+        reply = db.db.query(DbNote).filter(DbNote.msg == "reply").one()
+        assert db.db.query(DbNote).get(reply.refer_id).msg == "first"
+
+    # deletion and a new note travel as one tombstone and one record
+    with NoteDb() as db:
+        db.delete_by_id(db.db.query(DbNote).filter(DbNote.msg == "second").one().id)
+        db.insert(note("third", 1600000003))
+    with SyncDb() as db:
+        changes = sync.diff(db, remote, "notes")
+        assert (len(changes.push), len(changes.push_deletes), len(changes.pull)) == (1, 1, 0)
+        assert sync.push(db, remote, "notes", changes)[:3] == (1, 0, 1)
+
+    # first machine again, learns about both without resurrecting deleted note
+    fresh_machine()
+    with SyncDb() as db:
+        remote.trees.clear()
+        sync.pull(db, remote, "notes")
+        sync.pull(db, remote, "keys")
+        assert sync.diff(db, remote, "notes").in_sync
+        # another key under same title, made before ever pulling it
+        db.remove("keys", db.hashes("keys"))
+        db.forget_deleted("keys")
+        with SecretDb() as secrets:
+            secrets.insert(SecretCreate(title="sync/a", data=b"other"))
+        assert len(sync.pull(db, remote, "keys").conflicts) == 1
+    with NoteDb() as db:
+        assert sorted(n.msg for n in db.iter_all()) == ["first", "reply", "third"]
+
+    # a corrupted remote record is refused
+    fresh_machine()
+    leaf = next((tmp_path/"remote"/"notes").glob("*.json.gz"))
+    with gzip.open(leaf, "rt") as f:
+        stored = json.load(f)
+    for record in stored.values():
+        record["msg"] = "tampered"
+    with gzip.open(leaf, "wt") as f:
+        json.dump(stored, f)
+    with SyncDb() as db:
+        with pytest.raises(SyncError):
+            sync.pull(db, sync.DirectoryRemote(tmp_path/"remote"), "notes")
+
+    # a half sync schema is completed when the database is opened again
+    with SqliteStorage(tmp_path/"half.db").engine.begin() as conn:
+        conn.exec_driver_sql("DROP TRIGGER notes_sync_delete")
+    with SqliteStorage(tmp_path/"half.db").engine.connect() as conn:
+        assert not schema.missing(conn, ["sync_deleted", "notes_sync_delete", "keys_sync_insert"])
+
+    # secrets are encrypted to a random master key, it travels with them so same password opens them elsewhere
+    from nkit import keys_app
+    keys = functools.lru_cache()(lambda password: generate_rsa_key(password.encode(), 512))
+    monkeypatch.setattr(keys_app, "derive_key", keys)
+    shared = ["sync", "--remote", str(tmp_path/"shared")]
+    def machine(name):
+        fresh_machine()
+        for attr, file in [("KEY_PATH", "pub.pem"), ("MASTER_PATH", "master.key"), ("VERIFIER_PATH", "pub.verifier")]:
+            monkeypatch.setattr(keys_app, attr, tmp_path/name/file)
+    def invoke(*args):
+        output = runner.invoke(app, list(args))
+        assert output.exit_code == 0, output.stdout
+        return output.stdout
+
+    machine("a")
+    invoke("keys", "init", "--password", "pw")
+    invoke("keys", "add", "from a", "--title", "shared/secret")
+    assert "master key: sent" in invoke(*shared, "push")
+    # pulled before init, init opens pulled master key instead of making one
+    machine("b")
+    assert "master key: installed" in invoke(*shared, "pull")
+    invoke("keys", "init", "--password", "pw")
+    assert invoke("keys", "get", "shared/secret", "--password", "pw").strip() == "from a"
+    # initialized before pull, own master key has nothing encrypted to it yet
+    machine("c")
+    invoke("keys", "init", "--password", "pw")
+    assert "master key: installed" in invoke(*shared, "pull")
+    assert invoke("keys", "get", "shared/secret", "--password", "pw").strip() == "from a"
+    # keys of two master keys don't mix
+    machine("d")
+    invoke("keys", "init", "--password", "pw")
+    invoke("keys", "add", "from d", "--title", "shared/other")
+    assert runner.invoke(app, shared + ["push"]).exit_code != 0
+
+def test_remote_storage():
+    notes = [NoteCreate(ty=NoteType.update, msg=f"remote {i}", created_at=arrow.get(1600000000 + i), draft=False,
+        deadline=arrow.get(1700000000) if i == 1 else None, resources=["r"] if i == 2 else [], refer_id=None, completed=None) for i in range(250)]
+
+    async def exercise(url):
+        async with RemoteNoteDb(url, concurrency=4, backoff=0.01) as db:
+            first = await db.insert(notes[0])
+            assert first.id == 1
+            assert await db.insert_many(notes[1:], batch_size=20) == 249
+            everything = [note async for note in db.iter_all(batch_size=100)]
+            assert sorted(note.msg for note in everything) == sorted(note.msg for note in notes)
+            recent = await db.get_recent(3)
+            # newest first, like local get_recent
+            assert [note.msg for note in recent] == ["remote 249", "remote 248", "remote 247"]
+            assert next(n for n in everything if n.msg == "remote 1").deadline == arrow.get(1700000000)
+            assert next(n for n in everything if n.msg == "remote 2").resources == ["r"]
+            await db.delete_by_id(first.id)
+            with pytest.raises(CrudException):
+                await db.delete_by_id(first.id)
+        async with RemoteSecretDb(url) as db:
+            await db.insert(SecretCreate(title="remote/a b", data=b"\x00secret"))
+            await db.insert(SecretCreate(title="remote/c", data=b"other"))
+            with pytest.raises(CrudException):
+                await db.insert(SecretCreate(title="remote/c", data=b"again"))
+            assert await db.titles(prefix="remote/") == ["remote/a b", "remote/c"]
+            assert (await db.get_secret("remote/a b")).data == b"\x00secret"
+            await db.delete_by_title("remote/a b")
+            assert await db.get_secret("remote/a b") is None
+
+    with running_server() as server:
+        aio.run(exercise(server.url))
+        # batches reuse kept alive connections
+        assert server.connections <= 4 + 1
+
+    async def retried(url):
+        async with RemoteNoteDb(url, backoff=0.01, retries=3) as db:
+            return await db.insert_many(notes[:10])
+
+    with running_server() as server:
+        server.fail_next = 3
+        assert aio.run(retried(server.url)) == 10
+        assert len(server.store.notes) == 10
+        server.fail_next = 4
+        with pytest.raises(RemoteError):
+            aio.run(retried(server.url))
+
+    async def failed_upload(url):
+        async with RemoteNoteDb(url, concurrency=4, retries=0) as db:
+            with pytest.raises(RemoteError):
+                await db.insert_many(notes, batch_size=10)
+            # batches in flight when one failed are cancelled, none is left running
+            assert aio.all_tasks() == {aio.current_task()}
+
+    with running_server() as server:
+        server.fail_next = 1
+        server.delay = 0.05
+        aio.run(failed_upload(server.url))
+
+    with running_server() as server:
+        # retry arriving while the original is still applied gets its response instead of applying again
+        apply = server.store.route
+        server.store.route = lambda *args: time.sleep(0.2) or apply(*args)
+        record = notes_io.to_record(notes[0])
+        record.pop("id")
+        post = lambda _: httpx.post(server.url + "/notes", json=[record], headers={"Idempotency-Key": "same"}).json()
+        with ThreadPoolExecutor(2) as pool:
+            assert len(set(json.dumps(response) for response in pool.map(post, range(2)))) == 1
+        assert len(server.store.notes) == 1
+
+        # NKIT_STORAGE=remote, same api behind the sync storage interface
+        storage = create_storage("remote", url=server.url)
+        with storage.notes() as db:
+            # batches are uploaded concurrently, ids needn't follow their order
+            db.insert_many(notes[1:6], batch_size=2)
+            assert sorted(note.msg for note in db.iter_all(batch_size=4)) == [f"remote {i}" for i in range(6)]
+            assert [note.msg for note in db.get_recent(2)] == ["remote 5", "remote 4"]
+            newest = list(db.iter_recent(3))
+            assert [note.msg for note in newest] == ["remote 3", "remote 4", "remote 5"]
+            assert [note.msg for note in db.iter_recent(2, before=note_cursor(newest[0]))] == ["remote 1", "remote 2"]
+            assert [note.msg for note in db.iter_recent(5, after=note_cursor(newest[0]))] == ["remote 4", "remote 5"]
+            assert db.get_note(newest[0].id).msg == "remote 3" and db.get_note(10**9) is None
+            # replayed journal isn't uploaded twice
+            assert db.insert_new(notes[4:8]) == 2
+            # what the api can't do fails with a message, not a bare NotImplementedError
+            with pytest.raises(CrudException, match="isn't supported by remote storage"):
+                db.due()
+            db.delete_by_id(1)
+        with storage.secrets() as db:
+            db.insert(SecretCreate(title="remote/s", data=b"s"))
+            assert [secret.data for secret in db.get_secrets("remote/")] == [b"s"]
+            with pytest.raises(CrudException, match="isn't supported by remote storage"):
+                db.update_all([])
+            assert db.delete_all() == 1 and db.titles() == []
+
+def write_and_read_notes(path, socket_path, writes, worker):
+    # runs in its own process
+    storage = SqliteStorage(Path(path))
+    latencies = []
+    for i in range(writes):
+        note = NoteCreate(ty=NoteType.update, msg=f"worker {worker} note {i}", created_at=arrow.utcnow(), draft=False,
+            deadline=None, resources=[], refer_id=None, completed=None)
+        start = time.perf_counter()
+        if socket_path:
+            AgentClient(Path(socket_path)).note(note)
+        else:
+            with storage.notes() as db:
+                db.insert(note)
+        with storage.notes() as db:
+            assert len(list(db.iter_recent(5))) > 0
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+@pytest.mark.skipif(sys.platform == "win32", reason="agent needs unix sockets")
+def test_concurrent_writers(tmp_path):
+    storage = SqliteStorage(tmp_path/"notes.db")
+    with storage.engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+
+    socket_path = tmp_path/"agent.sock"
+    server = threading.Thread(target=Agent(generate_rsa_key(b"Hyy3", 512), socket_path, storage=storage).run)
+    server.start()
+    while not AgentClient(socket_path).available():
+        time.sleep(0.05)
+    try:
+        with multiprocessing.get_context("spawn").Pool(4) as pool:
+            direct = pool.starmap(write_and_read_notes, [(str(tmp_path/"notes.db"), None, 15, i) for i in range(4)])
+            queued = pool.starmap(write_and_read_notes, [(str(tmp_path/"notes.db"), str(socket_path), 15, i) for i in range(4)])
+    finally:
+        AgentClient(socket_path).stop()
+        server.join(5)
+    assert len(sum(direct, [])) == len(sum(queued, [])) == 60
+    with storage.notes() as db:
+        assert len(list(db.iter_all())) == 120
+
+def test_write_queue_coalesces(tmp_path):
+    storage = SqliteStorage(tmp_path/"notes.db")
+    commits = []
+    event.listen(storage.engine, "commit", lambda conn: commits.append(1))
+    queue = WriteQueue(storage)
+    notes = [NoteCreate(ty=NoteType.update, msg=f"queued {i}", created_at=arrow.get(1600000000 + i), draft=False,
+        deadline=None, resources=[], refer_id=None, completed=None) for i in range(200)]
+    with ThreadPoolExecutor(16) as pool:
+        saved = list(pool.map(queue.insert, notes))
+    queue.close()
+    assert sorted(note.msg for note in saved) == sorted(note.msg for note in notes)
+    assert len({note.id for note in saved}) == 200
+    assert len(commits) < 200
+
+def test_note_journal(monkeypatch, tmp_path):
+    storage = SqliteStorage(tmp_path/"notes.db")
+    path = tmp_path/"notes.journal"
+    records = [journal.note_record(f"journaled {i}", NoteType.think_block) for i in range(5)]
+    for record in records[:3]:
+        journal.append(record, path)
+    # crash in the middle of an append
+    with open(path, "ab") as f:
+        f.write(b'{"ty": "think", "ms')
+    for record in records[3:]:
+        journal.append(record, path)
+    copy = path.read_bytes()
+
+    assert journal.fold(storage, path) == 5
+    assert not journal.pending(path)
+    # crashed after commit, before journal was emptied
+    path.write_bytes(copy)
+    assert journal.fold(storage, path) == 0
+    with storage.notes() as db:
+        assert sorted(note.msg for note in db.iter_all()) == [record["msg"] for record in records]
+    # backends without content hashes replay without duplicates too
+    memory = create_storage("memory")
+    for inserted in [5, 0]:
+        path.write_bytes(copy)
+        assert journal.fold(memory, path) == inserted
+    with memory.notes() as db:
+        assert sorted(note.msg for note in db.iter_all()) == [record["msg"] for record in records]
+
+    monkeypatch.setattr("nkit.constants.NOTE_JOURNAL", True)
+    monkeypatch.setattr(journal, "JOURNAL_PATH", path)
+    # deadline is read like `notes create` reads it, a malformed one is a usage error
+    output = runner.invoke(app, ["note", "x", "--deadline", "someday"])
+    assert output.exit_code == 2 and "--deadline" in output.output
+    assert runner.invoke(app, ["note", "journaled for sync", "--deadline", "2030/01/31"]).exit_code == 0
+    assert journal.read(path.read_bytes())[-1]["deadline"] == arrow.get("2030/01/31").isoformat()
+    # sync sees journaled notes
+    output = runner.invoke(app, ["sync", "--remote", str(tmp_path/"remote"), "status"])
+    assert output.exit_code == 0 and "notes: in sync" not in output.stdout
+    assert not journal.pending(path)
+    with NoteDb() as db:
+        assert db.db.query(DbNote).filter(DbNote.msg == "journaled for sync").count() == 1
+
+def test_startup_import_budget():
+    # cold `nkit --help` must not pull in heavy dependencies, budget can be raised on slow machines
+    budget_ms = float(os.environ.get("NKIT_STARTUP_BUDGET_MS", "500"))
+    script = "import sys; sys.argv = ['nkit', '--help']; from nkit.main import app; app()"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", script], capture_output=True, text=True,
+        cwd=Path(__file__).parent.parent, env={**os.environ, "TESTING": "1"})
+    assert result.returncode == 0, result.stderr
+    assert "keys" in result.stdout
+
+    imported = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line and "self [us]" not in line:
+            _, cumulative, name = line.split("|")
+            # one space after "|" for top level imports, more for nested ones
+            imported[name.rstrip()[1:]] = int(cumulative)
+    names = {name.strip() for name in imported}
+    for heavy in ["sqlalchemy", "Crypto", "pydantic", "arrow", "nkit.storage.local", "nkit.keys_app"]:
+        assert heavy not in names, f"{heavy} imported on startup"
+
+    top_level_ms = sum(cumulative for name, cumulative in imported.items() if not name.startswith(" ")) / 1000
+    assert top_level_ms < budget_ms, f"imports took {top_level_ms:.0f}ms, budget {budget_ms:.0f}ms"